@@ -3,6 +3,7 @@ from typing import Any, Dict, List, Optional, Type
 
 from app.agents.tools.base import BaseTool
 from app.repositories.models.custom_bot import BotModel
+from app.rerank import rerank_for_bot
 from app.vector_search import SearchResult, search_related_docs
 from langchain_core.callbacks import CallbackManagerForToolRun
 from langchain_core.language_models import BaseLanguageModel
@@ -137,6 +138,7 @@ class AnswerWithKnowledgeTool(BaseTool):
                 self.bot,
                 query=query,
             )
+            search_results = rerank_for_bot(self.bot, query, search_results)
 
         context_prompt = self._format_search_results(search_results)
         output = self.llm_chain.invoke({"context": context_prompt, "query": query})
@@ -1,29 +1,51 @@
-import base64
 import json
 import logging
 import os
+import random
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from typing import TypedDict, no_type_check
+from typing import NotRequired, TypedDict, no_type_check
 
-from app.config import BEDROCK_PRICING, DEFAULT_EMBEDDING_CONFIG
+from app.config import (
+    BEDROCK_PRICING,
+    DEFAULT_EMBEDDING_CONFIG,
+    EMBEDDING_CHARS_PER_TOKEN,
+    EMBEDDING_PRICING,
+)
 from app.config import DEFAULT_GENERATION_CONFIG as DEFAULT_CLAUDE_GENERATION_CONFIG
 from app.config import DEFAULT_MISTRAL_GENERATION_CONFIG
+from app.embedding_cache import compose_cache_key, get_query_embedding_cache
+from app.repositories.content_blob import load_content_bytes
 from app.repositories.models.conversation import MessageModel
 from app.repositories.models.custom_bot import GenerationParamsModel
+from app.region_router import get_region_router
 from app.routes.schemas.conversation import type_model_name, real_model_name
-from app.utils import convert_dict_keys_to_camel_case, get_bedrock_client, rename_model_id, get_model_id
+from app.utils import (
+    convert_dict_keys_to_camel_case,
+    get_bedrock_client,
+    get_bedrock_region,
+    get_model_id,
+    rename_model_id,
+)
+from botocore.exceptions import ClientError
 
 logger = logging.getLogger(__name__)
 
-DEFAULT_BEDROCK_REGION = '''{
-    "claude-v3-sonnet": "us-east-2",
-    "claude-v3.5-sonnet": "us-east-1",
-    "claude-v3-opus": "us-west-2",
-    "default": "us-west-2"
-}'''
-BEDROCK_REGION = os.environ.get("BEDROCK_REGION", DEFAULT_BEDROCK_REGION)
-BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
+# Cohere Embed on Bedrock accepts up to 96 texts per request.
+# Ref: https://docs.aws.amazon.com/bedrock/latest/userguide/model-parameters-embed.html
+EMBEDDING_MAX_TEXTS_PER_REQUEST = 96
+# Each text is limited to 2048 characters.
+EMBEDDING_MAX_CHARS_PER_TEXT = 2048
+# Upper bound of total characters per request to keep the payload bounded.
+EMBEDDING_MAX_CHARS_PER_REQUEST = (
+    EMBEDDING_MAX_TEXTS_PER_REQUEST * EMBEDDING_MAX_CHARS_PER_TEXT
+)
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get("EMBEDDING_MAX_CONCURRENCY", 4))
+EMBEDDING_MAX_RETRIES = 8
+EMBEDDING_RETRY_BASE_DELAY_SEC = 0.5
 
 ENABLE_MISTRAL = os.environ.get("ENABLE_MISTRAL", "") == "true"
 DEFAULT_GENERATION_CONFIG = (
@@ -62,6 +84,8 @@ class ConverseApiResponse(TypedDict):
     output: ConverseApiResponseOutput
     stopReason: str
     usage: ConverseApiResponseUsage
+    # Region which served the request, set by `call_converse_api`
+    region: NotRequired[str]
 
 def compose_args(
     messages: list[MessageModel],
@@ -128,8 +152,8 @@ def compose_args_for_converse_api(
                         {
                             "image": {
                                 "format": format,
-                                # decode base64 encoded image
-                                "source": {"bytes": base64.b64decode(c.body)},
+                                # decode base64 encoded image, or fetch the blob
+                                "source": {"bytes": load_content_bytes(c)},
                             }
                         }
                     )
@@ -145,7 +169,7 @@ def compose_args_for_converse_api(
                                 "name": Path(
                                     _convert_to_valid_file_name(c.file_name)
                                 ).stem,  # e.g. "document.txt" -> "document"
-                                "source": {"bytes": base64.b64decode(c.body)},
+                                "source": {"bytes": load_content_bytes(c)},
                             }
                         }
                     )
@@ -191,16 +215,16 @@ def call_converse_api(args: ConverseApiRequest) -> ConverseApiResponse:
 
     model_id = args["model_id"]
     model_name = rename_model_id(model_id)
-    BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
-    client = get_bedrock_client(BEDROCK_REGION_JSON[model_name])
 
-    response= client.converse(
+    response, region = get_region_router().converse(
+        model_name,
         modelId=model_id,
         messages=messages,
         inferenceConfig=inference_config,
         system=system,
         additionalModelRequestFields=additional_model_request_fields,
     )
+    response["region"] = region
 
     return response
 
@@ -208,11 +232,13 @@ def calculate_price(
     model: type_model_name,
     input_tokens: int,
     output_tokens: int,
-    region: str = BEDROCK_REGION,
+    region: str | None = None,
 ) -> float:
-    model_name = rename_model_id(model)
-    BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
-    region = BEDROCK_REGION_JSON[model_name]
+    """Price of the tokens in the region which served them. Defaults to the primary
+    region of the model.
+    """
+    if region is None:
+        region = get_bedrock_region(rename_model_id(model))
 
     input_price = (
         BEDROCK_PRICING.get(region, {})
@@ -227,12 +253,27 @@ def calculate_price(
 
     return input_price * input_tokens / 1000.0 + output_price * output_tokens / 1000.0
 
+
+def calculate_embedding_price(
+    text: str, model_id: str = DEFAULT_EMBEDDING_CONFIG["model_id"]
+) -> float:
+    """Estimated price of embedding the text, by its length."""
+    input_tokens = -(-len(text) // EMBEDDING_CHARS_PER_TOKEN)
+    return EMBEDDING_PRICING[model_id] * input_tokens / 1000.0
+
 def calculate_query_embedding(question: str) -> list[float]:
     model_id = DEFAULT_EMBEDDING_CONFIG["model_id"]
 
     # Currently only supports "cohere.embed-multilingual-v3"
     assert model_id == "cohere.embed-multilingual-v3"
 
+    # The same question is often embedded several times (e.g. related documents and chat)
+    cache = get_query_embedding_cache()
+    cache_key = compose_cache_key(model_id, question)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     payload = json.dumps({"texts": [question], "input_type": "search_query"})
     accept = "application/json"
     content_type = "application/json"
@@ -242,33 +283,116 @@ def calculate_query_embedding(question: str) -> list[float]:
     )
     output = json.loads(response.get("body").read())
     embedding = output.get("embeddings")[0]
+    cache.put(cache_key, embedding)
 
     return embedding
 
-def calculate_document_embeddings(documents: list[str]) -> list[list[float]]:
-    def _calculate_document_embeddings(documents: list[str]) -> list[list[float]]:
-        payload = json.dumps({"texts": documents, "input_type": "search_document"})
-        accept = "application/json"
-        content_type = "application/json"
-
-        response = client.invoke_model(
-            accept=accept, contentType=content_type, body=payload, modelId=model_id
-        )
-        output = json.loads(response.get("body").read())
-        embeddings = output.get("embeddings")
-
-        return embeddings
+class _AdaptiveConcurrencyLimiter:
+    """Limit concurrent requests. The limit is halved on throttling and
+    recovers one by one on success (AIMD).
+    """
 
-    BATCH_SIZE = 10
+    def __init__(self, max_limit: int):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self._active >= self.limit:
+                self._condition.wait()
+            self._active += 1
+
+    def release(self, throttled: bool):
+        with self._condition:
+            self._active -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+            else:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self._condition.notify_all()
+
+
+def _split_into_batches(documents: list[str]) -> list[tuple[int, list[str]]]:
+    """Split documents into batches which fill each request up to the model limits.
+    Returns the start index of each batch and the batch itself.
+    """
+    batches: list[tuple[int, list[str]]] = []
+    start = 0
+    batch: list[str] = []
+    batch_chars = 0
+    for i, document in enumerate(documents):
+        if batch and (
+            len(batch) >= EMBEDDING_MAX_TEXTS_PER_REQUEST
+            or batch_chars + len(document) > EMBEDDING_MAX_CHARS_PER_REQUEST
+        ):
+            batches.append((start, batch))
+            start, batch, batch_chars = i, [], 0
+        batch.append(document)
+        batch_chars += len(document)
+    if batch:
+        batches.append((start, batch))
+    return batches
+
+
+def calculate_document_embeddings(
+    documents: list[str], max_concurrency: int = EMBEDDING_MAX_CONCURRENCY
+) -> list[list[float]]:
+    """Calculate embeddings of the documents.
+    Batches are sent concurrently with adaptive back-off on throttling.
+    The order of the returned embeddings is the same as `documents`.
+    """
     model_id = DEFAULT_EMBEDDING_CONFIG["model_id"]
 
     # Currently only supports "cohere.embed-multilingual-v3"
     assert model_id == "cohere.embed-multilingual-v3"
 
-    embeddings = []
-    for i in range(0, len(documents), BATCH_SIZE):
-        # Split documents into batches to avoid exceeding the payload size limit
-        batch = documents[i : i + BATCH_SIZE]
-        embeddings += _calculate_document_embeddings(batch)
+    limiter = _AdaptiveConcurrencyLimiter(max_concurrency)
+
+    def _calculate_document_embeddings(documents: list[str]) -> list[list[float]]:
+        payload = json.dumps({"texts": documents, "input_type": "search_document"})
+        accept = "application/json"
+        content_type = "application/json"
+
+        for attempt in range(EMBEDDING_MAX_RETRIES):
+            limiter.acquire()
+            try:
+                response = client.invoke_model(
+                    accept=accept,
+                    contentType=content_type,
+                    body=payload,
+                    modelId=model_id,
+                )
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ThrottlingException":
+                    limiter.release(throttled=False)
+                    raise
+                limiter.release(throttled=True)
+                delay = EMBEDDING_RETRY_BASE_DELAY_SEC * (2**attempt)
+                logger.warning(
+                    f"Embedding throttled. Retrying in {delay:.1f}s (limit: {limiter.limit})"
+                )
+                time.sleep(delay * (1 + random.random()))
+                continue
+            limiter.release(throttled=False)
+            output = json.loads(response.get("body").read())
+            return output.get("embeddings")
+
+        raise RuntimeError(
+            f"Embedding was throttled {EMBEDDING_MAX_RETRIES} times in a row"
+        )
 
-    return embeddings
\ No newline at end of file
+    batches = _split_into_batches(documents)
+    embeddings: list[list[float]] = [[] for _ in documents]
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = {
+            executor.submit(_calculate_document_embeddings, batch): start
+            for start, batch in batches
+        }
+        for future in as_completed(futures):
+            start = futures[future]
+            for i, embedding in enumerate(future.result()):
+                embeddings[start + i] = embedding
+
+    return embeddings
@@ -12,6 +12,7 @@ from app.repositories.api_publication import (
 from app.repositories.common import RecordNotFoundError, decompose_bot_id
 from aws_lambda_powertools.utilities import parameters
 from app.repositories.custom_bot import find_public_bot_by_id
+from app.vector_index import drop_bot_index
 
 DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "documents")
@@ -37,7 +38,12 @@ def delete_from_postgres(bot_id: str):
         with conn.cursor() as cursor:
             delete_query = "DELETE FROM items WHERE botid = %s"
             cursor.execute(delete_query, (bot_id,))
+            # Fingerprints of sources used by incremental sync of the embedding job
+            cursor.execute("SELECT to_regclass('item_sources')")
+            if cursor.fetchone()[0] is not None:
+                cursor.execute("DELETE FROM item_sources WHERE botid = %s", (bot_id,))
         conn.commit()
+        drop_bot_index(conn, bot_id)
         print(f"Successfully deleted records for bot_id: {bot_id}")
     except Exception as e:
         conn.rollback()
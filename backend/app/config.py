@@ -49,6 +49,7 @@ DEFAULT_EMBEDDING_CONFIG: EmbeddingConfig = {
 # Configure search parameter to fetch relevant documents from vector store.
 DEFAULT_SEARCH_CONFIG = {
     "max_results": 20,
+    "search_type": "vector",
 }
 
 # Used for price estimation.
@@ -114,3 +115,11 @@ BEDROCK_PRICING = {
         "mistral-large": {"input": 0.008, "output": 0.024},
     },
 }
+
+# Price of embedding models per 1,000 input tokens.
+# See: https://aws.amazon.com/bedrock/pricing/
+EMBEDDING_PRICING = {
+    "cohere.embed-multilingual-v3": 0.0001,
+}
+# The embedding response does not include the token count, so it is estimated
+EMBEDDING_CHARS_PER_TOKEN = 4
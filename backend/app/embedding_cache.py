@@ -0,0 +1,149 @@
+"""Cache of query embeddings.
+
+Entries are keyed by a hash of the model id and the text, and stored compactly as
+float32 arrays. An in-process LRU is always used. When `EMBEDDING_CACHE_BUCKET` is set,
+S3 is used as a shared second tier so that warm entries survive across Lambda instances.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 1024))
+EMBEDDING_CACHE_TTL_SEC = int(os.environ.get("EMBEDDING_CACHE_TTL_SEC", 24 * 60 * 60))
+EMBEDDING_CACHE_BUCKET = os.environ.get("EMBEDDING_CACHE_BUCKET", "")
+EMBEDDING_CACHE_PREFIX = "query-embedding-cache"
+
+
+def compose_cache_key(model_id: str, text: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+
+class S3EmbeddingStore:
+    """Shared tier of the cache. Objects hold raw little-endian float32 bytes."""
+
+    def __init__(self, bucket: str, prefix: str = EMBEDDING_CACHE_PREFIX):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key[:2]}/{key}"
+
+    def get(self, key: str, ttl_sec: float) -> array | None:
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                return None
+            raise
+        if time.time() - response["LastModified"].timestamp() > ttl_sec:
+            return None
+        vector = array("f")
+        vector.frombytes(response["Body"].read())
+        return vector
+
+    def put(self, key: str, vector: array):
+        self.client.put_object(
+            Bucket=self.bucket, Key=self._key(key), Body=vector.tobytes()
+        )
+
+
+class EmbeddingCache:
+    """LRU + TTL cache of embeddings with an optional shared store."""
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_sec: float = EMBEDDING_CACHE_TTL_SEC,
+        shared_store: S3EmbeddingStore | None = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.shared_store = shared_store
+        self._items: OrderedDict[str, tuple[float, array]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "shared_hits": 0, "misses": 0, "evictions": 0}
+
+    def _put_local(self, key: str, vector: array):
+        with self._lock:
+            self._items[key] = (time.monotonic(), vector)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def get(self, key: str) -> list[float] | None:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is not None:
+                stored_at, vector = entry
+                if time.monotonic() - stored_at <= self.ttl_sec:
+                    self._items.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return vector.tolist()
+                del self._items[key]
+
+        if self.shared_store is not None:
+            try:
+                vector = self.shared_store.get(key, self.ttl_sec)
+            except Exception as e:
+                logger.warning(f"Failed to get embedding from shared cache: {e}")
+                vector = None
+            if vector is not None:
+                self._put_local(key, vector)
+                with self._lock:
+                    self._stats["shared_hits"] += 1
+                return vector.tolist()
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, key: str, embedding: list[float]):
+        vector = array("f", embedding)
+        self._put_local(key, vector)
+        if self.shared_store is not None:
+            try:
+                self.shared_store.put(key, vector)
+            except Exception as e:
+                logger.warning(f"Failed to put embedding to shared cache: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self._stats, "size": len(self._items)}
+        lookups = stats["hits"] + stats["shared_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["hits"] + stats["shared_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._stats = {key: 0 for key in self._stats}
+
+
+_cache: EmbeddingCache | None = None
+
+
+def get_query_embedding_cache() -> EmbeddingCache:
+    global _cache
+    if _cache is None:
+        _cache = EmbeddingCache(
+            shared_store=(
+                S3EmbeddingStore(EMBEDDING_CACHE_BUCKET)
+                if EMBEDDING_CACHE_BUCKET
+                else None
+            )
+        )
+    return _cache
@@ -0,0 +1,222 @@
+"""Pooled PostgreSQL (pgvector) connections.
+
+Connections are kept warm across Lambda invocations and validated on checkout.
+Statements executed repeatedly (e.g. similarity search) are prepared once per connection.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+import pg8000
+from aws_lambda_powertools.utilities import parameters
+
+logger = logging.getLogger(__name__)
+
+DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
+# Seconds to cache the database secret. Rotation is picked up after this period
+# or immediately when authentication fails.
+SECRET_CACHE_TTL_SEC = 300
+# Number of idle connections to keep. Connections over this are closed on release.
+POOL_MAX_IDLE = int(os.environ.get("PG_POOL_MAX_IDLE", 4))
+# Validate a connection with `SELECT 1` if it has been idle longer than this.
+VALIDATE_AFTER_IDLE_SEC = 30
+# Recycle connections older than this.
+CONNECTION_MAX_LIFETIME_SEC = 30 * 60
+
+
+def get_db_info(force_fetch: bool = False) -> dict:
+    secrets: Any = parameters.get_secret(  # type: ignore
+        DB_SECRETS_ARN, max_age=SECRET_CACHE_TTL_SEC, force_fetch=force_fetch
+    )
+    return json.loads(secrets)
+
+
+def connect_with_secret() -> pg8000.Connection:
+    """Open a connection with the credentials stored in Secrets Manager."""
+
+    def _connect(db_info: dict) -> pg8000.Connection:
+        return pg8000.connect(
+            database=db_info["dbname"],
+            host=db_info["host"],
+            port=db_info["port"],
+            user=db_info["username"],
+            password=db_info["password"],
+        )
+
+    try:
+        return _connect(get_db_info())
+    except pg8000.DatabaseError as e:
+        # The secret may have been rotated. Fetch again and retry once.
+        logger.warning(f"Failed to connect to PostgreSQL: {e}. Refreshing secret.")
+        return _connect(get_db_info(force_fetch=True))
+
+
+class PooledConnection:
+    """A connection owned by `ConnectionPool` with its prepared statements."""
+
+    def __init__(self, conn, pool: "ConnectionPool"):
+        self.conn = conn
+        self.pool = pool
+        self.created_at = time.monotonic()
+        self.last_used_at = self.created_at
+        self._prepared: dict[str, Any] = {}
+        self._settings: dict[str, str] = {}
+
+    def prepare(self, statement: str):
+        """Prepare the statement once per connection.
+        Use named parameters (e.g. `:bot_id`) in `statement`.
+        """
+        prepared = self._prepared.get(statement)
+        if prepared is None:
+            self.pool._count("prepare_misses")
+            prepared = self.conn.prepare(statement)
+            self._prepared[statement] = prepared
+        else:
+            self.pool._count("prepare_hits")
+        return prepared
+
+    def run_prepared(self, statement: str, **params) -> tuple:
+        return self.prepare(statement).run(**params)
+
+    def apply_settings(self, settings: dict[str, str]):
+        """Set session parameters (e.g. `hnsw.ef_search`) which differ from the values
+        set before on this connection, in a single round trip.
+        """
+        changed = {k: v for k, v in settings.items() if self._settings.get(k) != v}
+        if not changed:
+            return
+        params: dict[str, str] = {}
+        calls = []
+        for i, (name, value) in enumerate(changed.items()):
+            params[f"name{i}"] = name
+            params[f"value{i}"] = value
+            calls.append(f"set_config(:name{i}, :value{i}, false)")
+        self.conn.run(f"SELECT {', '.join(calls)}", **params)
+        self._settings.update(changed)
+
+    def close(self):
+        try:
+            self.conn.close()
+        except Exception as e:
+            logger.debug(f"Failed to close connection: {e}")
+
+
+class ConnectionPool:
+    """Simple LIFO pool of PostgreSQL connections."""
+
+    def __init__(
+        self,
+        connect: Callable[[], Any] = connect_with_secret,
+        max_idle: int = POOL_MAX_IDLE,
+        validate_after_idle_sec: float = VALIDATE_AFTER_IDLE_SEC,
+        max_lifetime_sec: float = CONNECTION_MAX_LIFETIME_SEC,
+    ):
+        self._connect = connect
+        self.max_idle = max_idle
+        self.validate_after_idle_sec = validate_after_idle_sec
+        self.max_lifetime_sec = max_lifetime_sec
+        self._idle: list[PooledConnection] = []
+        self._lock = threading.Lock()
+        self._stats = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "validations": 0,
+            "validation_failures": 0,
+            "prepare_hits": 0,
+            "prepare_misses": 0,
+            "in_use": 0,
+        }
+
+    def _count(self, key: str, n: int = 1):
+        with self._lock:
+            self._stats[key] += n
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "idle": len(self._idle)}
+
+    def _new_connection(self) -> PooledConnection:
+        conn = self._connect()
+        # Each statement is committed by itself unless a transaction is started explicitly.
+        conn.autocommit = True
+        self._count("created")
+        return PooledConnection(conn, self)
+
+    def _is_usable(self, pooled: PooledConnection) -> bool:
+        now = time.monotonic()
+        if now - pooled.created_at > self.max_lifetime_sec:
+            return False
+        if now - pooled.last_used_at < self.validate_after_idle_sec:
+            return True
+
+        self._count("validations")
+        try:
+            pooled.conn.run("SELECT 1")
+            return True
+        except Exception as e:
+            logger.info(f"Connection validation failed: {e}")
+            self._count("validation_failures")
+            return False
+
+    def acquire(self) -> PooledConnection:
+        while True:
+            with self._lock:
+                pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                pooled = self._new_connection()
+                break
+            if self._is_usable(pooled):
+                self._count("reused")
+                break
+            self.discard(pooled)
+        self._count("in_use")
+        return pooled
+
+    def release(self, pooled: PooledConnection):
+        self._count("in_use", -1)
+        pooled.last_used_at = time.monotonic()
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(pooled)
+                return
+        self.discard(pooled)
+
+    def discard(self, pooled: PooledConnection):
+        self._count("discarded")
+        pooled.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[PooledConnection]:
+        """Borrow a connection. Connections which raised errors are not returned to the pool."""
+        pooled = self.acquire()
+        try:
+            yield pooled
+        except Exception:
+            self._count("in_use", -1)
+            self.discard(pooled)
+            raise
+        else:
+            self.release(pooled)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            pooled.close()
+
+
+_pool: ConnectionPool | None = None
+
+
+def get_pool() -> ConnectionPool:
+    """Get the process-wide pool, which stays warm across Lambda invocations."""
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool()
+    return _pool
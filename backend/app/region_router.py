@@ -0,0 +1,327 @@
+"""Multi-region routing for Bedrock Converse / ConverseStream calls.
+
+Each model can be served from several regions (see `BEDROCK_REGION`). The router
+keeps rolling latency and throttling statistics per region, sends each call to the
+healthiest region and fails over to the next one on throttling or transient errors.
+Its clients try once, so that the router owns retries: regions are tried in turn, with
+back-off before a region is tried again.
+"""
+
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Generator, Iterator
+
+from app.utils import get_bedrock_regions, get_routed_bedrock_client
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# Number of recent calls used to calculate latency percentiles and throttle rate.
+STATS_WINDOW_SIZE = 100
+# Open the circuit of a region after this many consecutive failures.
+CIRCUIT_FAILURE_THRESHOLD = 5
+# Seconds to keep the circuit open before trying the region again.
+CIRCUIT_COOLDOWN_SEC = 30
+# Send a hedged request to the next region if the first one has not responded
+# within this many seconds. `0` disables hedging. Only used for non-streaming calls.
+HEDGE_AFTER_SEC = float(os.environ.get("BEDROCK_HEDGE_AFTER_SEC", 0))
+# Total attempts of a call across all regions, e.g. a single region is tried 3 times.
+MAX_ATTEMPTS = int(os.environ.get("BEDROCK_ROUTER_MAX_ATTEMPTS", 3))
+# Base seconds of the jittered exponential back-off before trying a region again.
+RETRY_BACKOFF_SEC = float(os.environ.get("BEDROCK_ROUTER_RETRY_BACKOFF_SEC", 0.5))
+
+# Errors which are worth retrying in another region.
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "ModelTimeoutException",
+    "InternalServerException",
+}
+
+
+class NoRegionAvailableError(Exception):
+    pass
+
+
+def is_throttling_error(e: Exception) -> bool:
+    return isinstance(e, ClientError) and e.response["Error"]["Code"] in (
+        "ThrottlingException",
+        "TooManyRequestsException",
+    )
+
+
+def is_retryable_error(e: Exception) -> bool:
+    if isinstance(e, (ConnectionError, ReadTimeoutError)):
+        return True
+    return (
+        isinstance(e, ClientError)
+        and e.response["Error"]["Code"] in RETRYABLE_ERROR_CODES
+    )
+
+
+class RegionStats:
+    """Rolling health statistics and circuit breaker of a region."""
+
+    def __init__(self, region: str, window_size: int = STATS_WINDOW_SIZE):
+        self.region = region
+        self.latencies: deque[float] = deque(maxlen=window_size)
+        self.throttles: deque[bool] = deque(maxlen=window_size)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_success(self, latency: float):
+        self.latencies.append(latency)
+        self.throttles.append(False)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record_failure(self, throttled: bool, now: float):
+        self.throttles.append(throttled)
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= CIRCUIT_FAILURE_THRESHOLD:
+            logger.warning(f"Opening circuit of region {self.region}")
+            self.open_until = now + CIRCUIT_COOLDOWN_SEC
+
+    def is_open(self, now: float) -> bool:
+        return now < self.open_until
+
+    def percentile(self, q: float) -> float:
+        if not self.latencies:
+            return 0.0
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    @property
+    def p50(self) -> float:
+        return self.percentile(0.5)
+
+    @property
+    def p95(self) -> float:
+        return self.percentile(0.95)
+
+    @property
+    def throttle_rate(self) -> float:
+        if not self.throttles:
+            return 0.0
+        return sum(self.throttles) / len(self.throttles)
+
+    def to_dict(self) -> dict:
+        return {
+            "p50": self.p50,
+            "p95": self.p95,
+            "throttle_rate": self.throttle_rate,
+            "consecutive_failures": self.consecutive_failures,
+            "circuit_open": self.is_open(time.monotonic()),
+        }
+
+
+class RegionRouter:
+    """Route Converse API calls of a model to the healthiest of its regions."""
+
+    def __init__(
+        self,
+        client_factory: Callable[[str], Any] = get_routed_bedrock_client,
+        regions_resolver: Callable[[str], list[str]] = get_bedrock_regions,
+        hedge_after_sec: float = HEDGE_AFTER_SEC,
+        max_attempts: int = MAX_ATTEMPTS,
+        retry_backoff_sec: float = RETRY_BACKOFF_SEC,
+    ):
+        self.client_factory = client_factory
+        self.regions_resolver = regions_resolver
+        self.hedge_after_sec = hedge_after_sec
+        self.max_attempts = max_attempts
+        self.retry_backoff_sec = retry_backoff_sec
+        self._stats: dict[str, RegionStats] = {}
+        self._lock = threading.RLock()
+
+    def _get_stats(self, region: str) -> RegionStats:
+        stats = self._stats.get(region)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(region, RegionStats(region))
+        return stats
+
+    def stats(self) -> dict[str, dict]:
+        return {region: s.to_dict() for region, s in self._stats.items()}
+
+    def candidates(self, model_name: str) -> list[str]:
+        """Regions of the model ordered from the healthiest.
+        Regions with open circuit come last, so they are only tried when all others failed.
+        """
+        now = time.monotonic()
+        regions = self.regions_resolver(model_name)
+        # `sorted` is stable, so the configured order breaks ties
+        return sorted(
+            regions,
+            key=lambda r: (
+                self._get_stats(r).is_open(now),
+                round(self._get_stats(r).throttle_rate, 1),
+                self._get_stats(r).p95,
+            ),
+        )
+
+    def _record_success(self, region: str, latency: float):
+        with self._lock:
+            self._get_stats(region).record_success(latency)
+
+    def _record_failure(self, region: str, e: Exception):
+        with self._lock:
+            self._get_stats(region).record_failure(
+                is_throttling_error(e), time.monotonic()
+            )
+
+    def _attempts(self, regions: list[str]) -> Iterator[str]:
+        """Regions to try in order, at least once each and `max_attempts` in total.
+        Sleeps before a region is tried again.
+        """
+        for attempt in range(max(self.max_attempts, len(regions))):
+            if attempt >= len(regions):
+                rounds = attempt // len(regions)
+                time.sleep(
+                    random.uniform(0, self.retry_backoff_sec * 2 ** (rounds - 1))
+                )
+            yield regions[attempt % len(regions)]
+
+    def _converse_in_region(self, region: str, kwargs: dict) -> dict:
+        start = time.monotonic()
+        try:
+            response = self.client_factory(region).converse(**kwargs)
+        except Exception as e:
+            self._record_failure(region, e)
+            raise
+        self._record_success(region, time.monotonic() - start)
+        return response
+
+    def converse(self, model_name: str, **kwargs) -> tuple[dict, str]:
+        """Call `converse` in the healthiest region, failing over on retryable errors.
+        Returns the response and the region which served it.
+        """
+        regions = self.candidates(model_name)
+        last_error: Exception | None = None
+
+        if self.hedge_after_sec > 0 and len(regions) > 1:
+            try:
+                return self._hedged_converse(regions[0], regions[1], kwargs)
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                last_error = e
+                regions = regions[2:] + regions[:2]
+
+        for region in self._attempts(regions):
+            try:
+                return self._converse_in_region(region, kwargs), region
+            except Exception as e:
+                if not is_retryable_error(e):
+                    raise
+                logger.warning(f"Converse failed in {region}: {e}. Failing over.")
+                last_error = e
+
+        raise NoRegionAvailableError(
+            f"All regions failed for model {model_name}"
+        ) from last_error
+
+    def _hedged_converse(
+        self, primary: str, secondary: str, kwargs: dict
+    ) -> tuple[dict, str]:
+        """Send the request to `primary` and, if it is slow or fails, also to `secondary`.
+        The first successful response wins.
+        """
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            future = executor.submit(self._converse_in_region, primary, kwargs)
+            futures = {future}
+            regions = {future: primary}
+            done, _ = wait(futures, timeout=self.hedge_after_sec)
+            if done:
+                future = done.pop()
+                e = future.exception()
+                if e is None:
+                    return future.result(), primary
+                if not is_retryable_error(e):
+                    raise e
+                futures = set()
+            logger.info(f"Hedging converse request from {primary} to {secondary}")
+            future = executor.submit(self._converse_in_region, secondary, kwargs)
+            futures.add(future)
+            regions[future] = secondary
+
+            error: BaseException | None = None
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    e = future.exception()
+                    if e is None:
+                        return future.result(), regions[future]
+                    error = e
+            assert error is not None
+            raise error
+        finally:
+            # Do not wait for the slower request
+            executor.shutdown(wait=False)
+
+    def converse_stream(
+        self, model_name: str, **kwargs
+    ) -> tuple[Generator[dict, None, None], str]:
+        """Call `converse_stream` in the healthiest region. Returns the events and the
+        region which serves them.
+        Failover happens transparently until the first event is received. After that,
+        errors are propagated to the caller since tokens may have been already delivered.
+        """
+        last_error: Exception | None = None
+        for region in self._attempts(self.candidates(model_name)):
+            start = time.monotonic()
+            try:
+                response = self.client_factory(region).converse_stream(**kwargs)
+                event_stream = response["stream"]
+                stream = iter(event_stream)
+                first_event = next(stream)
+            except StopIteration:
+                self._record_success(region, time.monotonic() - start)
+                return _prepend([], stream, event_stream), region
+            except Exception as e:
+                self._record_failure(region, e)
+                if not is_retryable_error(e):
+                    raise
+                logger.warning(f"ConverseStream failed in {region}: {e}. Failing over.")
+                last_error = e
+                continue
+
+            # Time to first event
+            self._record_success(region, time.monotonic() - start)
+            return _prepend([first_event], stream, event_stream), region
+
+        raise NoRegionAvailableError(
+            f"All regions failed for model {model_name}"
+        ) from last_error
+
+
+def _prepend(
+    first: list[dict], rest: Iterator[dict], event_stream: Any
+) -> Generator[dict, None, None]:
+    """Yield the events read already and the rest. The event stream is closed also when
+    not read to the end, e.g. the client has disconnected, not to keep receiving tokens.
+    """
+    try:
+        yield from first
+        yield from rest
+    finally:
+        event_stream.close()
+
+
+_router: RegionRouter | None = None
+
+
+def get_region_router() -> RegionRouter:
+    """Get the process-wide router, so that statistics survive warm invocations."""
+    global _router
+    if _router is None:
+        _router = RegionRouter()
+    return _router
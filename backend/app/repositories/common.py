@@ -1,5 +1,9 @@
 import json
+import logging
 import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
 
 import boto3
 
@@ -9,6 +13,13 @@ ACCOUNT = os.environ.get("ACCOUNT", "")
 REGION = os.environ.get("REGION", "ap-northeast-1")
 TABLE_ACCESS_ROLE_ARN = os.environ.get("TABLE_ACCESS_ROLE_ARN", "")
 TRANSACTION_BATCH_SIZE = 25
+# Assumed role credentials are cached per user and shared across warm invocations.
+# Credentials are refreshed this many seconds before they expire.
+CREDENTIAL_REFRESH_MARGIN_SEC = 300
+# Upper bound of cached per-user credentials. Least recently used ones are evicted.
+MAX_CACHED_CREDENTIALS = int(os.environ.get("MAX_CACHED_CREDENTIALS", 256))
+
+logger = logging.getLogger(__name__)
 
 
 class RecordNotFoundError(Exception):
@@ -32,6 +43,24 @@ def decompose_conv_id(conv_id: str):
     return conv_id.split("#")[-1]
 
 
+def compose_conv_message_prefix(user_id: str, conversation_id: str):
+    # NOTE: Not prefixed by `#CONV#`, so that queries of conversations do not match messages
+    return f"{user_id}#CONV_MSG#{conversation_id}#"
+
+
+def compose_conv_message_id(user_id: str, conversation_id: str, message_id: str):
+    return f"{compose_conv_message_prefix(user_id, conversation_id)}{message_id}"
+
+
+def decompose_conv_message_id(conv_message_id: str):
+    return conv_message_id.split("#")[-1]
+
+
+def compose_content_blob_ref_id(user_id: str, blob_key: str):
+    # Keyed by the hash of the blob, i.e. the last part of the key
+    return f"{user_id}#BLOB#{blob_key.split('/')[-1]}"
+
+
 def compose_bot_id(user_id: str, bot_id: str):
     # Add user_id prefix for row level security to match with `LeadingKeys` condition
     return f"{user_id}#BOT#{bot_id}"
@@ -50,22 +79,92 @@ def decompose_bot_alias_id(composed_alias_id: str):
     return composed_alias_id.split("#")[-1]
 
 
-def _get_aws_resource(service_name, user_id=None):
-    """Get AWS resource with optional row-level access control for DynamoDB.
-    Ref: https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_examples_dynamodb_items.html
+class _CachedResource:
+    def __init__(self, resource, expiration: datetime):
+        self.resource = resource
+        self.expiration = expiration
+
+    def needs_refresh(self, now: datetime) -> bool:
+        return now >= self.expiration - timedelta(seconds=CREDENTIAL_REFRESH_MARGIN_SEC)
+
+
+class _CredentialCache:
+    """LRU cache of AWS resources built from row-level assumed role credentials.
+    Keyed by service name and user id (`None` for the public, unrestricted policy).
     """
-    if "AWS_EXECUTION_ENV" not in os.environ:
-        if DDB_ENDPOINT_URL:
-            return boto3.resource(
-                service_name,
-                endpoint_url=DDB_ENDPOINT_URL,
-                aws_access_key_id="key",
-                aws_secret_access_key="key",
-                region_name=REGION,
-            )
-        else:
-            return boto3.resource(service_name, region_name=REGION)
 
+    def __init__(self, max_size: int = MAX_CACHED_CREDENTIALS):
+        self.max_size = max_size
+        self._items: OrderedDict[tuple[str, str | None], _CachedResource] = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.evictions = 0
+
+    def get(self, service_name: str, user_id: str | None):
+        key = (service_name, user_id)
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            cached = self._items.get(key)
+            if cached is not None and not cached.needs_refresh(now):
+                self._items.move_to_end(key)
+                self.hits += 1
+                return cached.resource
+            if cached is None:
+                self.misses += 1
+            else:
+                self.refreshes += 1
+
+        resource, expiration = _assume_role_resource(service_name, user_id)
+
+        with self._lock:
+            self._items[key] = _CachedResource(resource, expiration)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return resource
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "hits": self.hits,
+                "misses": self.misses,
+                "refreshes": self.refreshes,
+                "evictions": self.evictions,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.hits = self.misses = self.refreshes = self.evictions = 0
+
+
+_credential_cache = _CredentialCache()
+_sts_client = None
+
+
+def get_credential_cache_stats() -> dict:
+    """Return hit / miss / refresh / eviction counters of the credential cache."""
+    return _credential_cache.stats()
+
+
+def clear_credential_cache():
+    _credential_cache.clear()
+
+
+def _get_sts_client():
+    global _sts_client
+    if _sts_client is None:
+        _sts_client = boto3.client("sts")
+    return _sts_client
+
+
+def _compose_table_access_policy(user_id: str | None = None) -> dict:
     policy_document = {
         "Statement": [
             {
@@ -95,12 +194,16 @@ def _get_aws_resource(service_name, user_id=None):
             # Allow access to items with the same partition key as the user id
             "ForAllValues:StringLike": {"dynamodb:LeadingKeys": [f"{user_id}*"]}
         }
+    return policy_document
 
-    sts_client = boto3.client("sts")
-    assumed_role_object = sts_client.assume_role(
+
+def _assume_role_resource(service_name: str, user_id: str | None = None) -> tuple:
+    """Assume the table access role and return the resource with its expiration."""
+    logger.debug(f"Assuming table access role for user: {user_id}")
+    assumed_role_object = _get_sts_client().assume_role(
         RoleArn=TABLE_ACCESS_ROLE_ARN,
         RoleSessionName="DynamoDBSession",
-        Policy=json.dumps(policy_document),
+        Policy=json.dumps(_compose_table_access_policy(user_id)),
     )
     credentials = assumed_role_object["Credentials"]
     session = boto3.Session(
@@ -108,7 +211,31 @@ def _get_aws_resource(service_name, user_id=None):
         aws_secret_access_key=credentials["SecretAccessKey"],
         aws_session_token=credentials["SessionToken"],
     )
-    return session.resource(service_name, region_name=REGION)
+    expiration = credentials["Expiration"]
+    if expiration.tzinfo is None:
+        expiration = expiration.replace(tzinfo=timezone.utc)
+    return session.resource(service_name, region_name=REGION), expiration
+
+
+def _get_aws_resource(service_name, user_id=None):
+    """Get AWS resource with optional row-level access control for DynamoDB.
+    The assumed role credentials are cached per user until shortly before they expire,
+    so that repeated calls in a request (and across warm invocations) skip STS.
+    Ref: https://docs.aws.amazon.com/IAM/latest/UserGuide/reference_policies_examples_dynamodb_items.html
+    """
+    if "AWS_EXECUTION_ENV" not in os.environ:
+        if DDB_ENDPOINT_URL:
+            return boto3.resource(
+                service_name,
+                endpoint_url=DDB_ENDPOINT_URL,
+                aws_access_key_id="key",
+                aws_secret_access_key="key",
+                region_name=REGION,
+            )
+        else:
+            return boto3.resource(service_name, region_name=REGION)
+
+    return _credential_cache.get(service_name, user_id)
 
 
 def _get_dynamodb_client(user_id=None):
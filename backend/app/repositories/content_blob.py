@@ -0,0 +1,224 @@
+"""Binary contents of messages (images and attachments), stored once in S3.
+
+Objects are keyed by the SHA-256 of the bytes under the prefix of the user, so that the
+same file is stored once across the conversations of the user, and messages keep only
+the key. Bytes are fetched when the Converse API request is built, and kept in an
+in-process LRU bounded by total size.
+"""
+
+import base64
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import boto3
+from app.repositories.common import _get_table_client, compose_content_blob_ref_id
+from app.repositories.models.conversation import ContentModel, MessageModel
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+s3_client = boto3.client("s3")
+
+CONTENT_BLOB_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
+# Smaller contents are kept inline, not worth another request
+CONTENT_BLOB_THRESHOLD = int(os.environ.get("CONTENT_BLOB_THRESHOLD", 4 * 1024))
+CONTENT_BLOB_CACHE_MAX_BYTES = int(
+    os.environ.get("CONTENT_BLOB_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+
+_cache: OrderedDict[str, bytes] = OrderedDict()
+_cache_bytes = 0
+_lock = threading.Lock()
+
+
+def compose_content_blob_prefix(user_id: str) -> str:
+    return f"{user_id}/blobs/"
+
+
+def compose_content_blob_key(user_id: str, data: bytes) -> str:
+    return f"{compose_content_blob_prefix(user_id)}{hashlib.sha256(data).hexdigest()}"
+
+
+def _cache_get(key: str) -> bytes | None:
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+        return data
+
+
+def _cache_put(key: str, data: bytes):
+    global _cache_bytes
+    if len(data) > CONTENT_BLOB_CACHE_MAX_BYTES:
+        return
+    with _lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return
+        _cache[key] = data
+        _cache_bytes += len(data)
+        while _cache_bytes > CONTENT_BLOB_CACHE_MAX_BYTES:
+            _, evicted = _cache.popitem(last=False)
+            _cache_bytes -= len(evicted)
+
+
+def _cache_evict(key: str):
+    global _cache_bytes
+    with _lock:
+        data = _cache.pop(key, None)
+        if data is not None:
+            _cache_bytes -= len(data)
+
+
+def _exists(key: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=CONTENT_BLOB_BUCKET, Key=key)
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return False
+        raise
+
+
+def _add_reference(user_id: str, key: str, conversation_id: str) -> bool:
+    """Refer to the blob from the conversation. Returns True if referred to by none
+    before, i.e. the blob may not be stored yet.
+    """
+    table = _get_table_client(user_id)
+    response = table.update_item(
+        Key={"PK": user_id, "SK": compose_content_blob_ref_id(user_id, key)},
+        UpdateExpression="ADD ConversationIds :c",
+        ExpressionAttributeValues={":c": {conversation_id}},
+        ReturnValues="UPDATED_OLD",
+    )
+    return "ConversationIds" not in response.get("Attributes", {})
+
+
+def store_content_blob(user_id: str, conversation_id: str, data: bytes) -> str:
+    """Store the bytes unless already stored, refer to them from the conversation, and
+    return the key.
+    """
+    key = compose_content_blob_key(user_id, data)
+    if _add_reference(user_id, key, conversation_id):
+        if not _exists(key):
+            logger.info(f"Storing content blob: {key} ({len(data)} bytes)")
+            s3_client.put_object(Bucket=CONTENT_BLOB_BUCKET, Key=key, Body=data)
+        else:
+            # Stored before references were tracked, so never deleted by them
+            _get_table_client(user_id).update_item(
+                Key={"PK": user_id, "SK": compose_content_blob_ref_id(user_id, key)},
+                UpdateExpression="SET Untracked = :t",
+                ExpressionAttributeValues={":t": True},
+            )
+    _cache_put(key, data)
+    return key
+
+
+def release_content_blobs(user_id: str, conversation_id: str, keys: list[str]) -> int:
+    """Remove the references from the conversation, and delete the blobs no longer
+    referred to. Returns the count of deleted blobs.
+    """
+    table = _get_table_client(user_id)
+    count = 0
+    for key in set(keys):
+        ref_key = {"PK": user_id, "SK": compose_content_blob_ref_id(user_id, key)}
+        try:
+            response = table.update_item(
+                Key=ref_key,
+                UpdateExpression="DELETE ConversationIds :c",
+                ExpressionAttributeValues={":c": {conversation_id}},
+                ConditionExpression="attribute_exists(SK)",
+                ReturnValues="ALL_NEW",
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                # Stored before references were tracked
+                continue
+            raise
+        attributes = response["Attributes"]
+        if "ConversationIds" in attributes or attributes.get("Untracked", False):
+            continue
+
+        try:
+            table.delete_item(
+                Key=ref_key, ConditionExpression="attribute_not_exists(ConversationIds)"
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                # Referred to again meanwhile
+                continue
+            raise
+        logger.info(f"Deleting content blob: {key}")
+        s3_client.delete_object(Bucket=CONTENT_BLOB_BUCKET, Key=key)
+        _cache_evict(key)
+        count += 1
+    return count
+
+
+def get_content_blob(key: str) -> bytes:
+    data = _cache_get(key)
+    if data is None:
+        data = s3_client.get_object(Bucket=CONTENT_BLOB_BUCKET, Key=key)["Body"].read()
+        _cache_put(key, data)
+    return data
+
+
+def offload_content_blobs(
+    user_id: str, conversation_id: str, message: MessageModel
+) -> int:
+    """Move the binary contents of the message to blobs. Returns the count."""
+    count = 0
+    for content in message.content:
+        if content.content_type not in ("image", "attachment"):
+            continue
+        if content.blob_key is not None:
+            continue
+        data = base64.b64decode(content.body)
+        if len(data) < CONTENT_BLOB_THRESHOLD:
+            continue
+        content.blob_key = store_content_blob(user_id, conversation_id, data)
+        content.body = ""
+        count += 1
+    return count
+
+
+def get_content_blob_keys(message: MessageModel) -> list[str]:
+    return [c.blob_key for c in message.content if c.blob_key is not None]
+
+
+def load_content_bytes(content: ContentModel) -> bytes:
+    """Bytes of the image or attachment, either inline or stored as a blob."""
+    if content.blob_key is not None:
+        return get_content_blob(content.blob_key)
+    return base64.b64decode(content.body)
+
+
+def load_content_body(content: ContentModel) -> str:
+    """Body of the content, with the blob encoded in base64 as stored formerly."""
+    if content.blob_key is not None:
+        return base64.b64encode(get_content_blob(content.blob_key)).decode("utf-8")
+    return content.body
+
+
+def delete_content_blobs_by_user_id(user_id: str):
+    """Delete all the blobs of the user, including the ones stored before references
+    were tracked.
+    """
+    paginator = s3_client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(
+        Bucket=CONTENT_BLOB_BUCKET, Prefix=compose_content_blob_prefix(user_id)
+    ):
+        objects = [{"Key": o["Key"]} for o in page.get("Contents", [])]
+        if len(objects) > 0:
+            s3_client.delete_objects(
+                Bucket=CONTENT_BLOB_BUCKET, Delete={"Objects": objects}
+            )
+
+
+def clear_content_blob_cache():
+    global _cache_bytes
+    with _lock:
+        _cache.clear()
+        _cache_bytes = 0
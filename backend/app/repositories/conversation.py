@@ -1,17 +1,33 @@
 import json
 import logging
 import os
+from collections.abc import Callable, Iterator, Mapping, MutableMapping
 from datetime import datetime
 from decimal import Decimal as decimal
 from functools import wraps
 
 import boto3
+import pydantic_core
 from app.repositories.common import (
     TRANSACTION_BATCH_SIZE,
     RecordNotFoundError,
     _get_table_client,
     compose_conv_id,
+    compose_conv_message_id,
+    compose_conv_message_prefix,
     decompose_conv_id,
+    decompose_conv_message_id,
+)
+from app.repositories.content_blob import (
+    delete_content_blobs_by_user_id,
+    get_content_blob_keys,
+    offload_content_blobs,
+    release_content_blobs,
+)
+from app.repositories.message_codec import (
+    decode_message_json,
+    encode_message_json,
+    get_encoded_size,
 )
 from app.repositories.models.conversation import (
     ChunkModel,
@@ -23,7 +39,9 @@ from app.repositories.models.conversation import (
 )
 from app.utils import get_current_time
 from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
 from botocore.exceptions import ClientError
+from pydantic import ValidationError
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -31,14 +49,287 @@ s3_client = boto3.client("s3")
 
 THRESHOLD_LARGE_MESSAGE = 300 * 1024  # 300KB
 LARGE_MESSAGE_BUCKET = os.environ.get("LARGE_MESSAGE_BUCKET")
+# How messages are stored:
+# - `per_message`: each message in its own item (or S3 object if large), written only
+#   when changed. The conversation item holds the other attributes.
+# - `message_map`: the whole message map in the conversation item (or S3 if large).
+# Conversations are found in either format, and stored ones are migrated to the mode.
+CONVERSATION_STORAGE_MODE = os.environ.get("CONVERSATION_STORAGE_MODE", "per_message")
+MESSAGE_STORAGE_PER_MESSAGE = "PER_MESSAGE"
+
+
+def _compose_large_message_part_path(
+    user_id: str, conversation_id: str, message_id: str
+) -> str:
+    return f"{user_id}/{conversation_id}/messages/{message_id}.json"
+
+
+def _find_changeable_messages(
+    conversation: ConversationModel,
+) -> list[tuple[str, MessageModel]]:
+    """Messages which may differ from the stored ones. Messages never parsed are
+    unchanged, if the stored messages are known.
+    """
+    message_map = conversation.message_map
+    if conversation._stored_messages is not None and isinstance(
+        message_map, LazyMessageMap
+    ):
+        return message_map.parsed_items()
+    return list(message_map.items())
+
+
+def _compose_message_attributes(
+    user_id: str, conversation_id: str, message_id: str, body: str, threshold: int
+) -> dict:
+    """Attributes of the message item. Either `Message` with the encoded message, or
+    `MessagePath` of the part in S3, put here if larger than the threshold.
+    """
+    encoded = encode_message_json(body)
+    if get_encoded_size(encoded) > threshold:
+        path = _compose_large_message_part_path(user_id, conversation_id, message_id)
+        s3_client.put_object(Bucket=LARGE_MESSAGE_BUCKET, Key=path, Body=encoded)
+        return {"MessagePath": path}
+    return {"Message": encoded}
+
+
+def _store_messages(
+    table,
+    user_id: str,
+    conversation: ConversationModel,
+    threshold: int,
+    only_changed: bool = True,
+) -> int:
+    """Put the messages which differ from the stored ones as items. Returns the count."""
+    stored = conversation._stored_messages
+    changed = {}
+    for message_id, message in (
+        _find_changeable_messages(conversation)
+        if only_changed
+        else conversation.message_map.items()
+    ):
+        body = message.model_dump_json()
+        if not only_changed or stored is None or stored.get(message_id) != body:
+            changed[message_id] = body
+
+    with table.batch_writer() as writer:
+        for message_id, body in changed.items():
+            item = {
+                "PK": user_id,
+                "SK": compose_conv_message_id(user_id, conversation.id, message_id),
+                **_compose_message_attributes(
+                    user_id, conversation.id, message_id, body, threshold
+                ),
+            }
+            writer.put_item(Item=item)
+
+    if stored is None:
+        conversation._stored_messages = changed
+    else:
+        # Updated in place, since message parts loaded later are recorded to it
+        stored.update(changed)
+    return len(changed)
+
+
+def _find_messages(
+    table, user_id: str, conversation_id: str, stored_messages: dict[str, str]
+) -> dict[str, str | Callable[[], str]]:
+    """Find the serialized messages stored as items. Large messages are returned as
+    loaders, so that their parts are fetched only when the messages are accessed.
+    Serialized messages are recorded to `stored_messages` as they are found or loaded.
+    """
+    query_params = {
+        "KeyConditionExpression": Key("PK").eq(user_id)
+        & Key("SK").begins_with(compose_conv_message_prefix(user_id, conversation_id)),
+        # Messages are put before the conversation item, which may have been just found
+        "ConsistentRead": True,
+    }
+
+    def loader(message_id: str, fetch: Callable[[], str | bytes]) -> Callable[[], str]:
+        def load() -> str:
+            stored_messages[message_id] = decode_message_json(fetch())
+            return stored_messages[message_id]
+
+        return load
+
+    def fetch_part(path: str) -> Callable[[], bytes]:
+        return lambda: s3_client.get_object(Bucket=LARGE_MESSAGE_BUCKET, Key=path)[
+            "Body"
+        ].read()
+
+    messages: dict[str, str | Callable[[], str]] = {}
+    while True:
+        response = table.query(**query_params)
+        for item in response["Items"]:
+            message_id = decompose_conv_message_id(item["SK"])
+            if "MessagePath" in item:
+                messages[message_id] = loader(
+                    message_id, fetch_part(item["MessagePath"])
+                )
+            elif isinstance(item["Message"], str):
+                messages[message_id] = item["Message"]
+                stored_messages[message_id] = item["Message"]
+            else:
+                # Compressed, so decompressed only when accessed
+                messages[message_id] = loader(
+                    message_id, lambda value=item["Message"]: value
+                )
+        if "LastEvaluatedKey" not in response:
+            return messages
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _delete_messages(table, user_id: str, conversation_id: str):
+    query_params = {
+        "KeyConditionExpression": Key("PK").eq(user_id)
+        & Key("SK").begins_with(compose_conv_message_prefix(user_id, conversation_id)),
+        "ProjectionExpression": "SK, MessagePath",
+    }
+    while True:
+        response = table.query(**query_params)
+        with table.batch_writer() as writer:
+            for item in response["Items"]:
+                if "MessagePath" in item:
+                    s3_client.delete_object(
+                        Bucket=LARGE_MESSAGE_BUCKET, Key=item["MessagePath"]
+                    )
+                writer.delete_item(Key={"PK": user_id, "SK": item["SK"]})
+        if "LastEvaluatedKey" not in response:
+            return
+        query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+
+def _dump_message_map(message_map: Mapping[str, MessageModel]) -> str:
+    return pydantic_core.to_json(dict(message_map.items())).decode("utf-8")
+
+
+def _load_message_map(value: str | bytes | Binary) -> dict:
+    """Load the message map stored as is, or encoded by `encode_message_json`."""
+    return pydantic_core.from_json(decode_message_json(value))
+
+
+def _parse_message(v: dict) -> MessageModel:
+    try:
+        return MessageModel.model_validate(v)
+    except ValidationError:
+        pass
+    # For backward compatibility
+    return MessageModel(
+        role=v["role"],
+        content=(
+            [
+                ContentModel(
+                    content_type=c["content_type"],
+                    body=c["body"],
+                    media_type=c["media_type"],
+                    file_name=c.get("file_name", None),
+                    blob_key=c.get("blob_key", None),
+                )
+                for c in v["content"]
+            ]
+            if type(v["content"]) == list
+            else [
+                # For backward compatibility
+                ContentModel(
+                    content_type=v["content"]["content_type"],
+                    body=v["content"]["body"],
+                    media_type=None,
+                    file_name=None,
+                )
+            ]
+        ),
+        model=v["model"],
+        children=v["children"],
+        parent=v["parent"],
+        create_time=float(v["create_time"]),
+        feedback=(
+            FeedbackModel(
+                thumbs_up=v["feedback"]["thumbs_up"],
+                category=v["feedback"]["category"],
+                comment=v["feedback"]["comment"],
+            )
+            if v.get("feedback")
+            else None
+        ),
+        used_chunks=(
+            [
+                ChunkModel(
+                    content=c["content"],
+                    content_type=(c["content_type"] if "content_type" in c else "s3"),
+                    source=c["source"],
+                    rank=c["rank"],
+                )
+                for c in v["used_chunks"]
+            ]
+            if v.get("used_chunks")
+            else None
+        ),
+        thinking_log=v.get("thinking_log"),
+        cache_hit=v.get("cache_hit", False),
+    )
+
+
+class LazyMessageMap(MutableMapping[str, MessageModel]):
+    """Message map which parses the messages on access. Values are kept raw until then:
+    serialized messages, loaders of them, or dicts of the former message map format.
+    Only the messages traced from the active leaf are parsed when generating replies.
+    """
+
+    def __init__(self, raw_messages: dict[str, str | dict | Callable[[], str]]):
+        self._items: dict[str, MessageModel | str | dict | Callable[[], str]] = dict(
+            raw_messages
+        )
+
+    def __getitem__(self, key: str) -> MessageModel:
+        value = self._items[key]
+        if isinstance(value, MessageModel):
+            return value
+        if callable(value):
+            value = value()
+        if isinstance(value, str):
+            message = MessageModel.model_validate_json(value)
+        else:
+            message = _parse_message(value)
+        self._items[key] = message
+        return message
+
+    def __setitem__(self, key: str, value: MessageModel):
+        self._items[key] = value
+
+    def __delitem__(self, key: str):
+        del self._items[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._items
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._items))
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def parsed_items(self) -> list[tuple[str, MessageModel]]:
+        """Messages parsed so far, i.e. the only ones which may have been changed."""
+        return [(k, v) for k, v in self._items.items() if isinstance(v, MessageModel)]
 
 
 def store_conversation(
-    user_id: str, conversation: ConversationModel, threshold=THRESHOLD_LARGE_MESSAGE
+    user_id: str,
+    conversation: ConversationModel,
+    threshold=THRESHOLD_LARGE_MESSAGE,
+    storage_mode=CONVERSATION_STORAGE_MODE,
 ):
-    logger.info(f"Storing conversation: {conversation.model_dump_json()}")
+    logger.info(
+        f"Storing conversation: {conversation.id} ({len(conversation.message_map)} messages)"
+    )
     table = _get_table_client(user_id)
 
+    # Binary contents are stored once as blobs, and only their keys in messages
+    blob_count = 0
+    for _, message in _find_changeable_messages(conversation):
+        blob_count += offload_content_blobs(user_id, conversation.id, message)
+    if blob_count > 0:
+        logger.info(f"Offloaded {blob_count} contents to blobs")
+
     item_params = {
         "PK": user_id,
         "SK": compose_conv_id(user_id, conversation.id),
@@ -54,14 +345,39 @@ def store_conversation(
     if conversation.bot_id:
         item_params["BotId"] = conversation.bot_id
 
-    message_map = {
-        k: {
-            **v.model_dump(),
-            "content": [c.model_dump() for c in v.content],
-        }
-        for k, v in conversation.message_map.items()
-    }
-    message_map_size = len(json.dumps(message_map).encode("utf-8"))
+    if storage_mode == "per_message":
+        # Messages are put first, so that the conversation item never refers to
+        # messages not stored yet. The conversation item is put at once.
+        count = _store_messages(table, user_id, conversation, threshold)
+        logger.info(
+            f"Stored {count} of {len(conversation.message_map)} messages as items"
+        )
+        item_params["MessageStorage"] = MESSAGE_STORAGE_PER_MESSAGE
+        item_params["IsLargeMessage"] = False
+        # `system` is kept, since its model is listed with conversations
+        item_params["MessageMap"] = json.dumps(
+            {"system": conversation.message_map["system"].model_dump()}
+            if "system" in conversation.message_map
+            else {}
+        )
+        response = table.put_item(Item=item_params, ReturnValues="ALL_OLD")
+
+        previous = response.get("Attributes", {})
+        if previous.get(
+            "MessageStorage"
+        ) != MESSAGE_STORAGE_PER_MESSAGE and count < len(conversation.message_map):
+            # Unchanged messages were skipped, but they may not exist (e.g. the
+            # conversation was deleted after it was found)
+            _store_messages(table, user_id, conversation, threshold, only_changed=False)
+        if previous.get("IsLargeMessage", False):
+            s3_client.delete_object(
+                Bucket=LARGE_MESSAGE_BUCKET, Key=previous["LargeMessagePath"]
+            )
+        return response
+
+    # Serialize once, both to measure the size and to store
+    message_map = encode_message_json(_dump_message_map(conversation.message_map))
+    message_map_size = get_encoded_size(message_map)
     logger.info(f"Message map size: {message_map_size}")
     if message_map_size > threshold:
         logger.info(
@@ -74,7 +390,7 @@ def store_conversation(
         s3_client.put_object(
             Bucket=LARGE_MESSAGE_BUCKET,
             Key=large_message_path,
-            Body=json.dumps(message_map),
+            Body=message_map,
         )
         # Store only `system` attribute in DynamoDB
         item_params["MessageMap"] = json.dumps(
@@ -86,9 +402,7 @@ def store_conversation(
         )
     else:
         item_params["IsLargeMessage"] = False
-        item_params["MessageMap"] = json.dumps(
-            {k: v.model_dump() for k, v in conversation.message_map.items()}
-        )
+        item_params["MessageMap"] = message_map
 
     response = table.put_item(
         Item=item_params,
@@ -114,7 +428,9 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
             create_time=float(item["CreateTime"]),
             title=item["Title"],
             # NOTE: all message has the same model
-            model=json.loads(item["MessageMap"]).get("system", {}).get("model", ""),
+            model=_load_message_map(item["MessageMap"])
+            .get("system", {})
+            .get("model", ""),
             bot_id=item["BotId"] if "BotId" in item else None,
         )
         for item in response["Items"]
@@ -124,7 +440,7 @@ def find_conversation_by_user_id(user_id: str) -> list[ConversationMeta]:
     MAX_QUERY_COUNT = 5
     while "LastEvaluatedKey" in response:
         model = (
-            json.loads(response["Items"][0]["MessageMap"])
+            _load_message_map(response["Items"][0]["MessageMap"])
             .get("system", {})
             .get("model", "")
         )
@@ -167,81 +483,34 @@ def find_conversation_by_id(user_id: str, conversation_id: str) -> ConversationM
 
     # NOTE: conversation is unique
     item = response["Items"][0]
-    if item.get("IsLargeMessage", False):
+    stored_messages: dict[str, str] | None = None
+    if item.get("MessageStorage") == MESSAGE_STORAGE_PER_MESSAGE:
+        stored_messages = {}
+        message_map = LazyMessageMap(
+            _find_messages(table, user_id, conversation_id, stored_messages)
+        )
+    elif item.get("IsLargeMessage", False):
         large_message_path = item["LargeMessagePath"]
         response = s3_client.get_object(
             Bucket=LARGE_MESSAGE_BUCKET, Key=large_message_path
         )
-        message_map = json.loads(response["Body"].read().decode("utf-8"))
+        message_map = LazyMessageMap(_load_message_map(response["Body"].read()))
     else:
-        message_map = json.loads(item["MessageMap"])
+        message_map = LazyMessageMap(_load_message_map(item["MessageMap"]))
 
-    conv = ConversationModel(
+    # Not validated, so that messages are parsed only when accessed
+    conv = ConversationModel.model_construct(
         id=decompose_conv_id(item["SK"]),
         create_time=float(item["CreateTime"]),
         title=item["Title"],
-        total_price=item.get("TotalPrice", 0),
-        message_map={
-            k: MessageModel(
-                role=v["role"],
-                content=(
-                    [
-                        ContentModel(
-                            content_type=c["content_type"],
-                            body=c["body"],
-                            media_type=c["media_type"],
-                            file_name=c.get("file_name", None),
-                        )
-                        for c in v["content"]
-                    ]
-                    if type(v["content"]) == list
-                    else [
-                        # For backward compatibility
-                        ContentModel(
-                            content_type=v["content"]["content_type"],
-                            body=v["content"]["body"],
-                            media_type=None,
-                            file_name=None,
-                        )
-                    ]
-                ),
-                model=v["model"],
-                children=v["children"],
-                parent=v["parent"],
-                create_time=float(v["create_time"]),
-                feedback=(
-                    FeedbackModel(
-                        thumbs_up=v["feedback"]["thumbs_up"],
-                        category=v["feedback"]["category"],
-                        comment=v["feedback"]["comment"],
-                    )
-                    if v.get("feedback")
-                    else None
-                ),
-                used_chunks=(
-                    [
-                        ChunkModel(
-                            content=c["content"],
-                            content_type=(
-                                c["content_type"] if "content_type" in c else "s3"
-                            ),
-                            source=c["source"],
-                            rank=c["rank"],
-                        )
-                        for c in v["used_chunks"]
-                    ]
-                    if v.get("used_chunks")
-                    else None
-                ),
-                thinking_log=v.get("thinking_log"),
-            )
-            for k, v in message_map.items()
-        },
+        total_price=float(item.get("TotalPrice", 0)),
+        message_map=message_map,
         last_message_id=item["LastMessageId"],
         bot_id=item["BotId"] if "BotId" in item else None,
         should_continue=item.get("ShouldContinue", False),
     )
-    logger.info(f"Found conversation: {conv}")
+    conv._stored_messages = stored_messages
+    logger.info(f"Found conversation: {conv.id} ({len(conv.message_map)} messages)")
     return conv
 
 
@@ -249,6 +518,14 @@ def delete_conversation_by_id(user_id: str, conversation_id: str):
     logger.info(f"Deleting conversation: {conversation_id}")
     table = _get_table_client(user_id)
 
+    # Blobs referred to by the conversation, deleted unless referred to by others
+    conversation = find_conversation_by_id(user_id, conversation_id)
+    blob_keys = [
+        key
+        for message in conversation.message_map.values()
+        for key in get_content_blob_keys(message)
+    ]
+
     try:
         # Check if the conversation has a large message map
         response = table.get_item(
@@ -268,6 +545,12 @@ def delete_conversation_by_id(user_id: str, conversation_id: str):
             Key={"PK": user_id, "SK": compose_conv_id(user_id, conversation_id)},
             ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         )
+        # Messages stored as items
+        _delete_messages(table, user_id, conversation_id)
+
+        deleted_blob_count = release_content_blobs(user_id, conversation_id, blob_keys)
+        if deleted_blob_count > 0:
+            logger.info(f"Deleted {deleted_blob_count} content blobs")
 
     except ClientError as e:
         if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
@@ -284,13 +567,6 @@ def delete_conversation_by_user_id(user_id: str):
     logger.info(f"Deleting ALL conversations for user: {user_id}")
     table = _get_table_client(user_id)
 
-    query_params = {
-        "KeyConditionExpression": Key("PK").eq(user_id)
-        # NOTE: Need SK to fetch only conversations
-        & Key("SK").begins_with(f"{user_id}#CONV#"),
-        "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath",
-    }
-
     def delete_batch(batch):
         with table.batch_writer() as writer:
             for item in batch:
@@ -302,29 +578,47 @@ def delete_conversation_by_user_id(user_id: str):
                 s3_client.delete_object(
                     Bucket=LARGE_MESSAGE_BUCKET, Key=item["LargeMessagePath"]
                 )
+            if "MessagePath" in item:
+                s3_client.delete_object(
+                    Bucket=LARGE_MESSAGE_BUCKET, Key=item["MessagePath"]
+                )
 
     try:
-        response = table.query(
-            **query_params,
-        )
+        # Conversations, messages stored as items, and references to blobs
+        for prefix in (
+            f"{user_id}#CONV#",
+            f"{user_id}#CONV_MSG#",
+            f"{user_id}#BLOB#",
+        ):
+            query_params = {
+                "KeyConditionExpression": Key("PK").eq(user_id)
+                # NOTE: Need SK to fetch only conversations
+                & Key("SK").begins_with(prefix),
+                "ProjectionExpression": "SK, IsLargeMessage, LargeMessagePath, MessagePath",
+            }
+            response = table.query(
+                **query_params,
+            )
 
-        while True:
-            items = response.get("Items", [])
-            delete_large_messages(items)
+            while True:
+                items = response.get("Items", [])
+                delete_large_messages(items)
 
-            for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
-                batch = items[i : i + TRANSACTION_BATCH_SIZE]
-                delete_batch(batch)
+                for i in range(0, len(items), TRANSACTION_BATCH_SIZE):
+                    batch = items[i : i + TRANSACTION_BATCH_SIZE]
+                    delete_batch(batch)
 
-            # Check if next page exists
-            if "LastEvaluatedKey" not in response:
-                break
+                # Check if next page exists
+                if "LastEvaluatedKey" not in response:
+                    break
 
-            # Load next page
-            query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
-            response = table.query(
-                **query_params,
-            )
+                # Load next page
+                query_params["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+                response = table.query(
+                    **query_params,
+                )
+
+        delete_content_blobs_by_user_id(user_id)
 
     except ClientError as e:
         logger.error(f"An error occurred: {e.response['Error']['Message']}")
@@ -361,12 +655,39 @@ def change_conversation_title(user_id: str, conversation_id: str, new_title: str
 def update_feedback(
     user_id: str, conversation_id: str, message_id: str, feedback: FeedbackModel
 ):
+    """Returns the response of the DynamoDB update."""
     logger.info(f"Updating feedback for conversation: {conversation_id}")
     table = _get_table_client(user_id)
     conv = find_conversation_by_id(user_id, conversation_id)
     message_map = conv.message_map
     message_map[message_id].feedback = feedback
 
+    if CONVERSATION_STORAGE_MODE == "per_message":
+        if conv._stored_messages is None:
+            # Migrate the conversation stored in the former format
+            return store_conversation(user_id, conv)
+        # Only the message with the feedback is updated
+        body = message_map[message_id].model_dump_json()
+        attributes = _compose_message_attributes(
+            user_id, conversation_id, message_id, body, THRESHOLD_LARGE_MESSAGE
+        )
+        # The message may have moved between the item and S3 by its size
+        name = "Message" if "Message" in attributes else "MessagePath"
+        removed = "MessagePath" if name == "Message" else "Message"
+        response = table.update_item(
+            Key={
+                "PK": user_id,
+                "SK": compose_conv_message_id(user_id, conversation_id, message_id),
+            },
+            UpdateExpression=f"set {name} = :m remove {removed}",
+            ExpressionAttributeValues={":m": attributes[name]},
+            ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
+            ReturnValues="UPDATED_NEW",
+        )
+        conv._stored_messages[message_id] = body
+        logger.info(f"Updated feedback response: {response}")
+        return response
+
     response = table.update_item(
         Key={
             "PK": user_id,
@@ -374,7 +695,7 @@ def update_feedback(
         },
         UpdateExpression="set MessageMap = :m",
         ExpressionAttributeValues={
-            ":m": json.dumps({k: v.model_dump() for k, v in message_map.items()})
+            ":m": encode_message_json(_dump_message_map(message_map))
         },
         ConditionExpression="attribute_exists(PK) AND attribute_exists(SK)",
         ReturnValues="UPDATED_NEW",
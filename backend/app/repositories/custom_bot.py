@@ -75,6 +75,7 @@ def store_bot(user_id: str, custom_bot: BotModel):
         "ApiPublishedDatetime": custom_bot.published_api_datetime,
         "ApiPublishCodeBuildId": custom_bot.published_api_codebuild_id,
         "DisplayRetrievedChunks": custom_bot.display_retrieved_chunks,
+        "EnableResponseCache": custom_bot.enable_response_cache,
         "ConversationQuickStarters": [
             starter.model_dump() for starter in custom_bot.conversation_quick_starters
         ],
@@ -102,6 +103,7 @@ def update_bot(
     display_retrieved_chunks: bool,
     conversation_quick_starters: list[ConversationQuickStarterModel],
     bedrock_knowledge_base: BedrockKnowledgeBaseModel | None = None,
+    enable_response_cache: bool = False,
 ):
     """Update bot title, description, and instruction.
     NOTE: Use `update_bot_visibility` to update visibility.
@@ -121,6 +123,7 @@ def update_bot(
         "GenerationParams = :generation_params, "
         "SearchParams = :search_params, "
         "DisplayRetrievedChunks = :display_retrieved_chunks, "
+        "EnableResponseCache = :enable_response_cache, "
         "ConversationQuickStarters = :conversation_quick_starters"
     )
 
@@ -134,6 +137,7 @@ def update_bot(
         ":sync_status": sync_status,
         ":sync_status_reason": sync_status_reason,
         ":display_retrieved_chunks": display_retrieved_chunks,
+        ":enable_response_cache": enable_response_cache,
         ":generation_params": generation_params.model_dump(),
         ":search_params": search_params.model_dump(),
         ":conversation_quick_starters": [
@@ -428,7 +432,14 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
                 item["SearchParams"]["max_results"]
                 if "SearchParams" in item
                 else DEFAULT_SEARCH_CONFIG["max_results"]
-            )
+            ),
+            search_type=item.get("SearchParams", {}).get(
+                "search_type", DEFAULT_SEARCH_CONFIG["search_type"]
+            ),
+            ef_search=item.get("SearchParams", {}).get("ef_search"),
+            probes=item.get("SearchParams", {}).get("probes"),
+            enable_rerank=item.get("SearchParams", {}).get("enable_rerank", False),
+            max_context_tokens=item.get("SearchParams", {}).get("max_context_tokens"),
         ),
         agent=(
             AgentModel(**item["AgentData"])
@@ -455,6 +466,7 @@ def find_private_bot_by_id(user_id: str, bot_id: str) -> BotModel:
             else item["ApiPublishCodeBuildId"]
         ),
         display_retrieved_chunks=item.get("DisplayRetrievedChunks", False),
+        enable_response_cache=item.get("EnableResponseCache", False),
         conversation_quick_starters=item.get("ConversationQuickStarters", []),
         bedrock_knowledge_base=(
             BedrockKnowledgeBaseModel(**item["BedrockKnowledgeBase"])
@@ -521,7 +533,14 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
                 item["SearchParams"]["max_results"]
                 if "SearchParams" in item
                 else DEFAULT_SEARCH_CONFIG["max_results"]
-            )
+            ),
+            search_type=item.get("SearchParams", {}).get(
+                "search_type", DEFAULT_SEARCH_CONFIG["search_type"]
+            ),
+            ef_search=item.get("SearchParams", {}).get("ef_search"),
+            probes=item.get("SearchParams", {}).get("probes"),
+            enable_rerank=item.get("SearchParams", {}).get("enable_rerank", False),
+            max_context_tokens=item.get("SearchParams", {}).get("max_context_tokens"),
         ),
         agent=(
             AgentModel(**item["AgentData"])
@@ -548,6 +567,7 @@ def find_public_bot_by_id(bot_id: str) -> BotModel:
             else item["ApiPublishCodeBuildId"]
         ),
         display_retrieved_chunks=item.get("DisplayRetrievedChunks", False),
+        enable_response_cache=item.get("EnableResponseCache", False),
         conversation_quick_starters=item.get("ConversationQuickStarters", []),
         bedrock_knowledge_base=(
             BedrockKnowledgeBaseModel(**item["BedrockKnowledgeBase"])
@@ -0,0 +1,56 @@
+"""Encoding of serialized messages stored in DynamoDB and S3.
+
+Serialized messages (or message maps) of at least `MESSAGE_COMPRESSION_MIN_SIZE` bytes
+are compressed, and stored as binary prefixed by a header with the format version.
+Smaller ones are stored as plain JSON text, as are all records stored before, which
+are decoded as is.
+"""
+
+import os
+import zlib
+
+from boto3.dynamodb.types import Binary
+
+# `zlib` or `none`, i.e. always plain JSON text as before
+MESSAGE_COMPRESSION = os.environ.get("MESSAGE_COMPRESSION", "zlib")
+MESSAGE_COMPRESSION_MIN_SIZE = int(os.environ.get("MESSAGE_COMPRESSION_MIN_SIZE", 1024))
+# Fastest, since messages are encoded on every turn.
+# See benchmarks/conversation_encoding.py
+MESSAGE_COMPRESSION_LEVEL = int(os.environ.get("MESSAGE_COMPRESSION_LEVEL", 1))
+
+# 0xFF never appears in UTF-8, so that encoded values are told from JSON text
+MESSAGE_CODEC_MAGIC = b"\xffMC"
+MESSAGE_CODEC_VERSION_ZLIB = 1
+
+
+def encode_message_json(
+    text: str, compression: str = MESSAGE_COMPRESSION
+) -> str | bytes:
+    """Encode the serialized JSON. Returns str if stored as text, otherwise bytes."""
+    data = text.encode("utf-8")
+    if compression == "none" or len(data) < MESSAGE_COMPRESSION_MIN_SIZE:
+        return text
+    if compression != "zlib":
+        raise ValueError(f"Unsupported message compression: {compression}")
+    return (
+        MESSAGE_CODEC_MAGIC
+        + bytes([MESSAGE_CODEC_VERSION_ZLIB])
+        + zlib.compress(data, MESSAGE_COMPRESSION_LEVEL)
+    )
+
+
+def decode_message_json(value: str | bytes | Binary) -> str:
+    """Decode the value stored by `encode_message_json`, or plain JSON text."""
+    if isinstance(value, str):
+        return value
+    data = value.value if isinstance(value, Binary) else bytes(value)
+    if not data.startswith(MESSAGE_CODEC_MAGIC):
+        return data.decode("utf-8")
+    version = data[len(MESSAGE_CODEC_MAGIC)]
+    if version == MESSAGE_CODEC_VERSION_ZLIB:
+        return zlib.decompress(data[len(MESSAGE_CODEC_MAGIC) + 1 :]).decode("utf-8")
+    raise ValueError(f"Unsupported message codec version: {version}")
+
+
+def get_encoded_size(value: str | bytes) -> int:
+    return len(value.encode("utf-8")) if isinstance(value, str) else len(value)
@@ -2,7 +2,7 @@ import base64
 from typing import Literal
 
 from app.routes.schemas.conversation import MessageInput, type_model_name
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr, field_serializer
 
 
 class ContentModel(BaseModel):
@@ -14,6 +14,10 @@ class ContentModel(BaseModel):
         description="Body string. If content_type is image or attachment, it should be base64 encoded.",
     )
     file_name: str | None = Field(None)
+    blob_key: str | None = Field(
+        None,
+        description="Key of the body stored as a content blob. If set, body is empty.",
+    )
 
     model_config = {
         "json_encoders": {
@@ -45,6 +49,7 @@ class MessageModel(BaseModel):
     feedback: FeedbackModel | None
     used_chunks: list[ChunkModel] | None
     thinking_log: str | None = Field(None, description="Only available for agent.")
+    cache_hit: bool = Field(False, description="Served from the response cache.")
 
     @classmethod
     def from_message_input(cls, message_input: MessageInput):
@@ -78,6 +83,14 @@ class ConversationModel(BaseModel):
     last_message_id: str
     bot_id: str | None
     should_continue: bool
+    # Serialized messages as last stored or found, to store only changed messages.
+    # None if unknown, e.g. new or found in the former format, to store all messages.
+    _stored_messages: dict[str, str] | None = PrivateAttr(default=None)
+
+    @field_serializer("message_map", mode="wrap")
+    def serialize_message_map(self, message_map, handler):
+        # Found conversations have a `LazyMessageMap`, which is not a dict
+        return handler(dict(message_map.items()))
 
 
 class ConversationMeta(BaseModel):
@@ -1,6 +1,6 @@
 from app.repositories.models.common import Float
 from app.repositories.models.custom_bot_kb import BedrockKnowledgeBaseModel
-from app.routes.schemas.bot import type_sync_status
+from app.routes.schemas.bot import type_search_type, type_sync_status
 from pydantic import BaseModel
 
 
@@ -43,6 +43,14 @@ class GenerationParamsModel(BaseModel):
 
 class SearchParamsModel(BaseModel):
     max_results: int
+    search_type: type_search_type = "vector"
+    # Tuning of the approximate nearest neighbor search. Defaults are used if None.
+    ef_search: int | None = None
+    probes: int | None = None
+    # Rerank and trim the results to `max_context_tokens` (or the default of
+    # `app.rerank`) before they are inserted into the prompt.
+    enable_rerank: bool = False
+    max_context_tokens: int | None = None
 
 
 class AgentToolModel(BaseModel):
@@ -82,6 +90,8 @@ class BotModel(BaseModel):
     published_api_datetime: int | None
     published_api_codebuild_id: str | None
     display_retrieved_chunks: bool
+    # Serve answers to similar first questions from `app.response_cache`
+    enable_response_cache: bool = False
     conversation_quick_starters: list[ConversationQuickStarterModel]
     bedrock_knowledge_base: BedrockKnowledgeBaseModel | None
 
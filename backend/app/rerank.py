@@ -0,0 +1,145 @@
+"""Rerank and trim search results before they are inserted into the prompt.
+
+Results are scored locally by their retrieval rank and the overlap of their words with
+the query, then selected by maximal marginal relevance (MMR) so that near-identical
+chunks are not sent twice, until the token budget of the context is used up.
+Ref: https://www.cs.cmu.edu/~jgc/publication/The_Use_MMR_Diversity_Based_LTMIR_1998.pdf
+"""
+
+import logging
+import re
+import zlib
+
+import numpy as np
+from app.repositories.models.custom_bot import BotModel
+from app.vector_search import SearchResult
+
+logger = logging.getLogger(__name__)
+
+# Weight of the word overlap with the query, relative to the retrieval rank.
+LEXICAL_WEIGHT = 0.5
+# Trade-off between relevance (1.0) and diversity (0.0) of MMR.
+MMR_LAMBDA = 0.7
+# Results at least this similar to a selected one are dropped as duplicates.
+DUPLICATE_SIMILARITY = 0.95
+# Tokens of search results inserted into the prompt when the bot does not set it.
+DEFAULT_MAX_CONTEXT_TOKENS = 4000
+# Dimension of the hashed character n-gram vectors used when results have no
+# embeddings (e.g. Bedrock Knowledge Base results).
+HASHED_VECTOR_DIMENSION = 1024
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: about 4 ASCII characters per token, and one token per
+    other character (e.g. CJK), which does not underestimate multilingual texts.
+    """
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _words(text: str) -> set[str]:
+    return {w.lower() for w in _WORD_PATTERN.findall(text)}
+
+
+def lexical_scores(query: str, contents: list[str]) -> np.ndarray:
+    """Fraction of the query words found in each content."""
+    query_words = _words(query)
+    if len(query_words) == 0:
+        return np.zeros(len(contents))
+    return np.array([len(query_words & _words(c)) / len(query_words) for c in contents])
+
+
+def _hashed_vectors(contents: list[str], n: int = 3) -> np.ndarray:
+    vectors = np.zeros((len(contents), HASHED_VECTOR_DIMENSION), dtype=np.float32)
+    for i, content in enumerate(contents):
+        text = " ".join(content.lower().split())
+        indices = [
+            zlib.crc32(text[j : j + n].encode("utf-8")) % HASHED_VECTOR_DIMENSION
+            for j in range(max(len(text) - n + 1, 1))
+        ]
+        np.add.at(vectors[i], indices, 1.0)
+    return vectors
+
+
+def _normalized_vectors(results: list[SearchResult]) -> np.ndarray:
+    if all(r.embedding is not None for r in results):
+        vectors = np.asarray([r.embedding for r in results], dtype=np.float32)
+    else:
+        vectors = _hashed_vectors([r.content for r in results])
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def mmr_order(
+    relevance: np.ndarray,
+    similarity: np.ndarray,
+    mmr_lambda: float = MMR_LAMBDA,
+    duplicate_similarity: float = DUPLICATE_SIMILARITY,
+) -> list[int]:
+    """Order indices by MMR. Indices of near duplicates of selected ones are dropped."""
+    n = len(relevance)
+    selected: list[int] = []
+    # Highest similarity of each candidate to the selected ones
+    max_similarity = np.full(n, -np.inf)
+    available = np.ones(n, dtype=bool)
+    while available.any():
+        redundancy = np.where(np.isinf(max_similarity), 0.0, max_similarity)
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        available &= max_similarity < duplicate_similarity
+    return selected
+
+
+def rerank_search_results(
+    query: str,
+    search_results: list[SearchResult],
+    max_context_tokens: int = DEFAULT_MAX_CONTEXT_TOKENS,
+) -> list[SearchResult]:
+    """Select the results to insert into the prompt, in the order of selection.
+    `rank` of the results is kept, since it is the source ID cited by the model.
+    """
+    if len(search_results) == 0:
+        return search_results
+
+    n = len(search_results)
+    # Earlier retrieval ranks score higher, from 1.0 down to 1 / n
+    rank_scores = 1.0 - np.arange(n) / n
+    relevance = rank_scores + LEXICAL_WEIGHT * lexical_scores(
+        query, [r.content for r in search_results]
+    )
+    vectors = _normalized_vectors(search_results)
+    order = mmr_order(relevance, vectors @ vectors.T)
+
+    selected: list[SearchResult] = []
+    tokens = 0
+    for i in order:
+        result_tokens = estimate_tokens(search_results[i].content)
+        if len(selected) > 0 and tokens + result_tokens > max_context_tokens:
+            break
+        selected.append(search_results[i])
+        tokens += result_tokens
+    logger.info(
+        f"Reranked {n} search results into {len(selected)} ({tokens} tokens, {n - len(order)} duplicates)"
+    )
+    return selected
+
+
+def rerank_for_bot(
+    bot: BotModel, query: str, search_results: list[SearchResult]
+) -> list[SearchResult]:
+    """Rerank the results if enabled for the bot, otherwise return them as they are."""
+    if not bot.search_params.enable_rerank:
+        return search_results
+    return rerank_search_results(
+        query,
+        search_results,
+        max_context_tokens=(
+            bot.search_params.max_context_tokens or DEFAULT_MAX_CONTEXT_TOKENS
+        ),
+    )
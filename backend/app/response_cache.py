@@ -0,0 +1,154 @@
+"""Semantic cache of bot responses.
+
+Answers to the first question of conversations are cached per bot version, and served
+for later questions whose embeddings are similar enough, without retrieval nor Converse
+calls. The version is a hash of the bot settings which affect answers, so entries are
+not used anymore once the knowledge, instruction or generation params change.
+Like `app.embedding_cache`, entries are kept in-process with LRU eviction and a TTL.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from app.repositories.models.custom_bot import BotModel
+from app.vector_search import SearchResult
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", 512))
+RESPONSE_CACHE_TTL_SEC = int(os.environ.get("RESPONSE_CACHE_TTL_SEC", 6 * 60 * 60))
+# Minimum cosine similarity of the query embeddings to serve a cached answer
+RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(
+    os.environ.get("RESPONSE_CACHE_SIMILARITY_THRESHOLD", 0.95)
+)
+
+
+class CachedResponse(BaseModel):
+    answer: str
+    # Cited search results. Sources are kept raw, since presigned URLs expire.
+    used_results: list[SearchResult]
+    # Price of the original generation, i.e. saved by each hit
+    price: float
+
+
+def compose_bot_version(bot: BotModel, model: str) -> str:
+    """Hash of the bot settings which affect answers. `sync_last_exec_id` changes on
+    every knowledge sync, even if the sources themselves are unchanged.
+    """
+    settings = bot.model_dump(
+        include={
+            "id",
+            "instruction",
+            "embedding_params",
+            "generation_params",
+            "search_params",
+            "knowledge",
+            "sync_last_exec_id",
+            "display_retrieved_chunks",
+            "bedrock_knowledge_base",
+        }
+    )
+    settings["model"] = model
+    return hashlib.sha256(
+        json.dumps(settings, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class ResponseCache:
+    """LRU + TTL cache of responses, looked up by the similarity of query embeddings."""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        ttl_sec: float = RESPONSE_CACHE_TTL_SEC,
+        similarity_threshold: float = RESPONSE_CACHE_SIMILARITY_THRESHOLD,
+    ):
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.similarity_threshold = similarity_threshold
+        # (version, entry id) -> (stored at, normalized embedding, response)
+        self._items: OrderedDict[
+            tuple[str, int], tuple[float, np.ndarray, CachedResponse]
+        ] = OrderedDict()
+        # version -> (entry ids, stacked embeddings), rebuilt after the version changes
+        self._matrices: dict[str, tuple[list[int], np.ndarray]] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _remove(self, key: tuple[str, int]):
+        del self._items[key]
+        self._matrices.pop(key[0], None)
+
+    def _matrix(self, version: str) -> tuple[list[int], np.ndarray]:
+        if version not in self._matrices:
+            ids = [entry_id for v, entry_id in self._items if v == version]
+            vectors = [self._items[(version, entry_id)][1] for entry_id in ids]
+            self._matrices[version] = (
+                ids,
+                np.stack(vectors) if len(vectors) > 0 else np.empty((0, 0)),
+            )
+        return self._matrices[version]
+
+    def get(self, version: str, embedding: list[float]) -> CachedResponse | None:
+        query = _normalize(embedding)
+        with self._lock:
+            ids, matrix = self._matrix(version)
+            if len(ids) > 0:
+                similarities = matrix @ query
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    key = (version, ids[best])
+                    stored_at, _, response = self._items[key]
+                    if time.monotonic() - stored_at <= self.ttl_sec:
+                        self._items.move_to_end(key)
+                        self._stats["hits"] += 1
+                        return response
+                    self._remove(key)
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, version: str, embedding: list[float], response: CachedResponse):
+        with self._lock:
+            key = (version, self._next_id)
+            self._next_id += 1
+            self._items[key] = (time.monotonic(), _normalize(embedding), response)
+            self._matrices.pop(version, None)
+            while len(self._items) > self.max_entries:
+                self._remove(next(iter(self._items)))
+                self._stats["evictions"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {**self._stats, "size": len(self._items)}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._matrices.clear()
+            self._stats = {key: 0 for key in self._stats}
+
+
+def _normalize(embedding: list[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    return vector / max(float(np.linalg.norm(vector)), 1e-12)
+
+
+_cache: ResponseCache | None = None
+
+
+def get_response_cache() -> ResponseCache:
+    global _cache
+    if _cache is None:
+        _cache = ResponseCache()
+    return _cache
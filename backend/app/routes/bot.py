@@ -163,11 +163,17 @@ def get_private_bot(request: Request, bot_id: str):
         ),
         search_params=SearchParams(
             max_results=bot.search_params.max_results,
+            search_type=bot.search_params.search_type,
+            ef_search=bot.search_params.ef_search,
+            probes=bot.search_params.probes,
+            enable_rerank=bot.search_params.enable_rerank,
+            max_context_tokens=bot.search_params.max_context_tokens,
         ),
         sync_status=bot.sync_status,
         sync_status_reason=bot.sync_status_reason,
         sync_last_exec_id=bot.sync_last_exec_id,
         display_retrieved_chunks=bot.display_retrieved_chunks,
+        enable_response_cache=bot.enable_response_cache,
         conversation_quick_starters=[
             ConversationQuickStarter(
                 title=starter.title,
@@ -22,6 +22,8 @@ type_sync_status = Literal[
     "FAILED",
     "ORIGINAL_NOT_FOUND",
 ]
+# Retrieval of pgvector bots. `hybrid` fuses full-text and vector search results.
+type_search_type = Literal["vector", "hybrid"]
 
 
 class EmbeddingParams(BaseSchema):
@@ -40,6 +42,11 @@ class GenerationParams(BaseSchema):
 
 class SearchParams(BaseSchema):
     max_results: int
+    search_type: type_search_type = "vector"
+    ef_search: int | None = None
+    probes: int | None = None
+    enable_rerank: bool = False
+    max_context_tokens: int | None = None
 
 
 class AgentTool(BaseSchema):
@@ -107,6 +114,7 @@ class BotInput(BaseSchema):
     agent: Optional[AgentInput] = None
     knowledge: Knowledge | None
     display_retrieved_chunks: bool
+    enable_response_cache: bool = False
     conversation_quick_starters: list[ConversationQuickStarter] | None
     bedrock_knowledge_base: BedrockKnowledgeBaseInput | None = None
 
@@ -121,6 +129,7 @@ class BotModifyInput(BaseSchema):
     agent: Optional[AgentInput] = None
     knowledge: KnowledgeDiffInput | None
     display_retrieved_chunks: bool
+    enable_response_cache: bool = False
     conversation_quick_starters: list[ConversationQuickStarter] | None
     bedrock_knowledge_base: BedrockKnowledgeBaseInput | None = None
 
@@ -200,6 +209,7 @@ class BotOutput(BaseSchema):
     sync_status_reason: str
     sync_last_exec_id: str
     display_retrieved_chunks: bool
+    enable_response_cache: bool = False
     conversation_quick_starters: list[ConversationQuickStarter]
     bedrock_knowledge_base: BedrockKnowledgeBaseOutput | None
 
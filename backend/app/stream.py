@@ -1,26 +1,15 @@
 import logging
-import json
-import os
 from typing import Any, Callable
 
 from app.bedrock import ConverseApiRequest, calculate_price, get_model_id
 from app.routes.schemas.conversation import type_model_name
-from app.utils import get_bedrock_client, rename_model_id
+from app.region_router import get_region_router
+from app.utils import rename_model_id
 from langchain_core.outputs import GenerationChunk
 from pydantic import BaseModel
 
 logger = logging.getLogger(__name__)
 
-# BEDROCK_REGION = os.environ.get("BEDROCK_REGION", "us-east-1")
-DEFAULT_BEDROCK_REGION = '''{
-    "claude-v3-sonnet": "us-east-2",
-    "claude-v3.5-sonnet": "us-east-1",
-    "claude-v3-opus": "us-west-2",
-    "default": "us-west-2"
-}'''
-BEDROCK_REGION = os.environ.get("BEDROCK_REGION", DEFAULT_BEDROCK_REGION)
-BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
-
 
 class OnStopInput(BaseModel):
     full_token: str
@@ -66,10 +55,9 @@ class ConverseApiStreamHandler:
     def run(self, args: ConverseApiRequest):
         model_id = args["model_id"]
         model_name = rename_model_id(model_id)
-        BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
-        client = get_bedrock_client(BEDROCK_REGION_JSON[model_name])        
-        # client = get_bedrock_client()
-        response = client.converse_stream(
+        # Fails over to another region until the first event arrives
+        stream, region = get_region_router().converse_stream(
+            model_name,
             modelId=args["model_id"],
             messages=args["messages"],
             inferenceConfig=args["inference_config"],
@@ -78,30 +66,34 @@ class ConverseApiStreamHandler:
 
         completions = []
         stop_reason = ""
-        for event in response["stream"]:
-            if "contentBlockDelta" in event:
-                text = event["contentBlockDelta"]["delta"]["text"]
-                completions.append(text)
-                response = self.on_stream(text)
-                yield response
-            elif "messageStop" in event:
-                stop_reason = event["messageStop"]["stopReason"]
-            elif "metadata" in event:
-                metadata = event["metadata"]
-                usage = metadata["usage"]
-                input_token_count = usage["inputTokens"]
-                output_token_count = usage["outputTokens"]
-                price = calculate_price(
-                    self.model, input_token_count, output_token_count
-                )
-                concatenated = "".join(completions)
-                response = self.on_stop(
-                    OnStopInput(
-                        full_token=concatenated.rstrip(),
-                        stop_reason=stop_reason,
-                        input_token_count=input_token_count,
-                        output_token_count=output_token_count,
-                        price=price,
+        try:
+            for event in stream:
+                if "contentBlockDelta" in event:
+                    text = event["contentBlockDelta"]["delta"]["text"]
+                    completions.append(text)
+                    response = self.on_stream(text)
+                    yield response
+                elif "messageStop" in event:
+                    stop_reason = event["messageStop"]["stopReason"]
+                elif "metadata" in event:
+                    metadata = event["metadata"]
+                    usage = metadata["usage"]
+                    input_token_count = usage["inputTokens"]
+                    output_token_count = usage["outputTokens"]
+                    price = calculate_price(
+                        self.model, input_token_count, output_token_count, region=region
+                    )
+                    concatenated = "".join(completions)
+                    response = self.on_stop(
+                        OnStopInput(
+                            full_token=concatenated.rstrip(),
+                            stop_reason=stop_reason,
+                            input_token_count=input_token_count,
+                            output_token_count=output_token_count,
+                            price=price,
+                        )
                     )
-                )
-                yield response
+                    yield response
+        finally:
+            # Stop receiving tokens also when not read to the end
+            stream.close()
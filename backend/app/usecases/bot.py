@@ -203,6 +203,7 @@ def create_new_bot(user_id: str, bot_input: BotInput) -> BotOutput:
             published_api_datetime=None,
             published_api_codebuild_id=None,
             display_retrieved_chunks=bot_input.display_retrieved_chunks,
+            enable_response_cache=bot_input.enable_response_cache,
             conversation_quick_starters=(
                 []
                 if bot_input.conversation_quick_starters is None
@@ -256,6 +257,7 @@ def create_new_bot(user_id: str, bot_input: BotInput) -> BotOutput:
         sync_status_reason="",
         sync_last_exec_id="",
         display_retrieved_chunks=bot_input.display_retrieved_chunks,
+        enable_response_cache=bot_input.enable_response_cache,
         conversation_quick_starters=(
             []
             if bot_input.conversation_quick_starters is None
@@ -400,6 +402,7 @@ def modify_owned_bot(
             if modify_input.bedrock_knowledge_base
             else None
         ),
+        enable_response_cache=modify_input.enable_response_cache,
     )
 
     return BotModifyOutput(
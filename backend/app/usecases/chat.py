@@ -1,4 +1,5 @@
 import logging
+from collections.abc import Mapping
 from copy import deepcopy
 from typing import Literal
 
@@ -9,11 +10,14 @@ from app.agents.langchain import BedrockLLM
 from app.agents.tools.knowledge import AnswerWithKnowledgeTool
 from app.agents.utils import get_tool_by_name
 from app.bedrock import (
+    calculate_embedding_price,
     calculate_price,
+    calculate_query_embedding,
     call_converse_api,
     compose_args_for_converse_api,
 )
 from app.prompt import build_rag_prompt
+from app.repositories.content_blob import load_content_body
 from app.repositories.conversation import (
     RecordNotFoundError,
     find_conversation_by_id,
@@ -31,6 +35,8 @@ from app.repositories.models.custom_bot import (
     BotModel,
     ConversationQuickStarterModel,
 )
+from app.rerank import rerank_for_bot
+from app.response_cache import CachedResponse, compose_bot_version, get_response_cache
 from app.routes.schemas.conversation import (
     ChatInput,
     ChatOutput,
@@ -209,7 +215,7 @@ def prepare_conversation(
 
 
 def trace_to_root(
-    node_id: str | None, message_map: dict[str, MessageModel]
+    node_id: str | None, message_map: Mapping[str, MessageModel]
 ) -> list[MessageModel]:
     """Trace message map from leaf node to root node."""
     result = []
@@ -247,11 +253,97 @@ def insert_knowledge(
     return conversation_with_context
 
 
+def _get_response_cache_query(
+    bot: BotModel | None,
+    chat_input: ChatInput,
+    conversation: ConversationModel,
+    user_msg_id: str,
+) -> str | None:
+    """Query to look up the response cache with. None if the bot does not use it, or
+    the message is not the first text-only question of the conversation, since answers
+    also depend on the history and attachments.
+    """
+    if bot is None or not bot.enable_response_cache or chat_input.continue_generate:
+        return None
+    message = conversation.message_map[user_msg_id]
+    if message.parent not in ("instruction", "system"):
+        return None
+    if any(c.content_type != "text" for c in message.content):
+        return None
+    return message.content[-1].body  # type: ignore[return-value]
+
+
+def _generate(
+    bot: BotModel | None,
+    chat_input: ChatInput,
+    conversation: ConversationModel,
+    user_msg_id: str,
+) -> tuple[str, list[SearchResult], float]:
+    """Generate the reply with the Converse API, using the knowledge of the bot.
+    Returns the reply, the search results cited in it and the price.
+    """
+    message_map = conversation.message_map
+    search_results = []
+    if bot and is_running_on_lambda():
+        # NOTE: `is_running_on_lambda`is a workaround for local testing due to no postgres mock.
+        # Fetch most related documents from vector store
+        # NOTE: Currently embedding not support multi-modal. For now, use the last content.
+        query: str = conversation.message_map[user_msg_id].content[-1].body  # type: ignore[assignment]
+
+        search_results = search_related_docs(bot=bot, query=query)
+        search_results = rerank_for_bot(bot, query, search_results)
+        logger.info(f"Search results from vector store: {search_results}")
+
+        # Insert contexts to instruction
+        conversation_with_context = insert_knowledge(
+            conversation,
+            search_results,
+            display_citation=bot.display_retrieved_chunks,
+        )
+        message_map = conversation_with_context.message_map
+
+    messages = trace_to_root(
+        node_id=chat_input.message.parent_message_id, message_map=message_map
+    )
+
+    if not chat_input.continue_generate:
+        messages.append(MessageModel.from_message_input(chat_input.message))
+
+    # Create payload to invoke Bedrock
+    args = compose_args_for_converse_api(
+        messages=messages,
+        model=chat_input.message.model,
+        instruction=(
+            message_map["instruction"].content[0].body
+            if "instruction" in message_map
+            else None  # type: ignore[union-attr]
+        ),
+        generation_params=(bot.generation_params if bot else None),
+    )
+
+    converse_response = call_converse_api(args)
+    reply_txt = converse_response["output"]["message"]["content"][0]["text"]
+    reply_txt = reply_txt.rstrip()
+
+    used_results = filter_used_results(reply_txt, search_results)
+    input_tokens = converse_response["usage"]["inputTokens"]
+    output_tokens = converse_response["usage"]["outputTokens"]
+
+    price = calculate_price(
+        chat_input.message.model,
+        input_tokens,
+        output_tokens,
+        region=converse_response.get("region"),
+    )
+    return reply_txt, used_results, price
+
+
 def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
     user_msg_id, conversation, bot = prepare_conversation(user_id, chat_input)
     used_chunks = None
     price = 0.0
     thinking_log = None
+    cache_hit = False
 
     if bot and bot.is_agent_enabled():
         logger.info("Bot has agent tools. Using agent for response.")
@@ -309,53 +401,44 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
         reply_txt = agent_response["output"]
         conversation.should_continue = False
     else:
-        message_map = conversation.message_map
-        search_results = []
-        if bot and is_running_on_lambda():
-            # NOTE: `is_running_on_lambda`is a workaround for local testing due to no postgres mock.
-            # Fetch most related documents from vector store
-            # NOTE: Currently embedding not support multi-modal. For now, use the last content.
-            query: str = conversation.message_map[user_msg_id].content[-1].body  # type: ignore[assignment]
-
-            search_results = search_related_docs(bot=bot, query=query)
-            logger.info(f"Search results from vector store: {search_results}")
-
-            # Insert contexts to instruction
-            conversation_with_context = insert_knowledge(
-                conversation,
-                search_results,
-                display_citation=bot.display_retrieved_chunks,
-            )
-            message_map = conversation_with_context.message_map
-
-        messages = trace_to_root(
-            node_id=chat_input.message.parent_message_id, message_map=message_map
-        )
-
-        if not chat_input.continue_generate:
-            messages.append(MessageModel.from_message_input(chat_input.message))
-
-        # Create payload to invoke Bedrock
-        args = compose_args_for_converse_api(
-            messages=messages,
-            model=chat_input.message.model,
-            instruction=(
-                message_map["instruction"].content[0].body
-                if "instruction" in message_map
-                else None  # type: ignore[union-attr]
-            ),
-            generation_params=(bot.generation_params if bot else None),
+        cache_query = _get_response_cache_query(
+            bot, chat_input, conversation, user_msg_id
         )
+        cached_response = None
+        if cache_query is not None:
+            assert bot is not None
+            cache_version = compose_bot_version(bot, chat_input.message.model)
+            cache_query_embedding = calculate_query_embedding(cache_query)
+            cached_response = get_response_cache().get(
+                cache_version, cache_query_embedding
+            )
 
-        converse_response = call_converse_api(args)
-        reply_txt = converse_response["output"]["message"]["content"][0]["text"]
-        reply_txt = reply_txt.rstrip()
+        if cached_response is not None:
+            # Served without retrieval nor Converse API call, so only the lookup costs
+            logger.info(f"Response cache hit. Saved price: {cached_response.price}")
+            reply_txt = cached_response.answer
+            used_results = cached_response.used_results
+            assert cache_query is not None
+            price = calculate_embedding_price(cache_query)
+            cache_hit = True
+        else:
+            reply_txt, used_results, price = _generate(
+                bot, chat_input, conversation, user_msg_id
+            )
+            if cache_query is not None:
+                get_response_cache().put(
+                    cache_version,
+                    cache_query_embedding,
+                    CachedResponse(
+                        answer=reply_txt, used_results=used_results, price=price
+                    ),
+                )
 
         # Used chunks for RAG generation
         if bot and bot.display_retrieved_chunks and is_running_on_lambda():
-            if len(search_results) > 0:
+            if len(used_results) > 0:
                 used_chunks = []
-                for r in filter_used_results(reply_txt, search_results):
+                for r in used_results:
                     content_type, source_link = get_source_link(r.source)
                     used_chunks.append(
                         ChunkModel(
@@ -366,10 +449,6 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
                         )
                     )
 
-        input_tokens = converse_response["usage"]["inputTokens"]
-        output_tokens = converse_response["usage"]["outputTokens"]
-
-        price = calculate_price(chat_input.message.model, input_tokens, output_tokens)
         # Published API does not support continued generation
         conversation.should_continue = False
 
@@ -390,6 +469,7 @@ def chat(user_id: str, chat_input: ChatInput) -> ChatOutput:
         feedback=None,
         used_chunks=used_chunks,
         thinking_log=thinking_log,
+        cache_hit=cache_hit,
     )
 
     if chat_input.continue_generate:
@@ -523,7 +603,7 @@ def fetch_conversation(user_id: str, conversation_id: str) -> Conversation:
             content=[
                 Content(
                     content_type=c.content_type,
-                    body=c.body,
+                    body=load_content_body(c),
                     media_type=c.media_type,
                     file_name=c.file_name,
                 )
@@ -591,7 +671,7 @@ def fetch_related_documents(
         return None
 
     query: str = chat_input.message.content[-1].body  # type: ignore[assignment]
-    chunks = search_related_docs(bot=bot, query=query)
+    chunks = rerank_for_bot(bot, query, search_related_docs(bot=bot, query=query))
 
     documents = []
     for chunk in chunks:
@@ -2,15 +2,15 @@ import json
 import logging
 import os
 import re
+import threading
 from datetime import datetime
 from typing import Any, List, Literal
 
 import boto3
-import pg8000
-from aws_lambda_powertools.utilities import parameters
 from botocore.client import Config
 from botocore.exceptions import ClientError
 
+from app.postgres import get_pool
 from app.routes.schemas.conversation import type_model_name, real_model_name
 
 
@@ -25,12 +25,30 @@ DEFAULT_BEDROCK_REGION = '''{
     "default": "us-west-2"
 }'''
 BEDROCK_REGION = os.environ.get("BEDROCK_REGION", DEFAULT_BEDROCK_REGION)
+# Parsed once per process. Maps model name (e.g. `claude-v3-sonnet`) to its region,
+# or to a list of candidate regions ordered by preference for multi-region failover.
 BEDROCK_REGION_JSON = json.loads(BEDROCK_REGION)
 
+# Bedrock runtime clients are shared per region across warm invocations, so that
+# connections (and TLS sessions) to each region are reused.
+BEDROCK_CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", 50)),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=120,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
+# Clients of the region router try once, since the router retries across regions
+ROUTED_BEDROCK_CLIENT_CONFIG = BEDROCK_CLIENT_CONFIG.merge(
+    Config(retries={"max_attempts": 1, "mode": "standard"})
+)
+_bedrock_session = boto3.session.Session()
+_bedrock_clients: dict[str, Any] = {}
+_bedrock_clients_lock = threading.Lock()
+
 PUBLISH_API_CODEBUILD_PROJECT_NAME = os.environ.get(
     "PUBLISH_API_CODEBUILD_PROJECT_NAME", ""
 )
-DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
 
 
 def get_model_id(model: type_model_name) -> str:
@@ -87,12 +105,46 @@ def is_running_on_lambda():
     return "AWS_EXECUTION_ENV" in os.environ
 
 
-def get_bedrock_client(region=BEDROCK_REGION_JSON["default"]):
-    logger.info(f"Dongping: Model Region @ {region}")
-    client = boto3.client("bedrock-runtime", region)
+def get_bedrock_regions(model_name: str) -> list[str]:
+    """Get candidate regions of the model name (e.g. `claude-v3-sonnet`) configured by `BEDROCK_REGION`."""
+    regions = BEDROCK_REGION_JSON.get(model_name, BEDROCK_REGION_JSON["default"])
+    return [regions] if isinstance(regions, str) else list(regions)
+
+
+def get_bedrock_region(model_name: str) -> str:
+    """Get the preferred region of the model name."""
+    return get_bedrock_regions(model_name)[0]
+
+
+def get_bedrock_client(region=get_bedrock_region("default"), routed: bool = False):
+    """Get the Bedrock runtime client of the region.
+    The client is created lazily on first use and reused afterwards.
+    Clients for the region router (`routed`) do not retry by themselves.
+    """
+    key = f"{region}:routed" if routed else region
+    client = _bedrock_clients.get(key)
+    if client is not None:
+        return client
+
+    with _bedrock_clients_lock:
+        client = _bedrock_clients.get(key)
+        if client is None:
+            logger.info(f"Dongping: Model Region @ {region}")
+            client = _bedrock_session.client(
+                "bedrock-runtime",
+                region_name=region,
+                config=(
+                    ROUTED_BEDROCK_CLIENT_CONFIG if routed else BEDROCK_CLIENT_CONFIG
+                ),
+            )
+            _bedrock_clients[key] = client
     return client
 
 
+def get_routed_bedrock_client(region: str):
+    return get_bedrock_client(region, routed=True)
+
+
 def get_bedrock_agent_client(region=REGION):
     client = boto3.client("bedrock-agent-runtime", region)
     return client
@@ -148,6 +200,21 @@ def compose_upload_document_s3_path(user_id: str, bot_id: str, filename: str) ->
     return f"{user_id}/{bot_id}/documents/{filename}"
 
 
+def compose_url_content_type_cache_s3_path(user_id: str, bot_id: str) -> str:
+    """Compose S3 path for the cache of content types of the source URLs."""
+    return f"{user_id}/{bot_id}/_cache/url_content_types.json"
+
+
+def compose_pdf_partition_cache_s3_prefix(user_id: str, bot_id: str) -> str:
+    """Compose S3 prefix for the cache of partitioned PDF pages."""
+    return f"{user_id}/{bot_id}/_cache/pdf_partition"
+
+
+def compose_youtube_transcript_cache_s3_prefix(user_id: str, bot_id: str) -> str:
+    """Compose S3 prefix for the cache of YouTube transcripts."""
+    return f"{user_id}/{bot_id}/_cache/youtube_transcripts"
+
+
 def delete_file_from_s3(bucket: str, key: str):
     client = boto3.client("s3")
 
@@ -238,28 +305,17 @@ def query_postgres(
         example: ((1, 'Alice'), (2, 'Bob')) if include_columns is False
                  (('id', 'name'), (1, 'Alice'), (2, 'Bob')) if include_columns is True
     """
-    secrets: Any = parameters.get_secret(DB_SECRETS_ARN)  # type: ignore
-    db_info = json.loads(secrets)
-
-    conn = pg8000.connect(
-        database=db_info["dbname"],
-        host=db_info["host"],
-        port=db_info["port"],
-        user=db_info["username"],
-        password=db_info["password"],
-    )
-
     args = params if params else ()
     try:
-        with conn.cursor() as cursor:
-            cursor.execute(query, args=args)
-            res = cursor.fetchall()
-            columns = tuple([desc[0] for desc in cursor.description])
+        # Connections are pooled and kept warm across invocations
+        with get_pool().connection() as pooled:
+            with pooled.conn.cursor() as cursor:
+                cursor.execute(query, args=args)
+                res = cursor.fetchall()
+                columns = tuple([desc[0] for desc in cursor.description])
     except Exception as e:
         logger.error(f"Error executing query: {e}")
         raise e
-    finally:
-        conn.close()
 
     logger.debug(f"{len(res)} records found.")
 
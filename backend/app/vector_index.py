@@ -0,0 +1,179 @@
+"""Approximate nearest neighbor (ANN) indexes of the pgvector `items` table.
+
+Rows of all bots share `items`. A single ANN index over the table returns the nearest
+rows of any bot and drops rows of other bots afterwards, so a filtered search may
+return fewer rows than requested. Two strategies avoid it:
+
+- `per_bot` (default): bots with at least `BOT_INDEX_MIN_ROWS` rows get a partial HNSW
+  index of their own (`WHERE botid = ...`). Smaller bots are searched exactly through
+  `idx_items_botid`, which is fast at that size.
+- `iterative`: a single HNSW index over the table, searched with iterative index scans
+  until enough rows of the bot are found. Requires pgvector 0.8.0 or later.
+
+The full-text index used by hybrid search (see `app.vector_search`) is managed here too.
+
+Ref: https://github.com/pgvector/pgvector#filtering
+"""
+
+import logging
+import os
+import re
+from typing import Literal
+
+logger = logging.getLogger(__name__)
+
+type_index_strategy = Literal["per_bot", "iterative"]
+INDEX_STRATEGY: type_index_strategy = os.environ.get("PGVECTOR_INDEX_STRATEGY", "per_bot")  # type: ignore
+# Bots with fewer rows are searched exactly without an ANN index.
+BOT_INDEX_MIN_ROWS = int(os.environ.get("PGVECTOR_BOT_INDEX_MIN_ROWS", 10000))
+# Build parameters of HNSW indexes (defaults of pgvector).
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 64
+# Search parameters used when the bot does not set them.
+DEFAULT_EF_SEARCH = int(os.environ.get("PGVECTOR_EF_SEARCH", 100))
+DEFAULT_PROBES = int(os.environ.get("PGVECTOR_PROBES", 10))
+# Upper bound of `hnsw.ef_search` accepted by pgvector.
+MAX_EF_SEARCH = 1000
+
+# Index created by older versions of `setup-pgvector`. It was built on an empty table
+# and is replaced by the indexes managed here.
+LEGACY_INDEX_NAME = "idx_items_embedding"
+TABLE_INDEX_NAME = "idx_items_embedding_hnsw"
+# Full-text index of `content`. `simple` does not stem, since contents are multilingual.
+TEXT_INDEX_NAME = "idx_items_content_tsv"
+TEXT_SEARCH_CONFIG = "simple"
+TEXT_SEARCH_VECTOR = f"to_tsvector('{TEXT_SEARCH_CONFIG}', content)"
+
+_BOT_ID_PATTERN = re.compile(r"^[0-9A-Za-z]+$")
+
+
+def compose_bot_index_name(bot_id: str) -> str:
+    return f"idx_items_embedding_{bot_id.strip().lower()}"
+
+
+def _quote_bot_id(bot_id: str) -> str:
+    """Quote the bot id as a literal, since index predicates cannot be parameterized."""
+    bot_id = bot_id.strip()
+    if not _BOT_ID_PATTERN.match(bot_id):
+        raise ValueError(f"Invalid bot id: {bot_id}")
+    return f"'{bot_id}'"
+
+
+def _index_status(cursor, index_name: str) -> bool | None:
+    """Returns whether the index is valid, or None if it does not exist.
+    An index is left invalid when `CREATE INDEX CONCURRENTLY` fails.
+    """
+    cursor.execute(
+        "SELECT i.indisvalid FROM pg_index i WHERE i.indexrelid = to_regclass(%s)",
+        (index_name,),
+    )
+    row = cursor.fetchone()
+    return None if row is None else bool(row[0])
+
+
+def _create_index(cursor, index_name: str, definition: str):
+    if _index_status(cursor, index_name) is False:
+        logger.info(f"Dropping invalid index {index_name}")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+    cursor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON items {definition}"
+    )
+
+
+def _create_hnsw_index(cursor, index_name: str, predicate: str = ""):
+    _create_index(
+        cursor,
+        index_name,
+        f"""USING hnsw (embedding vector_l2_ops)
+            WITH (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION}) {predicate}""",
+    )
+
+
+def _run_autocommit(conn, func):
+    """Run `func(cursor)` outside of a transaction, as `CONCURRENTLY` requires."""
+    conn.commit()
+    autocommit = conn.autocommit
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            return func(cursor)
+    finally:
+        conn.autocommit = autocommit
+
+
+def ensure_table_index(conn, strategy: type_index_strategy = INDEX_STRATEGY):
+    """Create (or drop) indexes over the whole table for the strategy, and the
+    full-text index.
+    """
+
+    def _ensure(cursor):
+        _create_index(cursor, TEXT_INDEX_NAME, f"USING gin ({TEXT_SEARCH_VECTOR})")
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {LEGACY_INDEX_NAME}")
+        if strategy == "iterative":
+            _create_hnsw_index(cursor, TABLE_INDEX_NAME)
+        else:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {TABLE_INDEX_NAME}")
+
+    _run_autocommit(conn, _ensure)
+
+
+def ensure_bot_index(
+    conn,
+    bot_id: str,
+    strategy: type_index_strategy = INDEX_STRATEGY,
+    min_rows: int = BOT_INDEX_MIN_ROWS,
+) -> bool:
+    """Create the partial index of the bot if it has enough rows, or drop it otherwise.
+    Returns whether the bot has an index after the call.
+    """
+    if strategy != "per_bot":
+        return False
+    index_name = compose_bot_index_name(bot_id)
+
+    def _ensure(cursor) -> bool:
+        cursor.execute("SELECT count(*) FROM items WHERE botid = %s", (bot_id,))
+        count = cursor.fetchone()[0]
+        if count < min_rows:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            return False
+        if _index_status(cursor, index_name) is not True:
+            logger.info(f"Creating index {index_name} for {count} rows")
+            _create_hnsw_index(
+                cursor, index_name, f"WHERE botid = {_quote_bot_id(bot_id)}"
+            )
+        return True
+
+    return _run_autocommit(conn, _ensure)
+
+
+def drop_bot_index(conn, bot_id: str):
+    index_name = compose_bot_index_name(bot_id)
+    _run_autocommit(
+        conn,
+        lambda cursor: cursor.execute(
+            f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"
+        ),
+    )
+
+
+def compose_search_settings(
+    limit: int,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    strategy: type_index_strategy = INDEX_STRATEGY,
+) -> dict[str, str]:
+    """Session settings for a similarity search of `limit` rows."""
+    settings = {
+        # HNSW returns at most `ef_search` rows
+        "hnsw.ef_search": str(
+            min(max(ef_search or DEFAULT_EF_SEARCH, limit), MAX_EF_SEARCH)
+        ),
+        "ivfflat.probes": str(probes or DEFAULT_PROBES),
+    }
+    if strategy == "per_bot":
+        # Partial indexes are only used by plans made for the given bot id.
+        # Generic plans of prepared statements would fall back to a scan.
+        settings["plan_cache_mode"] = "force_custom_plan"
+    else:
+        settings["hnsw.iterative_scan"] = "strict_order"
+    return settings
@@ -1,24 +1,44 @@
-import json
 import logging
 import re
-from typing import Any, Literal
+from array import array
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Literal, Sequence, TypeVar
 
 from app.bedrock import calculate_query_embedding
+from app.postgres import get_pool
+from app.vector_index import (
+    TEXT_SEARCH_CONFIG,
+    TEXT_SEARCH_VECTOR,
+    compose_search_settings,
+)
 from app.repositories.custom_bot import find_public_bot_by_id
 from app.repositories.models.custom_bot import BotModel
-from app.utils import generate_presigned_url, get_bedrock_agent_client, query_postgres
+from app.routes.schemas.bot import type_search_type
+from app.utils import generate_presigned_url, get_bedrock_agent_client
 from botocore.exceptions import ClientError
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 logger = logging.getLogger(__name__)
 agent_client = get_bedrock_agent_client()
 
+# Candidates fetched by each retriever of hybrid search, per requested result.
+HYBRID_CANDIDATES_FACTOR = 2
+# Constant of reciprocal rank fusion, which damps the weight of the top ranks.
+# Ref: https://plg.uwaterloo.ca/~gvcormac/cormacksigir09-rrf.pdf
+RRF_K = 60
+
+T = TypeVar("T")
+_WORD_PATTERN = re.compile(r"\w+")
+_executor: ThreadPoolExecutor | None = None
+
 
 class SearchResult(BaseModel):
     bot_id: str
     content: str
     source: str
     rank: int
+    # Stored embedding of the content, only fetched for reranking (see `app.rerank`)
+    embedding: list[float] | None = Field(default=None, repr=False, exclude=True)
 
 
 def filter_used_results(
@@ -66,35 +86,173 @@ def get_source_link(source: str) -> tuple[Literal["s3", "url"], str]:
         return "url", f"https://www.youtube.com/watch?v={source}"
 
 
-def _pgvector_search(bot_id: str, limit: int, query: str) -> list[SearchResult]:
+def encode_query_vector(embedding: Sequence[float]) -> str:
+    """Encode the embedding as a pgvector literal with float32 precision, which is
+    how pgvector stores it. About half the size of `json.dumps` of Python floats.
+    pg8000 sends all parameters in text format, so a binary encoding is not possible.
+    """
+    # Rounded to float32 by `array`
+    values = array("f", embedding).tolist()
+    return "[" + ",".join(["%.9g" % v for v in values]) + "]"
+
+
+def decode_vector(text: str) -> list[float]:
+    """Decode the text representation of a pgvector value."""
+    return array("f", map(float, text[1:-1].split(","))).tolist()
+
+
+def _compose_columns(with_embeddings: bool) -> str:
+    columns = "id, botid, content, source"
+    return columns + ", embedding::text" if with_embeddings else columns
+
+
+def compose_text_query(query: str) -> str | None:
+    """Compose a `tsquery` which matches rows containing any word of the query.
+    Returns None if the query has no words.
+    """
+    words = dict.fromkeys(w.lower() for w in _WORD_PATTERN.findall(query))
+    if len(words) == 0:
+        return None
+    return " | ".join(f"'{w}'" for w in words)
+
+
+def reciprocal_rank_fusion(
+    rankings: list[list[T]], key: Callable[[T], Any], k: int = RRF_K
+) -> list[T]:
+    """Merge rankings by the sum of `1 / (k + rank)` of each item over the rankings."""
+    scores: dict[Any, float] = {}
+    items: dict[Any, T] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            item_key = key(item)
+            scores[item_key] = scores.get(item_key, 0.0) + 1.0 / (k + rank)
+            items.setdefault(item_key, item)
+    return [items[item_key] for item_key in sorted(scores, key=lambda x: -scores[x])]
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=4)
+    return _executor
+
+
+def _vector_search(
+    bot_id: str,
+    limit: int,
+    query: str,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    with_embeddings: bool = False,
+) -> tuple:
+    query_embedding = calculate_query_embedding(query)
+    logger.debug(f"query_embedding: {query_embedding}")
+
+    # The statement is prepared once per pooled connection and reused afterwards.
+    # Embeddings are only selected for reranking, since they dominate the result size.
+    search_query = f"""
+SELECT {_compose_columns(with_embeddings)}
+FROM items
+WHERE botid = :bot_id
+ORDER BY embedding <-> :embedding
+LIMIT :limit
+"""
+    with get_pool().connection() as pooled:
+        pooled.apply_settings(compose_search_settings(limit, ef_search, probes))
+        return pooled.run_prepared(
+            search_query,
+            bot_id=bot_id,
+            embedding=encode_query_vector(query_embedding),
+            limit=limit,
+        )
+
+
+def _text_search(
+    bot_id: str, limit: int, text_query: str, with_embeddings: bool = False
+) -> tuple:
+    # Uses the full-text index of `app.vector_index`
+    search_query = f"""
+SELECT {_compose_columns(with_embeddings)}
+FROM items
+WHERE botid = :bot_id
+AND {TEXT_SEARCH_VECTOR} @@ to_tsquery('{TEXT_SEARCH_CONFIG}', :text_query)
+ORDER BY ts_rank_cd({TEXT_SEARCH_VECTOR}, to_tsquery('{TEXT_SEARCH_CONFIG}', :text_query)) DESC
+LIMIT :limit
+"""
+    with get_pool().connection() as pooled:
+        return pooled.run_prepared(
+            search_query, bot_id=bot_id, text_query=text_query, limit=limit
+        )
+
+
+def _pgvector_search(
+    bot_id: str,
+    limit: int,
+    query: str,
+    ef_search: int | None = None,
+    probes: int | None = None,
+    search_type: type_search_type = "vector",
+    with_embeddings: bool = False,
+) -> list[SearchResult]:
     """Search to fetch top n most related documents from pgvector.
     Args:
         bot_id (str): bot id
         limit (int): number of results to return
         query (str): query string
+        ef_search (int | None): `hnsw.ef_search` of the search (see `app.vector_index`)
+        probes (int | None): `ivfflat.probes` of the search
+        search_type (type_search_type): `hybrid` also runs a full-text search in
+            parallel on another pooled connection, and fuses both rankings
+        with_embeddings (bool): also fetch the embeddings of the results
     Returns:
         list[SearchResult]: list of search results
     """
-    query_embedding = calculate_query_embedding(query)
-    logger.info(f"query_embedding: {query_embedding}")
-
-    search_query = """
-SELECT id, botid, content, source, embedding 
-FROM items 
-WHERE botid = %s 
-ORDER BY embedding <-> %s 
-LIMIT %s
-"""
-
-    results = query_postgres(search_query, (bot_id, json.dumps(query_embedding), limit))
+    try:
+        if search_type == "hybrid":
+            candidates = limit * HYBRID_CANDIDATES_FACTOR
+            text_query = compose_text_query(query)
+            text_future = (
+                _get_executor().submit(
+                    _text_search, bot_id, candidates, text_query, with_embeddings
+                )
+                if text_query is not None
+                else None
+            )
+            try:
+                vector_results = _vector_search(
+                    bot_id, candidates, query, ef_search, probes, with_embeddings
+                )
+            except Exception:
+                # Not to leave the text search holding a pooled connection
+                if text_future is not None and not text_future.cancel():
+                    wait([text_future])
+                raise
+            text_results = text_future.result() if text_future is not None else ()
+            results = reciprocal_rank_fusion(
+                [list(vector_results), list(text_results)], key=lambda r: r[0]
+            )[:limit]
+        else:
+            results = _vector_search(
+                bot_id, limit, query, ef_search, probes, with_embeddings
+            )
+    except Exception as e:
+        logger.error(f"Error executing query: {e}")
+        raise e
     # NOTE: results should be:
     # [
-    #     ('123', 'bot_1', 'content_1', 'source_1', [0.123, 0.456, 0.789]),
-    #     ('124', 'bot_1', 'content_2', 'source_2', [0.234, 0.567, 0.890]),
+    #     ('123', 'bot_1', 'content_1', 'source_1'),
+    #     ('124', 'bot_1', 'content_2', 'source_2'),
     #     ...
     # ]
+    # followed by the embedding if `with_embeddings`.
     return [
-        SearchResult(rank=i, bot_id=r[1], content=r[2], source=r[3])
+        SearchResult(
+            rank=i,
+            bot_id=r[1],
+            content=r[2],
+            source=r[3],
+            embedding=decode_vector(r[4]) if with_embeddings else None,
+        )
         for i, r in enumerate(results)
     ]
 
@@ -148,4 +306,12 @@ def search_related_docs(bot: BotModel, query: str) -> list[SearchResult]:
         logger.info("Searching related documents using Bedrock Knowledge Base.")
         return _bedrock_knowledge_base_search(bot, query)
     logger.info("Searching related documents using pgvector.")
-    return _pgvector_search(bot.id, bot.search_params.max_results, query)
+    return _pgvector_search(
+        bot.id,
+        bot.search_params.max_results,
+        query,
+        ef_search=bot.search_params.ef_search,
+        probes=bot.search_params.probes,
+        search_type=bot.search_params.search_type,
+        with_embeddings=bot.search_params.enable_rerank,
+    )
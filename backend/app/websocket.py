@@ -4,6 +4,7 @@ import os
 import traceback
 from datetime import datetime
 from decimal import Decimal as decimal
+from typing import Any
 
 import boto3
 from app.agents.agent import AgentExecutor, create_react_agent, format_log_to_str
@@ -17,12 +18,14 @@ from app.auth import verify_token
 from app.bedrock import compose_args_for_converse_api
 from app.repositories.conversation import RecordNotFoundError, store_conversation
 from app.repositories.models.conversation import ChunkModel, ContentModel, MessageModel
+from app.rerank import rerank_for_bot
 from app.routes.schemas.conversation import ChatInput
 from app.stream import ConverseApiStreamHandler, OnStopInput
 from app.usecases.bot import modify_bot_last_used_time
 from app.usecases.chat import insert_knowledge, prepare_conversation, trace_to_root
 from app.utils import get_current_time
 from app.vector_search import filter_used_results, get_source_link, search_related_docs
+from app.websocket_sender import WebsocketSender
 from boto3.dynamodb.conditions import Attr, Key
 from ulid import ULID
 
@@ -34,6 +37,18 @@ table = dynamodb_client.Table(WEBSOCKET_SESSION_TABLE_NAME)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# API Gateway management clients by endpoint, reused across invocations to keep the
+# connections alive
+_gatewayapi_clients: dict[str, Any] = {}
+
+
+def _get_gatewayapi_client(endpoint_url: str):
+    if endpoint_url not in _gatewayapi_clients:
+        _gatewayapi_clients[endpoint_url] = boto3.client(
+            "apigatewaymanagementapi", endpoint_url=endpoint_url
+        )
+    return _gatewayapi_clients[endpoint_url]
+
 
 def process_chat_input(
     user_id: str, chat_input: ChatInput, gatewayapi, connection_id: str
@@ -169,6 +184,7 @@ def process_chat_input(
         # NOTE: Currently embedding not support multi-modal. For now, use the last text content.
         query: str = conversation.message_map[user_msg_id].content[-1].body  # type: ignore[assignment]
         search_results = search_related_docs(bot=bot, query=query)
+        search_results = rerank_for_bot(bot, query, search_results)
         logger.info(f"Search results from vector store: {search_results}")
 
         # Insert contexts to instruction
@@ -197,12 +213,12 @@ def process_chat_input(
         generation_params=(bot.generation_params if bot else None),
     )
 
+    # Tokens are coalesced and posted in the background, not to block the stream
+    sender = WebsocketSender(gatewayapi, connection_id)
+
     def on_stream(token: str, **kwargs) -> None:
         # Send completion
-        data_to_send = json.dumps(dict(status="STREAMING", completion=token)).encode(
-            "utf-8"
-        )
-        gatewayapi.post_to_connection(ConnectionId=connection_id, Data=data_to_send)
+        sender.send_token(token)
 
     def on_stop(arg: OnStopInput, **kwargs) -> None:
         if chat_input.continue_generate:
@@ -258,11 +274,8 @@ def process_chat_input(
 
         # Store conversation before finish streaming so that front-end can avoid 404 issue
         store_conversation(user_id, conversation)
-        last_data_to_send = json.dumps(
+        sender.send(
             dict(status="STREAMING_END", completion="", stop_reason=arg.stop_reason)
-        ).encode("utf-8")
-        gatewayapi.post_to_connection(
-            ConnectionId=connection_id, Data=last_data_to_send
         )
 
     stream_handler = ConverseApiStreamHandler(
@@ -271,9 +284,18 @@ def process_chat_input(
         on_stop=on_stop,
     )
     try:
-        for _ in stream_handler.run(args):
-            # `StreamHandler.run` returns a generator, so need to iterate
-            ...
+        with sender:
+            stream = stream_handler.run(args)
+            for _ in stream:
+                # `StreamHandler.run` returns a generator, so need to iterate
+                if sender.error is not None:
+                    # e.g. the client has disconnected, so stop generating
+                    logger.warning(f"Stopped streaming: {sender.error}")
+                    stream.close()
+                    return {
+                        "statusCode": 500,
+                        "body": "Failed to send the message.",
+                    }
     except Exception as e:
         logger.error(f"Failed to run stream handler: {e}")
         logger.error(f"Dongping: {args}")
@@ -303,7 +325,7 @@ def handler(event, context):
     domain_name = event["requestContext"]["domainName"]
     stage = event["requestContext"]["stage"]
     endpoint_url = f"https://{domain_name}/{stage}"
-    gatewayapi = boto3.client("apigatewaymanagementapi", endpoint_url=endpoint_url)
+    gatewayapi = _get_gatewayapi_client(endpoint_url)
 
     now = datetime.now()
     expire = int(now.timestamp()) + 60 * 2  # 2 minute from now
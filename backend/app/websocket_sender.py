@@ -0,0 +1,133 @@
+"""Delivery of streamed messages to a websocket connection.
+
+Posting each token to API Gateway blocks reading the Bedrock stream for a round trip
+per few characters. `WebsocketSender` queues the messages instead, and posts them from
+a background thread. Consecutive tokens are coalesced into one `STREAMING` message
+until the time window passes or the size is reached, while the order of all the
+messages is kept, so that `STREAMING_END` is always posted last.
+"""
+
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any
+
+logger = logging.getLogger(__name__)
+
+# Tokens are held at most this long before posted, except the first one
+WEBSOCKET_FLUSH_INTERVAL_SEC = float(
+    os.environ.get("WEBSOCKET_FLUSH_INTERVAL_SEC", 0.1)
+)
+# Tokens are posted once this many bytes are held. API Gateway limits frames to 32KB.
+WEBSOCKET_FLUSH_BYTES = int(os.environ.get("WEBSOCKET_FLUSH_BYTES", 4 * 1024))
+WEBSOCKET_MAX_QUEUE_SIZE = int(os.environ.get("WEBSOCKET_MAX_QUEUE_SIZE", 1024))
+
+_STOP = object()
+
+
+class WebsocketSender:
+    """Post messages to the connection from a background thread. Usable as a context
+    manager, which waits for all the queued messages to be posted on exit.
+    """
+
+    def __init__(
+        self,
+        gatewayapi: Any,
+        connection_id: str,
+        flush_interval_sec: float = WEBSOCKET_FLUSH_INTERVAL_SEC,
+        flush_bytes: int = WEBSOCKET_FLUSH_BYTES,
+        max_queue_size: int = WEBSOCKET_MAX_QUEUE_SIZE,
+    ):
+        self.gatewayapi = gatewayapi
+        self.connection_id = connection_id
+        self.flush_interval_sec = flush_interval_sec
+        self.flush_bytes = flush_bytes
+        # Bounded, so that the stream is read no faster than the client can follow
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self.error: Exception | None = None
+        self.token_count = 0
+        self.post_count = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def send_token(self, token: str):
+        """Queue the token to be posted as (a part of) a `STREAMING` message."""
+        self.token_count += 1
+        self._queue.put(token)
+
+    def send(self, data: dict):
+        """Queue the message, posted after the tokens queued before it."""
+        self._queue.put(data)
+
+    def close(self, timeout: float | None = None):
+        """Post all the queued messages, and stop the thread."""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        logger.info(
+            f"Posted {self.token_count} tokens in {self.post_count} messages"
+            + (f" (failed: {self.error})" if self.error else "")
+        )
+
+    def __enter__(self) -> "WebsocketSender":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _post(self, data: dict):
+        if self.error is not None:
+            # e.g. the client has disconnected, so the rest is dropped
+            return
+        try:
+            self.gatewayapi.post_to_connection(
+                ConnectionId=self.connection_id,
+                Data=json.dumps(data).encode("utf-8"),
+            )
+            self.post_count += 1
+        except Exception as e:
+            logger.error(f"Failed to post to connection {self.connection_id}: {e}")
+            self.error = e
+
+    def _run(self):
+        tokens: list[str] = []
+        size = 0
+        deadline = 0.0
+
+        def flush():
+            nonlocal tokens, size
+            if len(tokens) > 0:
+                self._post(dict(status="STREAMING", completion="".join(tokens)))
+                tokens, size = [], 0
+
+        while True:
+            try:
+                item = self._queue.get(
+                    timeout=(
+                        max(deadline - time.monotonic(), 0) if len(tokens) > 0 else None
+                    )
+                )
+            except queue.Empty:
+                flush()
+                continue
+
+            if isinstance(item, str):
+                if len(tokens) == 0:
+                    deadline = time.monotonic() + self.flush_interval_sec
+                tokens.append(item)
+                size += len(item.encode("utf-8"))
+                # The first token is posted at once, for the time to first token
+                if size >= self.flush_bytes or self.post_count == 0:
+                    flush()
+                continue
+
+            flush()
+            if item is _STOP:
+                return
+            self._post(item)
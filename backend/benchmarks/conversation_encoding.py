@@ -0,0 +1,172 @@
+"""Compare the size and the (de)serialization time of message maps, as stored before
+(`json` text) and after (`pydantic_core` JSON compressed by `app.repositories.message_codec`),
+over synthetic conversations of growing size.
+
+```
+cd backend
+poetry run python benchmarks/conversation_encoding.py --turns 10 100 500 --repeat 20
+```
+
+`decode` parses all the messages, as `fetch_conversation` does. `decode (path)` parses
+only the messages from the last one to the root, as generating a reply does. Messages
+are parsed by `_parse_message` in both, so that only the formats are compared.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, ".")
+
+from app.repositories.conversation import (
+    LazyMessageMap,
+    _dump_message_map,
+    _load_message_map,
+    _parse_message,
+)
+from app.repositories.message_codec import encode_message_json, get_encoded_size
+from app.repositories.models.conversation import (
+    ChunkModel,
+    ContentModel,
+    MessageModel,
+)
+from app.usecases.chat import trace_to_root
+
+WORDS = (
+    "bedrock claude model knowledge bot conversation message answer question "
+    "document search vector embedding region lambda table bucket price token"
+).split()
+
+
+def _text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _message(
+    rng: random.Random, role: str, parent: str | None, children: list[str]
+) -> MessageModel:
+    return MessageModel(
+        role=role,
+        content=[
+            ContentModel(
+                content_type="text",
+                body=_text(rng, 150 if role == "assistant" else 30),
+                media_type=None,
+                file_name=None,
+            )
+        ],
+        model="claude-v3-haiku",
+        children=children,
+        parent=parent,
+        create_time=1700000000.0 + rng.random(),
+        feedback=None,
+        used_chunks=(
+            [
+                ChunkModel(
+                    content=_text(rng, 80),
+                    content_type="s3",
+                    source=f"s3://bucket/docs/{rng.randrange(100)}.pdf",
+                    rank=rank,
+                )
+                for rank in range(3)
+            ]
+            if role == "assistant"
+            else None
+        ),
+        thinking_log=None,
+    )
+
+
+def create_message_map(turns: int) -> tuple[dict[str, MessageModel], str]:
+    """Message map of the turns, and the id of the last message. Every other reply is
+    regenerated, so that the former one is off the path.
+    """
+    rng = random.Random(turns)
+    message_map = {"system": _message(rng, "system", None, [])}
+    parent = "system"
+    for i in range(turns):
+        for role in ("user", "assistant"):
+            message_id = f"{role}-{i}"
+            if role == "assistant" and i % 2 == 0:
+                message_map[f"{message_id}-former"] = _message(rng, role, parent, [])
+                message_map[parent].children.append(f"{message_id}-former")
+            message_map[message_id] = _message(rng, role, parent, [])
+            message_map[parent].children.append(message_id)
+            parent = message_id
+    return message_map, parent
+
+
+def _measure(func, repeat: int) -> float:
+    """Median of the elapsed milliseconds."""
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append((time.perf_counter() - start) * 1000)
+    return statistics.median(elapsed)
+
+
+def run(turns: int, repeat: int):
+    message_map, last_message_id = create_message_map(turns)
+
+    before = json.dumps({k: v.model_dump() for k, v in message_map.items()})
+    after = encode_message_json(_dump_message_map(message_map))
+
+    results = {
+        "before": {
+            "size": get_encoded_size(before),
+            "encode": _measure(
+                lambda: json.dumps({k: v.model_dump() for k, v in message_map.items()}),
+                repeat,
+            ),
+            "decode": _measure(
+                lambda: {k: _parse_message(v) for k, v in json.loads(before).items()},
+                repeat,
+            ),
+            "decode (path)": _measure(
+                lambda: trace_to_root(
+                    last_message_id,
+                    {k: _parse_message(v) for k, v in json.loads(before).items()},
+                ),
+                repeat,
+            ),
+        },
+        "after": {
+            "size": get_encoded_size(after),
+            "encode": _measure(
+                lambda: encode_message_json(_dump_message_map(message_map)), repeat
+            ),
+            "decode": _measure(
+                lambda: dict(LazyMessageMap(_load_message_map(after)).items()),
+                repeat,
+            ),
+            "decode (path)": _measure(
+                lambda: trace_to_root(
+                    last_message_id, LazyMessageMap(_load_message_map(after))
+                ),
+                repeat,
+            ),
+        },
+    }
+
+    for label, result in results.items():
+        print(
+            f"[{label}] turns={turns} messages={len(message_map)} "
+            f"size={result['size'] / 1024:.1f}KB "
+            f"encode={result['encode']:.2f}ms "
+            f"decode={result['decode']:.2f}ms "
+            f"decode_path={result['decode (path)']:.2f}ms"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 500])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    for turns in args.turns:
+        run(turns, args.repeat)
@@ -0,0 +1,84 @@
+"""Helpers to run benchmarks against a local PostgreSQL with pgvector.
+
+Start one with e.g. `docker run -p 5432:5432 -e POSTGRES_PASSWORD=postgres pgvector/pgvector:pg16`.
+Connection parameters are taken from the command line or the standard `PG*` variables.
+"""
+
+import argparse
+import json
+import os
+import random
+
+import pg8000
+
+DIMENSION = 1024
+
+
+def add_postgres_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--host", default=os.environ.get("PGHOST", "localhost"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PGPORT", 5432)))
+    parser.add_argument("--user", default=os.environ.get("PGUSER", "postgres"))
+    parser.add_argument("--password", default=os.environ.get("PGPASSWORD", "postgres"))
+    parser.add_argument("--database", default=os.environ.get("PGDATABASE", "postgres"))
+    parser.add_argument(
+        "--unix-sock",
+        default=os.environ.get("PGUNIXSOCK"),
+        help="Path of the unix socket, e.g. /tmp/pgdata/.s.PGSQL.5432",
+    )
+
+
+def connect(args: argparse.Namespace) -> pg8000.Connection:
+    if args.unix_sock:
+        return pg8000.connect(
+            user=args.user, database=args.database, unix_sock=args.unix_sock
+        )
+    return pg8000.connect(
+        host=args.host,
+        port=args.port,
+        user=args.user,
+        password=args.password,
+        database=args.database,
+    )
+
+
+def random_embedding(rng: random.Random, dimension: int = DIMENSION) -> list[float]:
+    return [rng.uniform(-1, 1) for _ in range(dimension)]
+
+
+def setup_items_table(
+    conn: pg8000.Connection, bots: int, chunks_per_bot: int, seed: int = 0
+) -> list[str]:
+    """(Re)create the `items` table as `setup-pgvector` does and fill it with random rows.
+    Returns the bot ids.
+    """
+    rng = random.Random(seed)
+    cursor = conn.cursor()
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cursor.execute("DROP TABLE IF EXISTS items")
+    cursor.execute(
+        f"""CREATE TABLE items(
+            id CHAR(26) primary key,
+            botid CHAR(26),
+            content text,
+            source text,
+            embedding vector({DIMENSION}))"""
+    )
+    cursor.execute("CREATE INDEX idx_items_botid ON items (botid)")
+
+    bot_ids = [f"BOT{i:023d}" for i in range(bots)]
+    for b, bot_id in enumerate(bot_ids):
+        cursor.executemany(
+            "INSERT INTO items (id, botid, content, source, embedding) VALUES (%s, %s, %s, %s, %s)",
+            [
+                (
+                    f"{b:06d}{i:020d}",
+                    bot_id,
+                    f"content {i} of {bot_id}",
+                    f"s3://bucket/{bot_id}/{i}.txt",
+                    json.dumps(random_embedding(rng)),
+                )
+                for i in range(chunks_per_bot)
+            ],
+        )
+    conn.commit()
+    return bot_ids
@@ -0,0 +1,271 @@
+"""Compare recall and latency of filtered similarity search with the indexes of
+`app.vector_index` on a synthetic corpus.
+
+```
+cd backend
+poetry run python benchmarks/pgvector_ann_recall.py --large-bot-rows 20000 --small-bots 20
+```
+
+The corpus has one large bot and several small bots sharing `items`, with embeddings
+drawn around random centers (one set of topics per bot). Queries are drawn the same
+way, and exact neighbors are computed with numpy to measure recall@limit. Configurations:
+
+- `exact`: no ANN index, rows of the bot are scanned through `idx_items_botid`
+- `ivfflat`: a single IVFFlat index over the table, as `setup-pgvector` used to create
+- `hnsw-table`: a single HNSW index over the table, without iterative scans
+- `hnsw-iterative`: same with iterative scans (pgvector 0.8.0 or later)
+- `hnsw-per-bot`: partial HNSW indexes of bots with enough rows (`per_bot` strategy)
+"""
+
+import argparse
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "benchmarks")
+
+from app.postgres import ConnectionPool
+from app.vector_index import (
+    compose_search_settings,
+    ensure_bot_index,
+    ensure_table_index,
+)
+from app.vector_search import encode_query_vector
+from embedding.vector_store import encode_binary_copy_rows
+from local_postgres import DIMENSION, add_postgres_args, connect
+
+SEARCH_QUERY = """
+SELECT id, botid, content, source
+FROM items
+WHERE botid = :bot_id
+ORDER BY embedding <-> :embedding
+LIMIT :limit
+"""
+
+
+def _clustered(
+    rng: np.random.Generator, centers: np.ndarray, n: int, spread: float
+) -> np.ndarray:
+    labels = rng.integers(0, len(centers), n)
+    points = centers[labels] + rng.normal(0, spread, (n, centers.shape[1]))
+    return (points / np.linalg.norm(points, axis=1, keepdims=True)).astype(np.float32)
+
+
+def setup_corpus(conn, bot_sizes: dict[str, int], seed: int = 0) -> dict:
+    """(Re)create `items` and fill it. Returns the embeddings and topics of each bot."""
+    rng = np.random.default_rng(seed)
+    cursor = conn.cursor()
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cursor.execute("DROP TABLE IF EXISTS items")
+    cursor.execute(
+        f"""CREATE TABLE items(
+            id CHAR(26) primary key,
+            botid CHAR(26),
+            content text,
+            source text,
+            embedding vector({DIMENSION}),
+            content_hash CHAR(64))"""
+    )
+    cursor.execute("CREATE INDEX idx_items_botid ON items (botid)")
+    corpus = {}
+    for bot_id, size in bot_sizes.items():
+        centers = rng.normal(0, 1, (16, DIMENSION))
+        embeddings = _clustered(rng, centers, size, spread=0.6)
+        cursor.execute(
+            "COPY items (id, botid, content, source, embedding, content_hash) FROM STDIN WITH (FORMAT BINARY)",
+            stream=encode_binary_copy_rows(
+                bot_id,
+                [f"content {i}" for i in range(size)],
+                [f"s3://bucket/{bot_id}/{i}.txt" for i in range(size)],
+                embeddings,
+                ["0" * 64] * size,
+            ),
+        )
+        corpus[bot_id] = (centers, embeddings)
+    conn.commit()
+    cursor.execute("ANALYZE items")
+    conn.commit()
+    return corpus
+
+
+def exact_neighbors(embeddings: np.ndarray, query: np.ndarray, limit: int) -> set[int]:
+    distances = np.linalg.norm(embeddings - query, axis=1)
+    return set(np.argsort(distances)[:limit].tolist())
+
+
+def run_queries(
+    pool: ConnectionPool,
+    queries: list[tuple[str, np.ndarray, set[int]]],
+    limit: int,
+    settings: dict[str, str],
+) -> tuple[float, list[float], float]:
+    """Returns mean recall, latencies and the mean number of returned rows."""
+    recalls, latencies, counts = [], [], []
+    for bot_id, query, truth in queries:
+        start = time.perf_counter()
+        with pool.connection() as pooled:
+            pooled.apply_settings(settings)
+            rows = pooled.run_prepared(
+                SEARCH_QUERY,
+                bot_id=bot_id,
+                embedding=encode_query_vector(query),
+                limit=limit,
+            )
+        latencies.append(time.perf_counter() - start)
+        # `content` is "content {index}"
+        found = {int(r[2].split(" ")[1]) for r in rows}
+        recalls.append(len(found & truth) / limit)
+        counts.append(len(rows))
+    return statistics.mean(recalls), latencies, statistics.mean(counts)
+
+
+def _summary(label: str, recall: float, latencies: list[float], rows: float):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(
+        f"[{label:<32}] recall={recall:.3f} rows={rows:5.1f} p50={p50:7.2f}ms p95={p95:7.2f}ms"
+    )
+
+
+def _drop_ann_indexes(conn):
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'items' AND indexname LIKE %s",
+            ("idx_items_embedding%",),
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute(f"DROP INDEX {name}")
+    conn.autocommit = False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_postgres_args(parser)
+    parser.add_argument("--large-bot-rows", type=int, default=20000)
+    parser.add_argument("--small-bots", type=int, default=20)
+    parser.add_argument("--small-bot-rows", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--ef-search", type=int, nargs="+", default=[40, 100, 200])
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+
+    bot_sizes = {f"LARGE{0:021d}": args.large_bot_rows}
+    for i in range(args.small_bots):
+        bot_sizes[f"SMALL{i:021d}"] = args.small_bot_rows
+
+    conn = connect(args)
+    (version,) = conn.run("SELECT extversion FROM pg_extension WHERE extname = 'vector'")[0]  # type: ignore
+    print(f"pgvector {version}, rows: {sum(bot_sizes.values())}")
+    start = time.perf_counter()
+    corpus = setup_corpus(conn, bot_sizes)
+    print(f"loaded in {time.perf_counter() - start:.1f}s")
+
+    rng = np.random.default_rng(1)
+    query_sets = {}
+    for label, bot_ids in (
+        ("large", [b for b in bot_sizes if b.startswith("LARGE")]),
+        ("small", [b for b in bot_sizes if b.startswith("SMALL")]),
+    ):
+        queries = []
+        for _ in range(args.queries):
+            bot_id = bot_ids[rng.integers(0, len(bot_ids))]
+            centers, embeddings = corpus[bot_id]
+            query = _clustered(rng, centers, 1, spread=0.6)[0]
+            queries.append(
+                (bot_id, query, exact_neighbors(embeddings, query, args.limit))
+            )
+        query_sets[label] = queries
+
+    def measure(label: str, settings_list: list[tuple[str, dict[str, str]]]):
+        pool = ConnectionPool(connect=lambda: connect(args))
+        for name, settings in settings_list:
+            for set_label, queries in query_sets.items():
+                # Warm up the prepared statement and the buffer cache
+                run_queries(pool, queries[:5], args.limit, settings)
+                _summary(
+                    f"{label} {name} {set_label}",
+                    *run_queries(pool, queries, args.limit, settings),
+                )
+        pool.close_all()
+
+    # `force_custom_plan` is harmless without partial indexes
+    exact_settings = compose_search_settings(args.limit, strategy="per_bot")
+    measure("exact", [("", exact_settings)])
+
+    _drop_ann_indexes(conn)
+    start = time.perf_counter()
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "CREATE INDEX idx_items_embedding ON items USING ivfflat (embedding vector_l2_ops) WITH (lists = 100)"
+        )
+    conn.commit()
+    print(f"ivfflat built in {time.perf_counter() - start:.1f}s")
+    measure(
+        "ivfflat",
+        [
+            (
+                f"probes={p}",
+                compose_search_settings(args.limit, probes=p, strategy="per_bot"),
+            )
+            for p in args.probes
+        ],
+    )
+
+    _drop_ann_indexes(conn)
+    start = time.perf_counter()
+    ensure_table_index(conn, strategy="iterative")
+    print(f"hnsw over the table built in {time.perf_counter() - start:.1f}s")
+    measure(
+        "hnsw-table",
+        [
+            (
+                f"ef={ef}",
+                compose_search_settings(args.limit, ef_search=ef, strategy="per_bot"),
+            )
+            for ef in args.ef_search
+        ],
+    )
+    if tuple(int(v) for v in version.split(".")[:2]) >= (0, 8):
+        measure(
+            "hnsw-iterative",
+            [
+                (
+                    f"ef={ef}",
+                    compose_search_settings(
+                        args.limit, ef_search=ef, strategy="iterative"
+                    ),
+                )
+                for ef in args.ef_search
+            ],
+        )
+    else:
+        print("hnsw-iterative: skipped (requires pgvector 0.8.0 or later)")
+
+    _drop_ann_indexes(conn)
+    start = time.perf_counter()
+    for bot_id in bot_sizes:
+        ensure_bot_index(
+            conn, bot_id, strategy="per_bot", min_rows=args.small_bot_rows + 1
+        )
+    print(f"hnsw per bot built in {time.perf_counter() - start:.1f}s")
+    measure(
+        "hnsw-per-bot",
+        [
+            (
+                f"ef={ef}",
+                compose_search_settings(args.limit, ef_search=ef, strategy="per_bot"),
+            )
+            for ef in args.ef_search
+        ],
+    )
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Compare the time to replace all embeddings of a bot in the `items` table.
+
+```
+cd backend
+poetry run python benchmarks/pgvector_bulk_insert.py --chunks 5000
+```
+
+`insert` uses `executemany` with text vectors (as `insert_to_postgres` used to do),
+`copy` streams binary COPY directly into `items`, and
+`copy+staging` COPYs into a temporary table and swaps rows with `INSERT ... SELECT`.
+"""
+
+import argparse
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "benchmarks")
+
+from embedding.vector_store import (
+    compose_content_hash,
+    ensure_schema,
+    replace_bot_embeddings,
+)
+from local_postgres import add_postgres_args, connect, setup_items_table
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_postgres_args(parser)
+    parser.add_argument("--chunks", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    conn = connect(args)
+    bot_ids = setup_items_table(conn, bots=1, chunks_per_bot=args.chunks)
+    ensure_schema(conn)
+
+    rng = np.random.default_rng(0)
+    embeddings = rng.uniform(-1, 1, (args.chunks, 1024)).astype(np.float32)
+    contents = [
+        f"content {i} " + "lorem ipsum " * random.randint(50, 150)
+        for i in range(args.chunks)
+    ]
+    sources = [f"s3://bucket/{bot_ids[0]}/{i}.txt" for i in range(args.chunks)]
+    content_hashes = [compose_content_hash("model", c) for c in contents]
+
+    for label, mode, use_staging in (
+        ("insert", "insert", False),
+        ("copy", "copy", False),
+        ("copy+staging", "copy", True),
+    ):
+        elapsed = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            count = replace_bot_embeddings(
+                conn,
+                bot_ids[0],
+                contents,
+                sources,
+                embeddings,
+                content_hashes,
+                mode=mode,  # type: ignore
+                use_staging=use_staging,
+            )
+            elapsed.append(time.perf_counter() - start)
+        best = min(elapsed)
+        print(f"[{label}] rows={count} best={best:.2f}s rows/sec={count / best:,.0f}")
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM items WHERE botid = %s", (bot_ids[0],))
+        print(f"rows of the bot after replacement: {cursor.fetchone()[0]}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
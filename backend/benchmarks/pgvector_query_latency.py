@@ -0,0 +1,99 @@
+"""Compare per-query latency of the similarity search with and without the connection pool.
+
+```
+cd backend
+poetry run python benchmarks/pgvector_query_latency.py --queries 200
+```
+
+`before` opens a new connection per query (as `query_postgres` used to do),
+`after` uses `app.postgres.ConnectionPool` with the prepared similarity query.
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, ".")
+sys.path.insert(0, "benchmarks")
+
+from app.postgres import ConnectionPool
+from local_postgres import (
+    add_postgres_args,
+    connect,
+    random_embedding,
+    setup_items_table,
+)
+
+SEARCH_QUERY_FORMAT = """
+SELECT id, botid, content, source, embedding
+FROM items
+WHERE botid = %s
+ORDER BY embedding <-> %s
+LIMIT %s
+"""
+
+SEARCH_QUERY_NAMED = """
+SELECT id, botid, content, source, embedding
+FROM items
+WHERE botid = :bot_id
+ORDER BY embedding <-> :embedding
+LIMIT :limit
+"""
+
+
+def _summary(label: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies) * 1000
+    p95 = latencies[int(len(latencies) * 0.95) - 1] * 1000
+    print(f"[{label}] queries={len(latencies)} p50={p50:.2f}ms p95={p95:.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_postgres_args(parser)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--bots", type=int, default=5)
+    parser.add_argument("--chunks-per-bot", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    conn = connect(args)
+    bot_ids = setup_items_table(conn, args.bots, args.chunks_per_bot)
+    conn.close()
+
+    rng = random.Random(1)
+    queries = [
+        (rng.choice(bot_ids), json.dumps(random_embedding(rng)))
+        for _ in range(args.queries)
+    ]
+
+    latencies = []
+    for bot_id, embedding in queries:
+        start = time.perf_counter()
+        conn = connect(args)
+        with conn.cursor() as cursor:
+            cursor.execute(SEARCH_QUERY_FORMAT, args=(bot_id, embedding, args.limit))
+            cursor.fetchall()
+        conn.close()
+        latencies.append(time.perf_counter() - start)
+    _summary("before", latencies)
+
+    pool = ConnectionPool(connect=lambda: connect(args))
+    latencies = []
+    for bot_id, embedding in queries:
+        start = time.perf_counter()
+        with pool.connection() as pooled:
+            pooled.run_prepared(
+                SEARCH_QUERY_NAMED, bot_id=bot_id, embedding=embedding, limit=args.limit
+            )
+        latencies.append(time.perf_counter() - start)
+    _summary("after", latencies)
+    print(f"pool stats: {pool.stats()}")
+    pool.close_all()
+
+
+if __name__ == "__main__":
+    main()
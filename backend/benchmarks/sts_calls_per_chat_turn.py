@@ -0,0 +1,150 @@
+"""Count STS `AssumeRole` calls made by the repository layer during chat turns.
+
+Runs against moto, so no AWS account is required:
+
+```
+cd backend
+poetry run python benchmarks/sts_calls_per_chat_turn.py --turns 20
+```
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, ".")
+
+os.environ.update(
+    {
+        "AWS_EXECUTION_ENV": "AWS_Lambda_python3.11",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "REGION": "us-east-1",
+        "ACCOUNT": "123456789012",
+        "TABLE_NAME": "bench-conversation-table",
+        "TABLE_ACCESS_ROLE_ARN": "arn:aws:iam::123456789012:role/TableAccessRole",
+        "LARGE_MESSAGE_BUCKET": "bench-large-message-bucket",
+    }
+)
+
+from moto import mock_aws
+
+USER_ID = "bench-user"
+BOT_ID = "bench-bot"
+
+
+def _create_table():
+    import boto3
+
+    boto3.client("dynamodb").create_table(
+        TableName=os.environ["TABLE_NAME"],
+        KeySchema=[
+            {"AttributeName": "PK", "KeyType": "HASH"},
+            {"AttributeName": "SK", "KeyType": "RANGE"},
+        ],
+        AttributeDefinitions=[
+            {"AttributeName": "PK", "AttributeType": "S"},
+            {"AttributeName": "SK", "AttributeType": "S"},
+            {"AttributeName": "PublicBotId", "AttributeType": "S"},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                "IndexName": "SKIndex",
+                "KeySchema": [{"AttributeName": "SK", "KeyType": "HASH"}],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+            {
+                "IndexName": "PublicBotIdIndex",
+                "KeySchema": [{"AttributeName": "PublicBotId", "KeyType": "HASH"}],
+                "Projection": {"ProjectionType": "ALL"},
+            },
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+
+
+def run(turns: int, cached: bool):
+    from app.repositories import common
+    from app.repositories.common import RecordNotFoundError
+    from app.repositories.conversation import (
+        find_conversation_by_id,
+        store_conversation,
+    )
+    from app.repositories.custom_bot import store_bot
+    from app.repositories.models.conversation import (
+        ContentModel,
+        ConversationModel,
+        MessageModel,
+    )
+    from app.usecases.bot import fetch_bot, modify_bot_last_used_time
+    from tests.test_repositories.utils.bot_factory import create_test_private_bot
+
+    _create_table()
+    common.clear_credential_cache()
+    # Emulate the previous behavior (assume role on every call) by disabling the cache
+    common._credential_cache.max_size = common.MAX_CACHED_CREDENTIALS if cached else 0
+
+    sts_calls = 0
+
+    def count(**kwargs):
+        nonlocal sts_calls
+        sts_calls += 1
+
+    common._get_sts_client().meta.events.register("before-call.sts.AssumeRole", count)
+    store_bot(USER_ID, create_test_private_bot(BOT_ID, False, USER_ID))
+    sts_calls = 0
+
+    start = time.perf_counter()
+    for i in range(turns):
+        try:
+            conversation = find_conversation_by_id(USER_ID, "conv")
+        except RecordNotFoundError:
+            conversation = ConversationModel(
+                id="conv",
+                create_time=0,
+                title="Benchmark",
+                total_price=0,
+                message_map={},
+                last_message_id="",
+                bot_id=BOT_ID,
+                should_continue=False,
+            )
+        fetch_bot(USER_ID, BOT_ID)
+        conversation.message_map[str(i)] = MessageModel(
+            role="user",
+            content=[
+                ContentModel(
+                    content_type="text", media_type=None, body="Hello", file_name=None
+                )
+            ],
+            model="claude-v3-haiku",
+            children=[],
+            parent=None,
+            create_time=0,
+            feedback=None,
+            used_chunks=None,
+            thinking_log=None,
+        )
+        store_conversation(USER_ID, conversation)
+        modify_bot_last_used_time(USER_ID, BOT_ID)
+    elapsed = time.perf_counter() - start
+
+    label = "cached" if cached else "uncached"
+    print(
+        f"[{label}] turns={turns} sts_calls={sts_calls} "
+        f"sts_calls_per_turn={sts_calls / turns:.2f} "
+        f"elapsed_per_turn={elapsed / turns * 1000:.1f}ms "
+        f"stats={common.get_credential_cache_stats()}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--turns", type=int, default=20)
+    args = parser.parse_args()
+
+    for cached in (False, True):
+        with mock_aws():
+            run(args.turns, cached)
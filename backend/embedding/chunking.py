@@ -0,0 +1,148 @@
+"""Split texts into chunks which fit the input limit of the embedding model.
+
+Texts are split at the coarsest boundaries that give pieces no longer than the chunk
+size (paragraphs, lines, sentences, clauses, words and finally fixed-width slices), and
+the pieces are merged greedily into chunks with overlap. Lengths are measured once per
+piece and the merge boundaries are found with binary searches over their cumulative
+sums, so that the cost does not depend on the number of characters per chunk.
+"""
+
+import logging
+import re
+from typing import Callable, Iterable
+
+import numpy as np
+from app.bedrock import EMBEDDING_MAX_CHARS_PER_TEXT
+
+logger = logging.getLogger(__name__)
+
+# Zero-width patterns, from the coarsest to the finest boundary. Separators stay
+# attached to the piece before them so that joining pieces restores the text.
+SPLIT_PATTERNS = [
+    re.compile(r"(?<=\n\n)(?=[^\n])"),  # paragraphs
+    re.compile(r"(?<=\n)(?=[^\n])"),  # lines
+    re.compile(r"(?<=[.!?])(?=\s)|(?<=[。！？])"),  # sentences
+    re.compile(r"(?<=[,;:、，；：])"),  # clauses
+    re.compile(r"(?<=\s)(?=\S)"),  # words
+]
+HISTOGRAM_BIN_WIDTH = 256
+
+
+class TextChunker:
+    """Split texts into chunks of at most `chunk_size`, measured by `length_function`.
+    `length_function` defaults to the number of characters, which is how Cohere Embed
+    on Bedrock limits its input. With a tokenizer, the length of a chunk is the sum of
+    the lengths of its pieces.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_overlap: int,
+        length_function: Callable[[str], int] = len,
+        max_length: int = EMBEDDING_MAX_CHARS_PER_TEXT,
+    ):
+        if chunk_size > max_length:
+            logger.warning(
+                f"chunk_size {chunk_size} exceeds the model limit. Using {max_length}."
+            )
+            chunk_size = max_length
+        if chunk_overlap >= chunk_size:
+            raise ValueError(
+                f"chunk_overlap ({chunk_overlap}) must be smaller than chunk_size ({chunk_size})."
+            )
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.length_function = length_function
+
+    def _split_fixed(self, text: str) -> list[str]:
+        if self.length_function is len:
+            return [
+                text[i : i + self.chunk_size]
+                for i in range(0, len(text), self.chunk_size)
+            ]
+        return list(text)
+
+    def _split_pieces(self, text: str, level: int = 0) -> list[str]:
+        """Split `text` into pieces no longer than `chunk_size`."""
+        if level == len(SPLIT_PATTERNS):
+            return self._split_fixed(text)
+        pieces: list[str] = []
+        for piece in SPLIT_PATTERNS[level].split(text):
+            if self.length_function(piece) <= self.chunk_size:
+                pieces.append(piece)
+            else:
+                pieces.extend(self._split_pieces(piece, level + 1))
+        return pieces
+
+    def split_text(self, text: str) -> list[str]:
+        if self.length_function(text) <= self.chunk_size:
+            stripped = text.strip()
+            return [stripped] if stripped else []
+
+        pieces = [p for p in self._split_pieces(text) if p]
+        lengths = np.fromiter(
+            (self.length_function(p) for p in pieces),
+            dtype=np.int64,
+            count=len(pieces),
+        )
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+
+        chunks: list[str] = []
+        i, n = 0, len(pieces)
+        while i < n:
+            # Pieces [i, j) fill the chunk
+            j = int(np.searchsorted(ends, starts[i] + self.chunk_size, side="right"))
+            j = max(j, i + 1)
+            chunk = "".join(pieces[i:j]).strip()
+            if chunk:
+                chunks.append(chunk)
+            if j >= n:
+                break
+            # Repeat the trailing pieces within `chunk_overlap`, leaving room for piece j
+            k = int(
+                np.searchsorted(
+                    starts,
+                    max(ends[j - 1] - self.chunk_overlap, ends[j] - self.chunk_size),
+                    side="left",
+                )
+            )
+            i = max(k, i + 1)
+        return chunks
+
+    def split_texts(self, texts: Iterable[str]) -> list[list[str]]:
+        return [self.split_text(text) for text in texts]
+
+
+class ChunkSizeHistogram:
+    """Histogram of chunk lengths, accumulated over batches."""
+
+    def __init__(
+        self,
+        max_length: int = EMBEDDING_MAX_CHARS_PER_TEXT,
+        bin_width: int = HISTOGRAM_BIN_WIDTH,
+    ):
+        self.edges = np.arange(0, max_length + bin_width, bin_width)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.max_length = max_length
+        self.num_over_limit = 0
+
+    def add(self, lengths: Iterable[int]):
+        values = np.fromiter(lengths, dtype=np.int64)
+        self.num_over_limit += int(np.count_nonzero(values > self.max_length))
+        self.counts += np.histogram(
+            np.minimum(values, self.edges[-1]), bins=self.edges
+        )[0]
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    def summary(self) -> str:
+        bins = ", ".join(
+            f"{self.edges[i]}-{self.edges[i + 1]}: {count}"
+            for i, count in enumerate(self.counts)
+            if count > 0
+        )
+        return f"Chunk lengths ({self.total} chunks, {self.num_over_limit} over limit): {bins}"
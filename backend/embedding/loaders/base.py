@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import Iterator
 
 from pydantic import BaseModel, Field
 
@@ -12,3 +13,7 @@ class BaseLoader(ABC):
     @abstractmethod
     def load(self) -> list[Document]:
         """Load data into Document objects."""
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Load data lazily. Loaders which can stream documents override this."""
+        yield from self.load()
@@ -0,0 +1,212 @@
+"""Partition PDFs with the hi-res strategy in parallel, page range by page range.
+
+A PDF is split into shards of a few pages, which are partitioned in a process pool and
+yielded in page order as they complete. Elements of each page are cached in S3, keyed by
+the content hash of the file, so that partitioning the same file again costs nothing.
+Cached pages are got and put concurrently.
+"""
+
+import io
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import IO, Any, Iterator
+
+import boto3
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Pages partitioned together by a worker.
+PDF_PAGES_PER_SHARD = 4
+# Processes used to partition shards.
+PDF_PARTITION_WORKERS = int(
+    os.environ.get("PDF_PARTITION_WORKERS", multiprocessing.cpu_count())
+)
+# Bump when the partition parameters change, so that cached results are not reused.
+PDF_PARTITION_CACHE_VERSION = "hi_res-v1"
+# Requests to get or put cached pages at the same time.
+PDF_PARTITION_CACHE_CONCURRENCY = 16
+
+
+class PdfPartitionCache:
+    """Element dicts of each page, stored as JSON objects in S3."""
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str,
+        max_concurrency: int = PDF_PARTITION_CACHE_CONCURRENCY,
+    ):
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.client = boto3.client("s3")
+
+    def _key(self, content_hash: str, page_number: int) -> str:
+        return f"{self.prefix}/{PDF_PARTITION_CACHE_VERSION}/{content_hash}/{page_number:06d}.json"
+
+    def get(self, content_hash: str, page_number: int) -> list[dict] | None:
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=self._key(content_hash, page_number)
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                logger.warning(f"Failed to get cached partition: {e}")
+            return None
+        return json.loads(response["Body"].read())
+
+    def get_many(
+        self, content_hash: str, page_numbers: list[int]
+    ) -> dict[int, list[dict]]:
+        """Get the pages concurrently. Pages which are not cached are omitted."""
+        if len(page_numbers) == 0:
+            return {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = executor.map(
+                lambda page_number: self.get(content_hash, page_number), page_numbers
+            )
+            return {
+                page_number: elements
+                for page_number, elements in zip(page_numbers, results)
+                if elements is not None
+            }
+
+    def put(self, content_hash: str, page_number: int, elements: list[dict]):
+        try:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=self._key(content_hash, page_number),
+                Body=json.dumps(elements),
+            )
+        except ClientError as e:
+            logger.warning(f"Failed to put cached partition: {e}")
+
+
+def _partition_shard(shard: bytes, starting_page_number: int) -> list[dict]:
+    """Partition a shard in a worker process. Returns element dicts."""
+    from unstructured.partition.pdf import partition_pdf
+    from unstructured.staging.base import elements_to_dicts
+
+    elements = partition_pdf(
+        file=io.BytesIO(shard),
+        strategy="hi_res",
+        infer_table_structure=True,
+        extract_images_in_pdf=False,
+        starting_page_number=starting_page_number,
+    )
+    return elements_to_dicts(elements)
+
+
+def _compose_ranges(page_numbers: list[int], pages_per_shard: int) -> list[list[int]]:
+    """Group ascending page numbers into runs of consecutive pages."""
+    ranges: list[list[int]] = []
+    for page_number in page_numbers:
+        if (
+            ranges
+            and ranges[-1][-1] == page_number - 1
+            and len(ranges[-1]) < pages_per_shard
+        ):
+            ranges[-1].append(page_number)
+        else:
+            ranges.append([page_number])
+    return ranges
+
+
+_executor: Executor | None = None
+
+
+def get_partition_executor() -> Executor:
+    global _executor
+    if _executor is None:
+        # `spawn` since the caller may run threads (e.g. the embedding pipeline)
+        _executor = ProcessPoolExecutor(
+            max_workers=PDF_PARTITION_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _executor
+
+
+def iter_partition_pdf_parallel(
+    file: IO[bytes],
+    content_hash: str,
+    cache: PdfPartitionCache | None = None,
+    pages_per_shard: int = PDF_PAGES_PER_SHARD,
+    executor: Executor | None = None,
+) -> Iterator[Any]:
+    """Partition a PDF with the hi-res strategy, running page ranges in parallel.
+    `file` must be seekable. Yields elements in page order, each page as soon as it is
+    got from the cache or its shard is partitioned.
+    """
+    from pypdf import PdfReader, PdfWriter
+    from unstructured.staging.base import elements_from_dicts
+
+    reader = PdfReader(file)
+    num_pages = len(reader.pages)
+
+    pages: dict[int, list[dict]] = {}
+    if cache is not None:
+        pages = cache.get_many(content_hash, list(range(1, num_pages + 1)))
+    missing = [p for p in range(1, num_pages + 1) if p not in pages]
+    logger.info(
+        f"Partitioning {len(missing)} of {num_pages} pages ({num_pages - len(missing)} cached)"
+    )
+
+    executor = executor or get_partition_executor()
+    shards: dict[int, tuple[list[int], Future]] = {}
+    for page_range in _compose_ranges(missing, pages_per_shard):
+        writer = PdfWriter()
+        for page_number in page_range:
+            writer.add_page(reader.pages[page_number - 1])
+        shard = io.BytesIO()
+        writer.write(shard)
+        future = executor.submit(_partition_shard, shard.getvalue(), page_range[0])
+        for page_number in page_range:
+            shards[page_number] = (page_range, future)
+
+    put_executor = (
+        ThreadPoolExecutor(max_workers=cache.max_concurrency)
+        if cache is not None
+        else None
+    )
+    try:
+        for page_number in range(1, num_pages + 1):
+            if page_number not in pages:
+                page_range, future = shards[page_number]
+                element_dicts = future.result()
+                for shard_page_number in page_range:
+                    pages[shard_page_number] = [
+                        d
+                        for d in element_dicts
+                        if d.get("metadata", {}).get("page_number", page_range[0])
+                        == shard_page_number
+                    ]
+                    if put_executor is not None:
+                        put_executor.submit(
+                            cache.put,  # type: ignore[union-attr]
+                            content_hash,
+                            shard_page_number,
+                            pages[shard_page_number],
+                        )
+            yield from elements_from_dicts(pages.pop(page_number))
+    finally:
+        if put_executor is not None:
+            put_executor.shutdown(wait=True)
+
+
+def partition_pdf_parallel(
+    file: IO[bytes],
+    content_hash: str,
+    cache: PdfPartitionCache | None = None,
+    pages_per_shard: int = PDF_PAGES_PER_SHARD,
+    executor: Executor | None = None,
+) -> list[Any]:
+    """See `iter_partition_pdf_parallel`. Returns elements in page order."""
+    return list(
+        iter_partition_pdf_parallel(
+            file, content_hash, cache, pages_per_shard, executor
+        )
+    )
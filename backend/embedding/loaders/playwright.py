@@ -1,7 +1,21 @@
+import asyncio
 import logging
-import time
+import multiprocessing
+import os
+import queue
+import threading
 from abc import ABC, abstractmethod
-from typing import TYPE_CHECKING
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+from urllib.parse import urlparse
 
 from embedding.loaders.base import BaseLoader, Document
 
@@ -9,10 +23,28 @@ logger = logging.getLogger(__name__)
 
 if TYPE_CHECKING:
     from playwright.async_api import Browser as AsyncBrowser
+    from playwright.async_api import BrowserContext as AsyncBrowserContext
     from playwright.async_api import Page as AsyncPage
     from playwright.async_api import Response as AsyncResponse
+    from playwright.async_api import Route as AsyncRoute
     from playwright.sync_api import Browser, Page, Response
 
+# Number of pages loaded at the same time.
+PLAYWRIGHT_MAX_CONCURRENCY = int(os.environ.get("PLAYWRIGHT_MAX_CONCURRENCY", 8))
+# Number of pages loaded at the same time from a single host.
+PLAYWRIGHT_MAX_CONCURRENCY_PER_HOST = int(
+    os.environ.get("PLAYWRIGHT_MAX_CONCURRENCY_PER_HOST", 2)
+)
+# Pages sharing one browser context. Contexts are isolated from each other (cookies, cache).
+PLAYWRIGHT_PAGES_PER_CONTEXT = 4
+PLAYWRIGHT_NAVIGATION_TIMEOUT_SEC = 30
+# Resources which are not needed to extract text.
+BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+# Processes used to run `partition_html`. `0` runs it in the crawler process.
+PARTITION_HTML_WORKERS = int(
+    os.environ.get("PARTITION_HTML_WORKERS", multiprocessing.cpu_count())
+)
+
 
 class PlaywrightEvaluator(ABC):
     """Abstract base class for all evaluators.
@@ -52,10 +84,37 @@ class PlaywrightEvaluator(ABC):
         pass
 
 
+def html_to_text(html: str) -> str:
+    from unstructured.partition.html import partition_html
+
+    elements = partition_html(text=html)
+    return "\n\n".join([str(el) for el in elements])
+
+
+_partition_executor: Executor | None = None
+
+
+def get_partition_executor() -> Executor | None:
+    """Process pool shared by evaluators to run CPU bound `partition_html`."""
+    global _partition_executor
+    if _partition_executor is None and PARTITION_HTML_WORKERS > 0:
+        _partition_executor = ProcessPoolExecutor(max_workers=PARTITION_HTML_WORKERS)
+    return _partition_executor
+
+
 class DelayUnstructuredHtmlEvaluator(PlaywrightEvaluator):
-    """UnstructuredHtmlEvaluator with delay."""
+    """UnstructuredHtmlEvaluator which waits for the page to be rendered.
+
+    Instead of sleeping for a fixed time, it waits until the network is idle or, if
+    `ready_selector` is given, until the selector appears. It waits at most `delay_sec`.
+    """
 
-    def __init__(self, remove_selectors: list[str] | None = None, delay_sec: int = 0):
+    def __init__(
+        self,
+        remove_selectors: list[str] | None = None,
+        delay_sec: float = 0,
+        ready_selector: str | None = None,
+    ):
         """Initialize UnstructuredHtmlEvaluator."""
         try:
             import unstructured  # noqa:F401
@@ -67,10 +126,23 @@ class DelayUnstructuredHtmlEvaluator(PlaywrightEvaluator):
 
         self.remove_selectors = remove_selectors
         self.delay_sec = delay_sec
+        self.ready_selector = ready_selector
 
     def evaluate(self, page: "Page", browser: "Browser", response: "Response") -> str:
         """Synchronously process the HTML content of the page."""
-        from unstructured.partition.html import partition_html
+        from playwright.sync_api import TimeoutError
+
+        try:
+            if self.delay_sec <= 0:
+                pass
+            elif self.ready_selector:
+                page.wait_for_selector(
+                    self.ready_selector, timeout=self.delay_sec * 1000
+                )
+            else:
+                page.wait_for_load_state("networkidle", timeout=self.delay_sec * 1000)
+        except TimeoutError:
+            logger.info(f"Page {page.url} was not ready in {self.delay_sec} sec.")
 
         for selector in self.remove_selectors or []:
             elements = page.locator(selector).all()
@@ -78,18 +150,27 @@ class DelayUnstructuredHtmlEvaluator(PlaywrightEvaluator):
                 if element.is_visible():
                     element.evaluate("element => element.remove()")
 
-        # Delay to wait for the page to load.
-        time.sleep(self.delay_sec)
-
-        page_source = page.content()
-        elements = partition_html(text=page_source)
-        return "\n\n".join([str(el) for el in elements])
+        return html_to_text(page.content())
 
     async def evaluate_async(
         self, page: "AsyncPage", browser: "AsyncBrowser", response: "AsyncResponse"
     ) -> str:
         """Asynchronously process the HTML content of the page."""
-        from unstructured.partition.html import partition_html
+        from playwright.async_api import TimeoutError
+
+        try:
+            if self.delay_sec <= 0:
+                pass
+            elif self.ready_selector:
+                await page.wait_for_selector(
+                    self.ready_selector, timeout=self.delay_sec * 1000
+                )
+            else:
+                await page.wait_for_load_state(
+                    "networkidle", timeout=self.delay_sec * 1000
+                )
+        except TimeoutError:
+            logger.info(f"Page {page.url} was not ready in {self.delay_sec} sec.")
 
         for selector in self.remove_selectors or []:
             elements = await page.locator(selector).all()
@@ -97,37 +178,74 @@ class DelayUnstructuredHtmlEvaluator(PlaywrightEvaluator):
                 if await element.is_visible():
                     await element.evaluate("element => element.remove()")
 
-        # Delay to wait for the page to load.
-        time.sleep(self.delay_sec)
-
         page_source = await page.content()
-        elements = partition_html(text=page_source)
-        return "\n\n".join([str(el) for el in elements])
+        executor = get_partition_executor()
+        if executor is None:
+            return html_to_text(page_source)
+        return await asyncio.get_running_loop().run_in_executor(
+            executor, html_to_text, page_source
+        )
+
+
+async def _aiter_urls(urls: Iterable[str]) -> AsyncIterator[str]:
+    """Iterate `urls` without blocking the event loop, e.g. while another thread feeds
+    them.
+    """
+    if isinstance(urls, Sequence):
+        for url in urls:
+            yield url
+        return
+    iterator = iter(urls)
+    loop = asyncio.get_running_loop()
+    while True:
+        url = await loop.run_in_executor(None, next, iterator, None)
+        if url is None:
+            return
+        yield url
+
+
+async def _block_resources(route: "AsyncRoute"):
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
 
 
 class PlaywrightURLLoader(BaseLoader):
     """Load `HTML` pages with `Playwright` and parse with `Unstructured`.
 
     This is useful for loading pages that require javascript to render.
+    Pages are loaded concurrently by a pool of pages in a few browser contexts.
 
     Attributes:
-        urls (List[str]): List of URLs to load.
+        urls (Iterable[str]): URLs to load. May be a lazy iterable, which is consumed
+            while loading, so that a single browser loads all of them.
         continue_on_failure (bool): If True, continue loading other URLs on failure.
         headless (bool): If True, the browser will run in headless mode.
+        max_concurrency (int): Number of pages loaded at the same time.
+        max_concurrency_per_host (int): Number of pages loaded at the same time per host.
     """
 
     def __init__(
         self,
-        urls: list[str],
+        urls: Iterable[str],
         continue_on_failure: bool = True,
         headless: bool = True,
         remove_selectors: list[str] | None = None,
         evaluator: PlaywrightEvaluator | None = None,
+        max_concurrency: int = PLAYWRIGHT_MAX_CONCURRENCY,
+        max_concurrency_per_host: int = PLAYWRIGHT_MAX_CONCURRENCY_PER_HOST,
+        pages_per_context: int = PLAYWRIGHT_PAGES_PER_CONTEXT,
+        navigation_timeout_sec: float = PLAYWRIGHT_NAVIGATION_TIMEOUT_SEC,
     ):
         """Load a list of URLs using Playwright."""
         self.urls = urls
         self.continue_on_failure = continue_on_failure
         self.headless = headless
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.pages_per_context = pages_per_context
+        self.navigation_timeout_sec = navigation_timeout_sec
 
         if remove_selectors and evaluator:
             raise ValueError(
@@ -141,31 +259,105 @@ class PlaywrightURLLoader(BaseLoader):
         """Load the specified URLs using Playwright and create Document instances.
 
         Returns:
-            List[Document]: A list of Document instances with loaded content.
+            List[Document]: A list of Document instances with loaded content,
+            in the order of `urls`.
         """
-        from playwright.sync_api import sync_playwright
-
-        docs: list[Document] = list()
-
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=self.headless)
-            for url in self.urls:
-                try:
-                    page = browser.new_page()
-                    response = page.goto(url)
-                    if response is None:
-                        raise ValueError(f"page.goto() returned None for url {url}")
-
-                    text = self.evaluator.evaluate(page, browser, response)
-                    metadata = {"source": url}
-                    docs.append(Document(page_content=text, metadata=metadata))
-                    page.close()
-                except Exception as e:
-                    if self.continue_on_failure:
-                        logger.error(
-                            f"Error fetching or processing {url}, exception: {e}"
+        return asyncio.run(self.aload())
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield documents as pages are loaded, in the order of completion."""
+        documents: queue.Queue = queue.Queue()
+
+        def run():
+            try:
+                asyncio.run(self.aload(on_document=documents.put))
+                documents.put(None)
+            except BaseException as e:
+                documents.put(e)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        while (item := documents.get()) is not None:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+        thread.join()
+
+    async def aload(
+        self, on_document: Callable[[Document], Any] | None = None
+    ) -> list[Document]:
+        """Asynchronous version of `load`. `on_document` is called with each document
+        as soon as its page is loaded.
+        """
+        from playwright.async_api import async_playwright
+
+        if isinstance(self.urls, Sequence) and len(self.urls) == 0:
+            return []
+
+        async with async_playwright() as p:
+            browser = await p.chromium.launch(headless=self.headless)
+            try:
+                pages: asyncio.Queue = asyncio.Queue()
+                num_pages = (
+                    min(self.max_concurrency, len(self.urls))
+                    if isinstance(self.urls, Sequence)
+                    else self.max_concurrency
+                )
+                contexts: list["AsyncBrowserContext"] = []
+                for i in range(num_pages):
+                    if i % self.pages_per_context == 0:
+                        context = await browser.new_context()
+                        context.set_default_navigation_timeout(
+                            self.navigation_timeout_sec * 1000
                         )
-                    else:
-                        raise e
-            browser.close()
-        return docs
+                        await context.route("**/*", _block_resources)
+                        contexts.append(context)
+                    pages.put_nowait(await contexts[-1].new_page())
+
+                host_limits: dict[str, asyncio.Semaphore] = {}
+
+                async def load_url(url: str) -> Document | None:
+                    document = await self._load_url(url, browser, pages, host_limits)
+                    if document is not None and on_document is not None:
+                        on_document(document)
+                    return document
+
+                # Pages start loading while more URLs are awaited
+                tasks = [
+                    asyncio.create_task(load_url(url))
+                    async for url in _aiter_urls(self.urls)
+                ]
+                results = await asyncio.gather(*tasks)
+            finally:
+                await browser.close()
+        return [doc for doc in results if doc is not None]
+
+    async def _load_url(
+        self,
+        url: str,
+        browser: "AsyncBrowser",
+        pages: asyncio.Queue,
+        host_limits: dict[str, asyncio.Semaphore],
+    ) -> Document | None:
+        host = urlparse(url).netloc
+        host_limit = host_limits.setdefault(
+            host, asyncio.Semaphore(self.max_concurrency_per_host)
+        )
+        async with host_limit:
+            page: "AsyncPage" = await pages.get()
+            try:
+                response = await page.goto(url)
+                if response is None:
+                    raise ValueError(f"page.goto() returned None for url {url}")
+
+                text = await self.evaluator.evaluate_async(page, browser, response)
+                return Document(page_content=text, metadata={"source": url})
+            except Exception as e:
+                if self.continue_on_failure:
+                    logger.error(f"Error fetching or processing {url}, exception: {e}")
+                    return None
+                raise e
+            finally:
+                if page.is_closed():
+                    page = await page.context.new_page()
+                pages.put_nowait(page)
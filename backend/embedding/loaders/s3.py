@@ -1,15 +1,48 @@
+import hashlib
 import os
+import shutil
 import tempfile
 import logging
 import boto3
 from distutils.util import strtobool
+from typing import IO, Iterable, Iterator
 from embedding.loaders.base import BaseLoader, Document
+from embedding.loaders.pdf import PdfPartitionCache, iter_partition_pdf_parallel
 from unstructured.partition.auto import partition
 from unstructured.partition.pdf import partition_pdf
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# Fetch objects into a spooled file object instead of downloading them to a file in a
+# temporary directory.
+S3_LOADER_STREAMING = bool(strtobool(os.environ.get("S3_LOADER_STREAMING", "true")))
+# Objects are held in memory up to this size, and in a temporary file beyond it.
+S3_SPOOL_MAX_MEMORY_BYTES = 64 * 1024 * 1024
+# In `single` mode, `lazy_load` yields documents of at most this many characters
+# (split at element boundaries) instead of a single document of the whole file.
+STREAM_DOCUMENT_MAX_CHARS = 100_000
+# Partition PDFs in hi-resolution mode page range by page range on all cores.
+PDF_PARTITION_PARALLEL = bool(
+    strtobool(os.environ.get("PDF_PARTITION_PARALLEL", "true"))
+)
+
+
+def open_s3_object(bucket: str, key: str, client=None) -> IO[bytes]:
+    """Fetch the object with a single GET into a seekable file object, so that
+    partitioning can seek around it without further requests.
+    """
+    client = client or boto3.client("s3")
+    file = tempfile.SpooledTemporaryFile(max_size=S3_SPOOL_MAX_MEMORY_BYTES)
+    try:
+        body = client.get_object(Bucket=bucket, Key=key)["Body"]
+        shutil.copyfileobj(body, file)
+        file.seek(0)
+    except Exception:
+        file.close()
+        raise
+    return file  # type: ignore[return-value]
+
 
 class S3FileLoader(BaseLoader):
     """Loads a document from a file in S3.
@@ -22,77 +55,147 @@ class S3FileLoader(BaseLoader):
         key: str,
         mode: str = "single",
         enable_partition_pdf: bool = False,
+        streaming: bool = S3_LOADER_STREAMING,
+        partition_cache_prefix: str | None = None,
     ):
+        """`partition_cache_prefix`: S3 prefix (in `bucket`) of the cache of partitioned
+        PDF pages. No cache is used if None.
+        """
         self.bucket = bucket
         self.key = key
         self.mode = mode
         self.enable_partition_pdf = enable_partition_pdf
+        self.streaming = streaming
+        self.partition_cache_prefix = partition_cache_prefix
+
+    @property
+    def partitions_pdf_in_parallel(self) -> bool:
+        """True if partitioning uses a process pool of its own, in which case the loader
+        must not run in a daemonic worker process.
+        """
+        return (
+            PDF_PARTITION_PARALLEL
+            and self.enable_partition_pdf
+            and os.path.splitext(self.key)[1] == ".pdf"
+        )
+
+    def _iter_pdf_elements_parallel(self) -> Iterator:
+        """Yield elements page by page, as soon as they are partitioned."""
+        logger.info(
+            f"Start partitioning using hi-resolution mode in parallel: {self.key}"
+        )
+        s3 = boto3.client("s3")
+        response = s3.head_object(Bucket=self.bucket, Key=self.key)
+        content_hash = hashlib.sha256(
+            f"{response['ETag']}:{response['ContentLength']}".encode("utf-8")
+        ).hexdigest()
+        cache = (
+            PdfPartitionCache(self.bucket, self.partition_cache_prefix)
+            if self.partition_cache_prefix is not None
+            else None
+        )
+        with open_s3_object(self.bucket, self.key, s3) as file:
+            yield from iter_partition_pdf_parallel(file, content_hash, cache)
+
+    def _partition(self, file_path: str | None = None, file=None) -> list:
+        extension = os.path.splitext(self.key)[1]
+        if extension == ".pdf" and self.enable_partition_pdf == True:
+            logger.info(f"Start partitioning using hi-resolution mode: {self.key}")
+            return partition_pdf(
+                filename=file_path,
+                file=file,
+                strategy="hi_res",
+                infer_table_structure=True,
+                extract_images_in_pdf=False,
+            )
+        else:
+            logger.info(f"Start partitioning using auto mode: {self.key}")
+            if file is not None:
+                return partition(file=file, metadata_filename=self.key)
+            return partition(filename=file_path)
+
+    def _get_elements(self) -> Iterable:
+        """Get elements. PDFs partitioned in parallel are yielded lazily."""
+        if self.partitions_pdf_in_parallel:
+            return self._iter_pdf_elements_parallel()
+        if self.streaming:
+            with open_s3_object(self.bucket, self.key) as file:
+                return self._partition(file=file)
 
-    def _get_elements(self) -> list:
-        """Get elements."""
         s3 = boto3.client("s3")
         with tempfile.TemporaryDirectory() as temp_dir:
             file_path = f"{temp_dir}/{self.key}"
             os.makedirs(os.path.dirname(file_path), exist_ok=True)
             s3.download_file(self.bucket, self.key, file_path)
-            extension = os.path.splitext(file_path)[1]
-
-            if extension == ".pdf" and self.enable_partition_pdf == True:
-                logger.info(f"Start partitioning using hi-resolution mode: {file_path}")
-                return partition_pdf(
-                    filename=file_path,
-                    strategy="hi_res",
-                    infer_table_structure=True,
-                    extract_images_in_pdf=False,
-                )
-            else:
-                logger.info(f"Start partitioning using auto mode: {file_path}")
-                return partition(filename=file_path)
+            return self._partition(file_path=file_path)
 
     def _get_metadata(self) -> dict:
         return {"source": f"s3://{self.bucket}/{self.key}"}
 
-    def load(self) -> list[Document]:
-        """Load file."""
+    def _iter_element_documents(self, elements: Iterable) -> Iterator[Document]:
+        for element in elements:
+            metadata = self._get_metadata()
+            if hasattr(element, "metadata"):
+                metadata.update(element.metadata.to_dict())
+            if hasattr(element, "category"):
+                metadata["category"] = element.category
+            yield Document(page_content=str(element), metadata=metadata)
+
+    def _iter_page_documents(self, elements: Iterable) -> Iterator[Document]:
+        """Group elements of the same page into a document, wherever they appear."""
+        texts: dict[int, list[str]] = {}
+        page_metadata: dict[int, dict] = {}
+        for element in elements:
+            metadata = self._get_metadata()
+            if hasattr(element, "metadata"):
+                metadata.update(element.metadata.to_dict())
+            page_number = metadata.get("page_number", 1)
+
+            texts.setdefault(page_number, []).append(str(element) + "\n\n")
+            page_metadata.setdefault(page_number, {}).update(metadata)
+        for page_number, page_texts in texts.items():
+            yield Document(
+                page_content="".join(page_texts), metadata=page_metadata[page_number]
+            )
+
+    def _iter_text_documents(self, elements: Iterable) -> Iterator[Document]:
+        """Join elements into documents of at most `STREAM_DOCUMENT_MAX_CHARS`."""
+        texts: list[str] = []
+        length = 0
+        for element in elements:
+            text = str(element)
+            if texts and length + len(text) > STREAM_DOCUMENT_MAX_CHARS:
+                yield Document(
+                    page_content="\n\n".join(texts), metadata=self._get_metadata()
+                )
+                texts, length = [], 0
+            texts.append(text)
+            length += len(text) + 2
+        if texts:
+            yield Document(
+                page_content="\n\n".join(texts), metadata=self._get_metadata()
+            )
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Load file and yield documents one by one.
+        In `single` mode, the file is yielded as several documents of bounded size, so
+        that the whole text is never held as a single string.
+        """
         elements = self._get_elements()
         if self.mode == "elements":
-            docs: list[Document] = list()
-            for element in elements:
-                metadata = self._get_metadata()
-                if hasattr(element, "metadata"):
-                    metadata.update(element.metadata.to_dict())
-                if hasattr(element, "category"):
-                    metadata["category"] = element.category
-                docs.append(Document(page_content=str(element), metadata=metadata))
+            yield from self._iter_element_documents(elements)
         elif self.mode == "paged":
-            text_dict: dict[int, str] = {}
-            meta_dict: dict[int, dict] = {}
-
-            for idx, element in enumerate(elements):
-                metadata = self._get_metadata()
-                if hasattr(element, "metadata"):
-                    metadata.update(element.metadata.to_dict())
-                page_number = metadata.get("page_number", 1)
-
-                # Check if this page_number already exists in docs_dict
-                if page_number not in text_dict:
-                    # If not, create new entry with initial text and metadata
-                    text_dict[page_number] = str(element) + "\n\n"
-                    meta_dict[page_number] = metadata
-                else:
-                    # If exists, append to text and update the metadata
-                    text_dict[page_number] += str(element) + "\n\n"
-                    meta_dict[page_number].update(metadata)
-
-            # Convert the dict to a list of Document objects
-            docs = [
-                Document(page_content=text_dict[key], metadata=meta_dict[key])
-                for key in text_dict.keys()
-            ]
+            yield from self._iter_page_documents(elements)
         elif self.mode == "single":
-            metadata = self._get_metadata()
-            text = "\n\n".join([str(el) for el in elements])
-            docs = [Document(page_content=text, metadata=metadata)]
+            yield from self._iter_text_documents(elements)
         else:
             raise ValueError(f"mode of {self.mode} not supported.")
-        return docs
+
+    def load(self) -> list[Document]:
+        """Load file."""
+        if self.mode == "single":
+            elements = self._get_elements()
+            metadata = self._get_metadata()
+            text = "\n\n".join([str(el) for el in elements])
+            return [Document(page_content=text, metadata=metadata)]
+        return list(self.lazy_load())
@@ -0,0 +1,127 @@
+"""Discover page URLs from sitemaps.
+Ref: https://www.sitemaps.org/protocol.html
+"""
+
+import gzip
+import logging
+import urllib.request
+import xml.etree.ElementTree as ET
+from collections import deque
+from dataclasses import dataclass
+from typing import IO, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+SITEMAP_REQUEST_TIMEOUT_SEC = 30
+# Upper bounds to protect against huge or cyclic sitemaps.
+MAX_SITEMAPS = 1000
+MAX_SITEMAP_PAGES = 50000
+
+# Using browser headers to avoid 403
+SITEMAP_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0",
+    "Accept": "*/*",
+    "Accept-Language": "*",
+}
+
+
+@dataclass(frozen=True)
+class SitemapEntry:
+    loc: str
+    lastmod: str | None = None
+
+
+def _local_name(tag: str) -> str:
+    # Strip the namespace, e.g. `{http://www.sitemaps.org/schemas/sitemap/0.9}url`
+    return tag.rsplit("}", 1)[-1]
+
+
+def parse_sitemap(stream: IO[bytes]) -> Iterator[tuple[str, SitemapEntry]]:
+    """Parse a sitemap or a sitemap index incrementally.
+    Yields `("url", entry)` for pages and `("sitemap", entry)` for nested sitemaps.
+    """
+    context = ET.iterparse(stream, events=("start", "end"))
+    _, root = next(context)
+    for event, element in context:
+        if event != "end":
+            continue
+        kind = _local_name(element.tag)
+        if kind not in ("url", "sitemap"):
+            continue
+        loc = lastmod = None
+        for child in element:
+            name = _local_name(child.tag)
+            if name == "loc" and child.text:
+                loc = child.text.strip()
+            elif name == "lastmod" and child.text:
+                lastmod = child.text.strip()
+        if loc:
+            yield kind, SitemapEntry(loc, lastmod)
+        # Release parsed elements so that memory does not grow with the sitemap size
+        root.clear()
+
+
+def _open_sitemap(url: str) -> IO[bytes]:
+    req = urllib.request.Request(url, headers=SITEMAP_HEADERS)
+    response = urllib.request.urlopen(req, timeout=SITEMAP_REQUEST_TIMEOUT_SEC)
+    if url.endswith(".gz") or response.headers.get("Content-Encoding") == "gzip":
+        return gzip.GzipFile(fileobj=response)  # type: ignore
+    return response
+
+
+class SitemapLoader:
+    """Stream page entries of sitemaps, following sitemap indexes.
+    Each page URL is yielded once, and URLs in `exclude` are skipped.
+    """
+
+    def __init__(
+        self,
+        sitemap_urls: list[str],
+        exclude: Iterable[str] = (),
+        continue_on_failure: bool = True,
+        max_sitemaps: int = MAX_SITEMAPS,
+        max_pages: int = MAX_SITEMAP_PAGES,
+    ):
+        self.sitemap_urls = sitemap_urls
+        self.exclude = set(exclude)
+        self.continue_on_failure = continue_on_failure
+        self.max_sitemaps = max_sitemaps
+        self.max_pages = max_pages
+
+    def iter_entries(self) -> Iterator[SitemapEntry]:
+        queue = deque(self.sitemap_urls)
+        visited_sitemaps: set[str] = set()
+        seen_pages = set(self.exclude)
+        num_pages = 0
+
+        while queue and len(visited_sitemaps) < self.max_sitemaps:
+            sitemap_url = queue.popleft()
+            if sitemap_url in visited_sitemaps:
+                continue
+            visited_sitemaps.add(sitemap_url)
+
+            try:
+                with _open_sitemap(sitemap_url) as stream:
+                    for kind, entry in parse_sitemap(stream):
+                        if kind == "sitemap":
+                            queue.append(entry.loc)
+                            continue
+                        if entry.loc in seen_pages:
+                            continue
+                        seen_pages.add(entry.loc)
+                        yield entry
+                        num_pages += 1
+                        if num_pages >= self.max_pages:
+                            logger.warning(
+                                f"Reached the maximum number of pages ({self.max_pages}) in sitemaps."
+                            )
+                            return
+            except Exception as e:
+                if self.continue_on_failure:
+                    logger.error(
+                        f"Error fetching or parsing sitemap {sitemap_url}: {e}"
+                    )
+                else:
+                    raise e
+
+        logger.info(f"Found {num_pages} pages in {len(visited_sitemaps)} sitemaps.")
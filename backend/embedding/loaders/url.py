@@ -1,89 +1,419 @@
+import http.client
+import json
 import logging
-import urllib.error
-import urllib.request
-from typing import Literal
+import queue
+import threading
+import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Iterable, Iterator, Literal
+from urllib.parse import urljoin, urlsplit, urlunsplit
 
+import boto3
+from botocore.exceptions import ClientError
 from embedding.loaders.base import BaseLoader, Document
 from embedding.loaders.playwright import (
     DelayUnstructuredHtmlEvaluator,
     PlaywrightURLLoader,
 )
 from embedding.loaders.unstructured import UnstructuredURLLoader
-from embedding.loaders.youtube import YoutubeLoaderWithLangDetection, _parse_video_id
+from embedding.loaders.youtube import (
+    TranscriptCache,
+    YoutubeLoaderWithLangDetection,
+    _parse_video_id,
+)
 
 logger = logging.getLogger(__name__)
 
 # Delay seconds to wait for the page to render by JavaScript.
 DELAY_SEC = 2
 
+# Number of URLs whose content type is checked at the same time.
+PROBE_MAX_CONCURRENCY = 16
+# Timeout of a content type check. It follows the observed latency within these bounds.
+PROBE_TIMEOUT_INITIAL_SEC = 10
+PROBE_TIMEOUT_MIN_SEC = 2
+PROBE_TIMEOUT_MAX_SEC = 30
+PROBE_MAX_REDIRECTS = 5
+# Seconds to use a cached content type without checking it again.
+CONTENT_TYPE_CACHE_TTL_SEC = 24 * 60 * 60
+# URLs passed to an unstructured or youtube loader at once. Loading starts as soon as
+# a batch is classified. Web pages are all passed to a single loader (and browser).
+LOADER_BATCH_SIZE = 16
 
-def get_loader(loader_type: str, urls: list[str]) -> BaseLoader:
-    map = {
-        "web": PlaywrightURLLoader(
-            urls=urls, evaluator=DelayUnstructuredHtmlEvaluator(delay_sec=DELAY_SEC)
-        ),
-        "unstructured": UnstructuredURLLoader(urls, request_timeout=30),
-        "youtube": YoutubeLoaderWithLangDetection(urls),
-    }
-    return map[loader_type]
-
-
-def check_content_type(url) -> Literal["web", "unstructured", "youtube"]:
-    if _parse_video_id(url):
-        return "youtube"
-
-    # Using urllib.request instead of requests to avoid 403
-    # Ref: https://stackoverflow.com/questions/74446830/how-to-fix-403-forbidden-errors-with-python-requests-even-with-user-agent-head
-    req = urllib.request.Request(url, method="HEAD")
-    req.add_header(
-        "User-Agent",
-        "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0",
-    )
-    req.add_header("Accept", "*/*")
-    req.add_header("Accept-Language", "*")
+# Using browser headers to avoid 403
+# Ref: https://stackoverflow.com/questions/74446830/how-to-fix-403-forbidden-errors-with-python-requests-even-with-user-agent-head
+PROBE_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:106.0) Gecko/20100101 Firefox/106.0",
+    "Accept": "*/*",
+    "Accept-Language": "*",
+}
 
-    try:
-        with urllib.request.urlopen(req, timeout=30) as response:
-            content_type = response.headers.get("Content-Type", "").lower()
-    except Exception as e:
-        logger.warning(
-            f"Failed to get content type of {url}: {e}. Use unstructured to load."
+type_content_type = Literal["web", "unstructured", "youtube"]
+CONTENT_TYPES: tuple[type_content_type, ...] = ("web", "unstructured", "youtube")
+
+
+def get_loader(
+    loader_type: str,
+    urls: Iterable[str],
+    transcript_cache: TranscriptCache | None = None,
+) -> BaseLoader:
+    if loader_type == "web":
+        return PlaywrightURLLoader(
+            urls=urls, evaluator=DelayUnstructuredHtmlEvaluator(delay_sec=DELAY_SEC)
         )
-        return "unstructured"
+    elif loader_type == "unstructured":
+        return UnstructuredURLLoader(list(urls), request_timeout=30)
+    elif loader_type == "youtube":
+        return YoutubeLoaderWithLangDetection(list(urls), cache=transcript_cache)
+    raise ValueError(f"Unsupported loader type: {loader_type}")
+
+
+def _iter_queue(urls: queue.Queue) -> Iterator[str]:
+    """Yield URLs put into the queue until `None` is put."""
+    while (url := urls.get()) is not None:
+        yield url
+
+
+class AdaptiveTimeout:
+    """Timeout which follows a moving average of the observed latencies."""
+
+    def __init__(
+        self,
+        initial_sec: float = PROBE_TIMEOUT_INITIAL_SEC,
+        min_sec: float = PROBE_TIMEOUT_MIN_SEC,
+        max_sec: float = PROBE_TIMEOUT_MAX_SEC,
+        factor: float = 4.0,
+        alpha: float = 0.2,
+    ):
+        self.initial_sec = initial_sec
+        self.min_sec = min_sec
+        self.max_sec = max_sec
+        self.factor = factor
+        self.alpha = alpha
+        self._average: float | None = None
+        self._lock = threading.Lock()
+
+    def get(self) -> float:
+        if self._average is None:
+            return self.initial_sec
+        return min(self.max_sec, max(self.min_sec, self._average * self.factor))
+
+    def observe(self, latency: float):
+        with self._lock:
+            if self._average is None:
+                self._average = latency
+            else:
+                self._average += self.alpha * (latency - self._average)
+
+
+class ContentTypeCache:
+    """URL to content type and ETag, persisted as a JSON object in S3 between syncs."""
+
+    def __init__(
+        self,
+        entries: dict[str, dict] | None = None,
+        ttl_sec: float = CONTENT_TYPE_CACHE_TTL_SEC,
+    ):
+        self.entries = entries or {}
+        self.ttl_sec = ttl_sec
+        self._lock = threading.Lock()
+
+    def get(self, url: str) -> dict | None:
+        return self.entries.get(url)
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["checked_at"] <= self.ttl_sec
+
+    def put(self, url: str, content_type: type_content_type, etag: str | None):
+        with self._lock:
+            self.entries[url] = {
+                "content_type": content_type,
+                "etag": etag,
+                "checked_at": time.time(),
+            }
+
+    @classmethod
+    def load_s3(cls, bucket: str, key: str) -> "ContentTypeCache":
+        try:
+            response = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+            return cls(json.loads(response["Body"].read()))
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "NoSuchKey":
+                logger.warning(f"Failed to load content type cache: {e}")
+            return cls()
+
+    def save_s3(self, bucket: str, key: str):
+        with self._lock:
+            body = json.dumps(self.entries)
+        try:
+            boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=body)
+        except ClientError as e:
+            # Only probed again next time
+            logger.warning(f"Failed to save content type cache: {e}")
 
-    if "text/html" in content_type:
+
+def _classify(content_type: str) -> type_content_type:
+    if "text/html" in content_type.lower():
         return "web"
     else:
         return "unstructured"
 
 
-def group_urls_by_content_type(urls: list[str]) -> dict:
-    res: dict = {
-        "web": [],
-        "unstructured": [],
-        "youtube": [],
-    }
-    for url in urls:
-        content_type = check_content_type(url)
+class ContentTypeProber:
+    """Check content types of URLs concurrently with `HEAD` requests.
+    Connections are kept alive and reused per host within each worker thread.
+    """
+
+    def __init__(
+        self,
+        cache: ContentTypeCache | None = None,
+        max_concurrency: int = PROBE_MAX_CONCURRENCY,
+        timeout: AdaptiveTimeout | None = None,
+    ):
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout or AdaptiveTimeout()
+        self._local = threading.local()
+        self._opened: list[http.client.HTTPConnection] = []
+        self._lock = threading.Lock()
+
+    def _get_connection(
+        self, scheme: str, netloc: str
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        """Returns the connection and whether it is reused."""
+        connections: dict = self._local.__dict__.setdefault("connections", {})
+        conn = connections.get((scheme, netloc))
+        if conn is not None:
+            return conn, True
+        if scheme == "https":
+            conn = http.client.HTTPSConnection(netloc)
+        elif scheme == "http":
+            conn = http.client.HTTPConnection(netloc)
+        else:
+            raise ValueError(f"Unsupported scheme: {scheme}")
+        connections[(scheme, netloc)] = conn
+        with self._lock:
+            self._opened.append(conn)
+        return conn, False
+
+    def _drop_connection(self, scheme: str, netloc: str):
+        conn = self._local.__dict__.get("connections", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def _request_head(
+        self, url: str, headers: dict, timeout: float
+    ) -> http.client.HTTPResponse:
+        parsed = urlsplit(url)
+        path = urlunsplit(("", "", parsed.path or "/", parsed.query, ""))
+        while True:
+            conn, reused = self._get_connection(parsed.scheme, parsed.netloc)
+            conn.timeout = timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(timeout)
+            try:
+                conn.request("HEAD", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                return response
+            except (http.client.HTTPException, OSError):
+                self._drop_connection(parsed.scheme, parsed.netloc)
+                # The server may have closed an idle keep-alive connection
+                if not reused:
+                    raise
+
+    def head(
+        self, url: str, etag: str | None = None
+    ) -> tuple[int, http.client.HTTPMessage]:
+        """Send `HEAD` following redirects. Returns the status and headers."""
+        headers = dict(PROBE_HEADERS)
+        if etag:
+            headers["If-None-Match"] = etag
+        for _ in range(PROBE_MAX_REDIRECTS + 1):
+            start = time.monotonic()
+            response = self._request_head(url, headers, self.timeout.get())
+            self.timeout.observe(time.monotonic() - start)
+            location = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                url = urljoin(url, location)
+                continue
+            return response.status, response.headers
+        raise ValueError(f"Too many redirects: {url}")
+
+    def check(self, url: str) -> type_content_type:
+        if _parse_video_id(url):
+            return "youtube"
+
+        entry = self.cache.get(url) if self.cache else None
+        if entry is not None and self.cache is not None and self.cache.is_fresh(entry):
+            return entry["content_type"]
+
+        try:
+            status, headers = self.head(url, etag=entry["etag"] if entry else None)
+        except Exception as e:
+            logger.warning(
+                f"Failed to get content type of {url}: {e}. Use unstructured to load."
+            )
+            return "unstructured"
+
+        if status == 304 and entry is not None:
+            content_type = entry["content_type"]
+        elif status >= 400:
+            logger.warning(
+                f"Failed to get content type of {url}: status {status}. Use unstructured to load."
+            )
+            return "unstructured"
+        else:
+            content_type = _classify(headers.get("Content-Type", ""))
+
+        if self.cache is not None:
+            self.cache.put(url, content_type, headers.get("ETag"))
+        return content_type
+
+    def iter_content_types(
+        self, urls: Iterable[str]
+    ) -> Iterator[tuple[str, type_content_type]]:
+        """Yield `(url, content_type)` in the order the checks complete.
+        `urls` is consumed lazily, a bounded number of URLs ahead of the results.
+        """
+        max_pending = self.max_concurrency * 2
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+                pending: dict[Future, str] = {}
+                for url in urls:
+                    pending[executor.submit(self.check, url)] = url
+                    if len(pending) >= max_pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield pending.pop(future), future.result()
+                for future in as_completed(list(pending)):
+                    yield pending.pop(future), future.result()
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            opened, self._opened = self._opened, []
+        for conn in opened:
+            conn.close()
+
+
+def check_content_type(url) -> type_content_type:
+    prober = ContentTypeProber()
+    try:
+        return prober.check(url)
+    finally:
+        prober.close()
+
+
+def group_urls_by_content_type(
+    urls: Iterable[str], cache: ContentTypeCache | None = None
+) -> dict:
+    res: dict = {content_type: [] for content_type in CONTENT_TYPES}
+    for url, content_type in ContentTypeProber(cache).iter_content_types(urls):
         res[content_type].append(url)
 
     return res
 
 
 class UrlLoader(BaseLoader):
-    """Loads a document from a URL."""
+    """Loads a document from a URL.
+    URLs are classified concurrently and each category is loaded in batches as soon as
+    enough of its URLs are classified, except web pages, which are fed to a single
+    browser as soon as each of them is classified. `urls` may be a lazy iterable (e.g.
+    URLs discovered from sitemaps), which is consumed while loading.
+    """
 
-    def __init__(self, urls: list[str]):
+    def __init__(
+        self,
+        urls: Iterable[str],
+        content_type_cache: ContentTypeCache | None = None,
+        transcript_cache: TranscriptCache | None = None,
+    ):
         self._urls = urls
+        self._content_type_cache = content_type_cache
+        self._transcript_cache = transcript_cache
 
     def load(self) -> list[Document]:
-        res = []
-        categorized_urls = group_urls_by_content_type(self._urls)
-        logger.info(f"URLs are categorized as: {categorized_urls}")
+        return list(self.lazy_load())
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield documents as soon as each batch, or each web page, is loaded."""
+        batches: dict[str, list[str]] = {t: [] for t in CONTENT_TYPES}
+        # One worker per category, so that batches of a category run one after another
+        # while different categories run in parallel.
+        executors = {t: ThreadPoolExecutor(max_workers=1) for t in CONTENT_TYPES}
+        web_urls: queue.Queue = queue.Queue()
+        # Loaded documents, an exception, or `None` when a loader has finished
+        completed: queue.Queue = queue.Queue()
+        running = 0
+
+        def run(loader_type: str, urls: Iterable[str]):
+            try:
+                loader = get_loader(loader_type, urls, self._transcript_cache)
+                if loader_type == "web":
+                    for document in loader.lazy_load():
+                        completed.put([document])
+                else:
+                    completed.put(loader.load())
+            except Exception as e:
+                completed.put(e)
+            finally:
+                completed.put(None)
+
+        def submit(loader_type: str, urls: Iterable[str]):
+            nonlocal running
+            running += 1
+            executors[loader_type].submit(run, loader_type, urls)
+
+        def flush(loader_type: str):
+            urls, batches[loader_type] = batches[loader_type], []
+            logger.info(f"Loading {len(urls)} URLs with {loader_type} loader")
+            submit(loader_type, urls)
 
-        for loader_type, urls in categorized_urls.items():
-            loader = get_loader(loader_type, urls)
-            documents = loader.load()
-            res.extend(documents)
+        def drain(block: bool) -> Iterator[Document]:
+            nonlocal running
+            while running > 0:
+                try:
+                    item = completed.get(block=block)
+                except queue.Empty:
+                    return
+                if item is None:
+                    running -= 1
+                elif isinstance(item, Exception):
+                    raise item
+                else:
+                    yield from item
 
-        return res
+        try:
+            prober = ContentTypeProber(self._content_type_cache)
+            web_started = False
+            for url, loader_type in prober.iter_content_types(self._urls):
+                if loader_type == "web":
+                    # Launch the browser with the first page, and keep it for the rest
+                    if not web_started:
+                        logger.info("Loading URLs with web loader")
+                        submit("web", _iter_queue(web_urls))
+                        web_started = True
+                    web_urls.put(url)
+                else:
+                    batches[loader_type].append(url)
+                    if len(batches[loader_type]) >= LOADER_BATCH_SIZE:
+                        flush(loader_type)
+                yield from drain(block=False)
+            web_urls.put(None)
+            for loader_type in CONTENT_TYPES:
+                if batches[loader_type]:
+                    flush(loader_type)
+            yield from drain(block=True)
+        finally:
+            # Let the browser finish even if classifying failed
+            web_urls.put(None)
+            for executor in executors.values():
+                executor.shutdown(wait=True, cancel_futures=True)
@@ -1,6 +1,15 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Sequence, Union
 from urllib.parse import parse_qs, urlparse
 
+import boto3
+from botocore.exceptions import ClientError
 from embedding.loaders.base import BaseLoader, Document
 from youtube_transcript_api import (
     NoTranscriptFound,
@@ -8,6 +17,22 @@ from youtube_transcript_api import (
     YouTubeTranscriptApi,
 )
 
+logger = logging.getLogger(__name__)
+
+# Videos whose transcripts are fetched at the same time.
+YOUTUBE_MAX_CONCURRENCY = int(os.environ.get("YOUTUBE_MAX_CONCURRENCY", 4))
+# Upper bound of requests per second to YouTube, shared by all workers.
+YOUTUBE_REQUESTS_PER_SEC = float(os.environ.get("YOUTUBE_REQUESTS_PER_SEC", 4))
+YOUTUBE_TRANSCRIPT_CACHE_DIR = os.environ.get(
+    "YOUTUBE_TRANSCRIPT_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "youtube_transcripts"),
+)
+# Seconds to use a cached transcript without fetching it again, since transcripts may
+# be edited or added after the video is published.
+YOUTUBE_TRANSCRIPT_CACHE_TTL_SEC = float(
+    os.environ.get("YOUTUBE_TRANSCRIPT_CACHE_TTL_SEC", 7 * 24 * 60 * 60)
+)
+
 ALLOWED_SCHEMAS = {"http", "https"}
 ALLOWED_NETLOCK = {
     "youtu.be",
@@ -49,15 +74,98 @@ def _parse_video_id(url: str) -> str | None:
     return video_id
 
 
-def _detect_lang(video_id: str) -> str:
-    try:
-        available_transcripts = YouTubeTranscriptApi.list_transcripts(video_id)
-        languages = [transcript.language_code for transcript in available_transcripts]
-    except Exception as e:
-        raise Exception(f"Failed to detect language: {e}")
+class RateLimiter:
+    """Space calls at least `1 / rate_per_sec` seconds apart across threads."""
+
+    def __init__(self, rate_per_sec: float):
+        self.interval = 1.0 / rate_per_sec if rate_per_sec > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if wait > 0:
+            time.sleep(wait)
 
-    # Only the first language is used.
-    return languages[0]
+
+class TranscriptCache:
+    """Transcripts keyed by video id and language, stored as JSON files in `directory`.
+    If `bucket` is given, entries are also stored under `prefix` in S3, so that they
+    survive the embedding task and are reused by the next sync.
+    Entries older than `ttl_sec` are ignored, so that transcripts are fetched again.
+    """
+
+    def __init__(
+        self,
+        directory: str = YOUTUBE_TRANSCRIPT_CACHE_DIR,
+        bucket: str | None = None,
+        prefix: str = "",
+        ttl_sec: float = YOUTUBE_TRANSCRIPT_CACHE_TTL_SEC,
+    ):
+        self.directory = directory
+        self.bucket = bucket
+        self.prefix = prefix.rstrip("/")
+        self.ttl_sec = ttl_sec
+        self.client = boto3.client("s3") if bucket is not None else None
+
+    def _name(self, video_id: str, language: str) -> str:
+        return f"{video_id}/{language}.json"
+
+    def is_fresh(self, entry: dict) -> bool:
+        # Entries stored without `fetched_at` are treated as stale
+        return time.time() - entry.get("fetched_at", 0) <= self.ttl_sec
+
+    def get(self, video_id: str, language: str) -> dict | None:
+        name = self._name(video_id, language)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+            if self.is_fresh(entry):
+                return entry
+        except (OSError, ValueError):
+            pass
+        if self.client is None:
+            return None
+        try:
+            response = self.client.get_object(
+                Bucket=self.bucket, Key=f"{self.prefix}/{name}"
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+                logger.warning(f"Failed to get cached transcript: {e}")
+            return None
+        entry = json.loads(response["Body"].read())
+        if not self.is_fresh(entry):
+            return None
+        self._write_file(path, entry)
+        return entry
+
+    def _write_file(self, path: str, entry: dict):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write to a temporary file first, so that readers never see a partial file
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+    def put(self, video_id: str, language: str, entry: dict):
+        entry = {**entry, "fetched_at": time.time()}
+        name = self._name(video_id, language)
+        self._write_file(os.path.join(self.directory, name), entry)
+        if self.client is None:
+            return
+        try:
+            self.client.put_object(
+                Bucket=self.bucket,
+                Key=f"{self.prefix}/{name}",
+                Body=json.dumps(entry, ensure_ascii=False).encode("utf-8"),
+            )
+        except ClientError as e:
+            logger.warning(f"Failed to put cached transcript: {e}")
 
 
 class YoutubeLoader(BaseLoader):
@@ -66,11 +174,16 @@ class YoutubeLoader(BaseLoader):
     def __init__(
         self,
         video_id: str,
-        language: Union[str, Sequence[str]] = "en",
+        language: Union[str, Sequence[str], None] = "en",
         translation: str | None = None,
         continue_on_failure: bool = False,
+        cache: TranscriptCache | None = None,
+        transcript_api: Any = YouTubeTranscriptApi,
+        rate_limiter: RateLimiter | None = None,
     ):
-        """Initialize with YouTube video ID."""
+        """Initialize with YouTube video ID.
+        `language` of None uses the first transcript listed for the video.
+        """
         self.video_id = video_id
         self.language = language
         if isinstance(language, str):
@@ -79,6 +192,9 @@ class YoutubeLoader(BaseLoader):
             self.language = language
         self.translation = translation
         self.continue_on_failure = continue_on_failure
+        self.cache = cache
+        self.transcript_api = transcript_api
+        self.rate_limiter = rate_limiter
 
     @staticmethod
     def extract_video_id(youtube_url: str) -> str:
@@ -90,41 +206,99 @@ class YoutubeLoader(BaseLoader):
             )
         return video_id
 
-    def load(self) -> list[Document]:
-        """Load documents."""
-        metadata = {"source": self.video_id}
+    def _cache_language(self) -> str:
+        language = ",".join(self.language) if self.language is not None else "auto"
+        if self.translation is not None:
+            language += f">{self.translation}"
+        return language
+
+    def _call(self, func, *args):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        return func(*args)
 
+    def _fetch(self) -> dict | None:
+        """Fetch the transcript with a single listing of the video's transcripts."""
         try:
-            transcript_list = YouTubeTranscriptApi.list_transcripts(self.video_id)
+            transcript_list = self._call(
+                self.transcript_api.list_transcripts, self.video_id
+            )
         except TranscriptsDisabled:
-            return []
+            if self.language is None:
+                raise Exception("Failed to detect language: transcripts disabled")
+            return None
+        except Exception as e:
+            if self.language is None:
+                raise Exception(f"Failed to detect language: {e}")
+            raise
 
-        try:
-            transcript = transcript_list.find_transcript(self.language)
-        except NoTranscriptFound:
-            transcript = transcript_list.find_transcript(["en"])
+        if self.language is None:
+            # Only the first language is used.
+            transcript = next(iter(transcript_list), None)
+            if transcript is None:
+                raise Exception("Failed to detect language: no transcripts")
+        else:
+            try:
+                transcript = transcript_list.find_transcript(self.language)
+            except NoTranscriptFound:
+                transcript = transcript_list.find_transcript(["en"])
 
         if self.translation is not None:
             transcript = transcript.translate(self.translation)
 
-        transcript_pieces = transcript.fetch()
+        transcript_pieces = self._call(transcript.fetch)
+        return {
+            "language": transcript.language_code,
+            "text": " ".join([t["text"].strip(" ") for t in transcript_pieces]),
+        }
+
+    def load(self) -> list[Document]:
+        """Load documents."""
+        metadata = {"source": self.video_id}
 
-        transcript = " ".join([t["text"].strip(" ") for t in transcript_pieces])
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(self.video_id, self._cache_language())
+        if entry is None:
+            entry = self._fetch()
+            if entry is None:
+                return []
+            if self.cache is not None:
+                self.cache.put(self.video_id, self._cache_language(), entry)
 
-        return [Document(page_content=transcript, metadata=metadata)]
+        return [Document(page_content=entry["text"], metadata=metadata)]
 
 
 class YoutubeLoaderWithLangDetection(YoutubeLoader):
-    """Loads a YouTube video transcript and detects the language automatically."""
+    """Loads YouTube video transcripts and detects the language automatically.
+    Videos are fetched concurrently, with requests to YouTube rate limited.
+    """
 
-    def __init__(self, urls: list[str]):
+    def __init__(
+        self,
+        urls: list[str],
+        cache: TranscriptCache | None = None,
+        max_concurrency: int = YOUTUBE_MAX_CONCURRENCY,
+        requests_per_sec: float = YOUTUBE_REQUESTS_PER_SEC,
+        transcript_api: Any = YouTubeTranscriptApi,
+    ):
         self._urls = urls
+        self.cache = cache
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_sec)
+        self.transcript_api = transcript_api
+
+    def _load_video(self, video_id: str) -> list[Document]:
+        return YoutubeLoader(
+            video_id,
+            language=None,
+            cache=self.cache,
+            transcript_api=self.transcript_api,
+            rate_limiter=self.rate_limiter,
+        ).load()
 
     def load(self) -> list[Document]:
-        documents = []
-        for url in self._urls:
-            video_id = YoutubeLoader.extract_video_id(url)
-            language = _detect_lang(video_id)
-            loader = YoutubeLoader(video_id, language=language)
-            documents.extend(loader.load())
-        return documents
+        video_ids = [YoutubeLoader.extract_video_id(url) for url in self._urls]
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            results = list(executor.map(self._load_video, video_ids))
+        return [document for documents in results for document in documents]
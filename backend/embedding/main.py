@@ -1,13 +1,18 @@
 import argparse
+import contextlib
+import itertools
 import json
 import logging
 import multiprocessing
 import os
-from multiprocessing.managers import ListProxy
-from typing import Any
+import tempfile
+from multiprocessing.pool import Pool
+from typing import IO, Any, Iterable, Iterator
 
+import numpy as np
 import pg8000
 import requests
+from app.bedrock import EMBEDDING_MAX_CONCURRENCY, EMBEDDING_MAX_TEXTS_PER_REQUEST
 from app.config import DEFAULT_EMBEDDING_CONFIG
 from app.repositories.common import RecordNotFoundError, _get_table_client
 from app.repositories.custom_bot import (
@@ -16,15 +21,40 @@ from app.repositories.custom_bot import (
     find_private_bot_by_id,
 )
 from app.routes.schemas.bot import type_sync_status
-from app.utils import compose_upload_document_s3_path
+from app.vector_index import ensure_bot_index
+from app.utils import (
+    compose_pdf_partition_cache_s3_prefix,
+    compose_upload_document_s3_path,
+    compose_url_content_type_cache_s3_path,
+    compose_youtube_transcript_cache_s3_prefix,
+)
 from aws_lambda_powertools.utilities import parameters
+from embedding.chunking import ChunkSizeHistogram, TextChunker
 from embedding.loaders import UrlLoader
-from embedding.loaders.base import BaseLoader
+from embedding.loaders.url import ContentTypeCache
+from embedding.loaders.youtube import TranscriptCache
+from embedding.loaders.base import BaseLoader, Document
 from embedding.loaders.s3 import S3FileLoader
+from embedding.loaders.sitemap import SitemapLoader
+from embedding.pipeline import Pipeline, bounded_imap
+from embedding.sync import (
+    SyncPlan,
+    compose_fingerprint,
+    compose_params_digest,
+    get_documents_fingerprints,
+    get_s3_object_fingerprint,
+)
+from embedding.vector_store import (
+    BotEmbeddingWriter,
+    compose_content_hash,
+    ensure_schema,
+    get_embeddings_by_content_hash,
+    get_source_fingerprints,
+    iter_spooled_rows,
+    spool_rows,
+)
 from embedding.wrapper import DocumentSplitter, Embedder
-from llama_index.core.node_parser import SentenceSplitter
 from retry import retry
-from ulid import ULID
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -44,6 +74,14 @@ RETRY_DELAY_TO_INSERT_TO_POSTGRES = 2
 RETRIES_TO_UPDATE_SYNC_STATUS = 4
 RETRY_DELAY_TO_UPDATE_SYNC_STATUS = 2
 
+# Chunks passed between the pipeline stages at once. Matches what a single
+# `calculate_document_embeddings` call sends to Bedrock concurrently.
+EMBED_BATCH_SIZE = EMBEDDING_MAX_TEXTS_PER_REQUEST * EMBEDDING_MAX_CONCURRENCY
+# Batches buffered between stages. Bounds memory regardless of the corpus size.
+PIPELINE_QUEUE_SIZE = 4
+# Files partitioned ahead of the embedding stage.
+LOADERS_AHEAD = multiprocessing.cpu_count()
+
 DB_SECRETS_ARN = os.environ.get("DB_SECRETS_ARN", "")
 DOCUMENT_BUCKET = os.environ.get("DOCUMENT_BUCKET", "documents")
 
@@ -61,13 +99,11 @@ def get_exec_id() -> str:
 
 
 @retry(tries=RETRIES_TO_INSERT_TO_POSTGRES, delay=RETRY_DELAY_TO_INSERT_TO_POSTGRES)
-def insert_to_postgres(
-    bot_id: str, contents: ListProxy, sources: ListProxy, embeddings: ListProxy
-):
+def connect_to_postgres() -> pg8000.Connection:
     secrets: Any = parameters.get_secret(DB_SECRETS_ARN)  # type: ignore
     db_info = json.loads(secrets)
 
-    conn = pg8000.connect(
+    return pg8000.connect(
         database=db_info["dbname"],
         host=db_info["host"],
         port=db_info["port"],
@@ -75,30 +111,6 @@ def insert_to_postgres(
         password=db_info["password"],
     )
 
-    try:
-        with conn.cursor() as cursor:
-            delete_query = "DELETE FROM items WHERE botid = %s"
-            cursor.execute(delete_query, (bot_id,))
-
-            insert_query = f"INSERT INTO items (id, botid, content, source, embedding) VALUES (%s, %s, %s, %s, %s)"
-            values_to_insert = []
-            for i, (source, content, embedding) in enumerate(
-                zip(sources, contents, embeddings)
-            ):
-                id_ = str(ULID())
-                logger.info(f"Preview of content {i}: {content[:200]}")
-                values_to_insert.append(
-                    (id_, bot_id, content, source, json.dumps(embedding))
-                )
-            cursor.executemany(insert_query, values_to_insert)
-        conn.commit()
-        logger.info(f"Successfully inserted {len(values_to_insert)} records.")
-    except Exception as e:
-        conn.rollback()
-        raise e
-    finally:
-        conn.close()
-
 
 @retry(tries=RETRIES_TO_UPDATE_SYNC_STATUS, delay=RETRY_DELAY_TO_UPDATE_SYNC_STATUS)
 def update_sync_status(
@@ -120,32 +132,242 @@ def update_sync_status(
     )
 
 
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> DocumentSplitter:
+    # Cohere Embed on Bedrock limits the input by characters
+    return DocumentSplitter(splitter=TextChunker(chunk_size, chunk_overlap))
+
+
+def load_and_split(
+    loader: BaseLoader, chunk_size: int, chunk_overlap: int
+) -> list[Document]:
+    return _get_splitter(chunk_size, chunk_overlap).split_documents(loader.lazy_load())
+
+
 def embed(
-    loader: BaseLoader,
-    contents: ListProxy,
-    sources: ListProxy,
-    embeddings: ListProxy,
-    chunk_size: int,
-    chunk_overlap: int,
-):
-    splitter = DocumentSplitter(
-        splitter=SentenceSplitter(
-            paragraph_separator=r"\n\n\n",
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            # Use length of text as token count for cohere-multilingual-v3
-            tokenizer=lambda text: [0] * len(text),
-        )
+    conn: pg8000.Connection, bot_id: str, chunks: list[Document]
+) -> tuple[np.ndarray, list[str]]:
+    """Calculate embeddings of the chunks. Embeddings of chunks whose content is already
+    stored for the bot are reused instead of calling Bedrock.
+    Returns embeddings and content hashes of the chunks.
+    """
+    model_id = DEFAULT_EMBEDDING_CONFIG["model_id"]
+    content_hashes = [compose_content_hash(model_id, c.page_content) for c in chunks]
+    stored = get_embeddings_by_content_hash(conn, bot_id, sorted(set(content_hashes)))
+
+    missing: dict[str, Document] = {}
+    for content_hash, chunk in zip(content_hashes, chunks):
+        if content_hash not in stored:
+            missing.setdefault(content_hash, chunk)
+    logger.info(
+        f"Number of chunks: {len(chunks)}, reused: {len(chunks) - len(missing)}, to embed: {len(missing)}"
     )
+
     embedder = Embedder(verbose=True)
+    if len(missing) > 0:
+        calculated = embedder.embed_documents(list(missing.values()))
+        stored.update(zip(missing.keys(), calculated))
 
-    documents = loader.load()
-    splitted = splitter.split_documents(documents)
-    splitted_embeddings = embedder.embed_documents(splitted)
+    if len(chunks) == 0:
+        return np.empty((0, 0), dtype=np.float32), []
+    return np.stack([stored[h] for h in content_hashes]), content_hashes
 
-    contents.extend([t.page_content for t in splitted])
-    sources.extend([t.metadata["source"] for t in splitted])
-    embeddings.extend(splitted_embeddings)
+
+def iter_urls_to_load(
+    source_urls: list[str],
+    sitemap_urls: list[str],
+    plan: SyncPlan,
+    previous: dict[str, str],
+    params_digest: str,
+    lastmod_fingerprints: dict[str, str],
+) -> Iterator[str]:
+    """Yield source URLs and then pages discovered from sitemaps as they are parsed.
+    Pages whose `lastmod` has not changed since the last sync are skipped.
+    """
+    yield from source_urls
+    if len(sitemap_urls) == 0:
+        return
+
+    for entry in SitemapLoader(sitemap_urls, exclude=source_urls).iter_entries():
+        if entry.lastmod is None:
+            yield entry.loc
+            continue
+        fingerprint = compose_fingerprint(params_digest, "lastmod", entry.lastmod)
+        lastmod_fingerprints[entry.loc] = fingerprint
+        plan.add(entry.loc, fingerprint, previous)
+        if entry.loc in plan.changed:
+            yield entry.loc
+
+
+def iter_url_chunks(
+    loader: UrlLoader,
+    splitter: DocumentSplitter,
+    plan: SyncPlan,
+    previous: dict[str, str],
+    params_digest: str,
+    lastmod_fingerprints: dict[str, str],
+) -> Iterator[Document]:
+    """Yield chunks of the pages which have changed, as soon as each page is loaded.
+    Pages not fingerprinted by `lastmod` are fingerprinted by their content on arrival.
+    """
+    loaded_sources: set[str] = set()
+    for document in loader.lazy_load():
+        source = document.metadata["source"]
+        loaded_sources.add(source)
+        if source not in lastmod_fingerprints:
+            # URL loaders return a single document per page
+            fingerprints = get_documents_fingerprints([document], params_digest)
+            plan.add(source, fingerprints[source], previous)
+        if source in plan.changed:
+            yield from splitter.iter_split_documents([document])
+
+    # Forget pages which failed to load, so that they are retried next time
+    for source in lastmod_fingerprints:
+        if source in plan.changed and source not in loaded_sources:
+            del plan.changed[source]
+
+
+def _partitions_in_parallel(loader: BaseLoader) -> bool:
+    return isinstance(loader, S3FileLoader) and loader.partitions_pdf_in_parallel
+
+
+def iter_chunk_batches(
+    pool: Pool,
+    chunks: Iterable[Document],
+    loaders: list[BaseLoader],
+    chunk_size: int,
+    chunk_overlap: int,
+) -> Iterator[list[Document]]:
+    """Yield batches of `chunks` (consumed lazily) and then of chunks of `loaders`.
+    Loaders are run in `pool`, a few of them ahead of the consumer. Loaders which
+    partition PDFs in parallel run in this process afterwards, since they use all cores
+    by themselves and the workers of `pool` cannot start processes.
+    """
+
+    def _batches(chunks: Iterable[Document]) -> Iterator[list[Document]]:
+        iterator = iter(chunks)
+        while batch := list(itertools.islice(iterator, EMBED_BATCH_SIZE)):
+            yield batch
+
+    yield from _batches(chunks)
+    for loaded in bounded_imap(
+        pool,
+        load_and_split,
+        [
+            (loader, chunk_size, chunk_overlap)
+            for loader in loaders
+            if not _partitions_in_parallel(loader)
+        ],
+        max_pending=LOADERS_AHEAD,
+    ):
+        yield from _batches(loaded)
+    for loader in loaders:
+        if _partitions_in_parallel(loader):
+            # Pages are embedded as soon as they are partitioned
+            yield from _batches(
+                _get_splitter(chunk_size, chunk_overlap).iter_split_documents(
+                    loader.lazy_load()
+                )
+            )
+
+
+@retry(tries=RETRIES_TO_INSERT_TO_POSTGRES, delay=RETRY_DELAY_TO_INSERT_TO_POSTGRES)
+def rewrite_spooled_rows(bot_id: str, plan: SyncPlan, spool: IO[bytes]) -> int:
+    """Write the spooled rows again in a new transaction. Returns the number of rows."""
+    conn = connect_to_postgres()
+    try:
+        writer = BotEmbeddingWriter(conn, bot_id, plan.sources_to_replace)
+        try:
+            for rows in iter_spooled_rows(spool):
+                writer.write(*rows)
+            return writer.commit(plan.changed)
+        except Exception:
+            writer.rollback()
+            raise
+    finally:
+        conn.close()
+
+
+def _rollback_quietly(writer: BotEmbeddingWriter):
+    try:
+        writer.rollback()
+    except Exception as e:
+        logger.warning(f"Failed to roll back: {e}")
+
+
+def embed_and_write(
+    bot_id: str,
+    plan: SyncPlan,
+    previous: dict[str, str],
+    chunk_batches: Iterable[list[Document]],
+) -> int:
+    """Embed chunk batches and write them to postgres as they arrive.
+    `plan` may be updated while `chunk_batches` is consumed (e.g. by `iter_url_chunks`),
+    and is finalized afterwards. All rows are committed in a single transaction at the
+    end, unless there is no change.
+    Rows are also spooled to a local file, so that if writing or committing fails
+    (e.g. the connection is dropped), they are written again in a new transaction
+    without loading and embedding the sources again.
+    Returns the number of written rows.
+    """
+    lookup_conn = connect_to_postgres()
+    write_conn = connect_to_postgres()
+    histogram = ChunkSizeHistogram()
+    write_error: Exception | None = None
+    try:
+        writer = BotEmbeddingWriter(write_conn, bot_id, plan.sources_to_replace)
+
+        def embed_batch(chunks: list[Document]):
+            embeddings, content_hashes = embed(lookup_conn, bot_id, chunks)
+            return chunks, embeddings, content_hashes
+
+        def write_batch(batch: tuple[list[Document], np.ndarray, list[str]]):
+            nonlocal write_error
+            chunks, embeddings, content_hashes = batch
+            histogram.add(len(c.page_content) for c in chunks)
+            rows = (
+                [c.page_content for c in chunks],
+                [c.metadata["source"] for c in chunks],
+                embeddings,
+                content_hashes,
+            )
+            spool_rows(spool, *rows)
+            if write_error is not None:
+                return
+            try:
+                writer.write(*rows)
+            except Exception as e:
+                # Keep embedding, and write all the rows again at the end
+                logger.warning(f"Failed to write rows, retrying after embedding: {e}")
+                write_error = e
+
+        with tempfile.TemporaryFile() as spool:
+            try:
+                Pipeline(
+                    [embed_batch, write_batch], queue_size=PIPELINE_QUEUE_SIZE
+                ).run(chunk_batches)
+            except Exception:
+                _rollback_quietly(writer)
+                raise
+            logger.info(histogram.summary())
+
+            plan.finalize(previous)
+            writer.sources_to_replace = plan.sources_to_replace
+            if not plan.has_changes:
+                _rollback_quietly(writer)
+                return 0
+
+            if write_error is None:
+                try:
+                    return writer.commit(plan.changed)
+                except Exception as e:
+                    logger.warning(f"Failed to commit rows, retrying: {e}")
+            _rollback_quietly(writer)
+            return rewrite_spooled_rows(bot_id, plan, spool)
+    finally:
+        lookup_conn.close()
+        # The connection may have been dropped, which is already handled above
+        with contextlib.suppress(Exception):
+            write_conn.close()
 
 
 def main(
@@ -187,53 +409,106 @@ def main(
             )
             return
 
-        # Calculate embeddings using LangChain
-        with multiprocessing.Manager() as manager:
-            contents: ListProxy = manager.list()
-            sources: ListProxy = manager.list()
-            embeddings: ListProxy = manager.list()
-
-            if len(source_urls) > 0:
-                embed(
-                    UrlLoader(source_urls),
-                    contents,
-                    sources,
-                    embeddings,
-                    chunk_size,
-                    chunk_overlap,
-                )
-            if len(sitemap_urls) > 0:
-                for sitemap_url in sitemap_urls:
-                    raise NotImplementedError()
-            if len(filenames) > 0:
-                with multiprocessing.Pool(processes=None) as pool:
-                    futures = [
-                        pool.apply_async(
-                            embed,
-                            args=(
-                                S3FileLoader(
-                                    bucket=DOCUMENT_BUCKET,
-                                    key=compose_upload_document_s3_path(
-                                        user_id, bot_id, filename
-                                    ),
-                                    enable_partition_pdf=enable_partition_pdf,
-                                ),
-                                contents,
-                                sources,
-                                embeddings,
-                                chunk_size,
-                                chunk_overlap,
+        conn = connect_to_postgres()
+        try:
+            ensure_schema(conn)
+            previous = get_source_fingerprints(conn, bot_id)
+        finally:
+            conn.close()
+        plan = SyncPlan(full_rebuild=len(previous) == 0)
+        params_digest = compose_params_digest(
+            DEFAULT_EMBEDDING_CONFIG["model_id"],
+            chunk_size,
+            chunk_overlap,
+            enable_partition_pdf,
+        )
+
+        keys_to_load: list[str] = []
+        for filename in filenames:
+            key = compose_upload_document_s3_path(user_id, bot_id, filename)
+            # Same as the `source` metadata set by `S3FileLoader`
+            source = f"s3://{DOCUMENT_BUCKET}/{key}"
+            plan.add(
+                source,
+                get_s3_object_fingerprint(DOCUMENT_BUCKET, key, params_digest),
+                previous,
+            )
+            if source in plan.changed:
+                keys_to_load.append(key)
+
+        url_chunks: Iterable[Document] = []
+        content_type_cache: ContentTypeCache | None = None
+        cache_key = compose_url_content_type_cache_s3_path(user_id, bot_id)
+        if len(source_urls) + len(sitemap_urls) > 0:
+            # Pages listed in sitemaps with `lastmod` are fingerprinted by it
+            lastmod_fingerprints: dict[str, str] = {}
+            content_type_cache = ContentTypeCache.load_s3(DOCUMENT_BUCKET, cache_key)
+            url_chunks = iter_url_chunks(
+                UrlLoader(
+                    iter_urls_to_load(
+                        source_urls,
+                        sitemap_urls,
+                        plan,
+                        previous,
+                        params_digest,
+                        lastmod_fingerprints,
+                    ),
+                    content_type_cache,
+                    TranscriptCache(
+                        bucket=DOCUMENT_BUCKET,
+                        prefix=compose_youtube_transcript_cache_s3_prefix(
+                            user_id, bot_id
+                        ),
+                    ),
+                ),
+                _get_splitter(chunk_size, chunk_overlap),
+                plan,
+                previous,
+                params_digest,
+                lastmod_fingerprints,
+            )
+
+        # Pages are loaded, split and embedded as they arrive. Partitioning files runs
+        # in worker processes (CPU bound) while embedding and writing run in threads
+        # (I/O bound) of this process.
+        with multiprocessing.Pool(processes=None) as pool:
+            count = embed_and_write(
+                bot_id,
+                plan,
+                previous,
+                iter_chunk_batches(
+                    pool,
+                    url_chunks,
+                    [
+                        S3FileLoader(
+                            bucket=DOCUMENT_BUCKET,
+                            key=key,
+                            enable_partition_pdf=enable_partition_pdf,
+                            partition_cache_prefix=compose_pdf_partition_cache_s3_prefix(
+                                user_id, bot_id
                             ),
                         )
-                        for filename in filenames
-                    ]
-                    for future in futures:
-                        future.get()
-
-            logger.info(f"Number of chunks: {len(contents)}")
+                        for key in keys_to_load
+                    ],
+                    chunk_size,
+                    chunk_overlap,
+                ),
+            )
+        if content_type_cache is not None:
+            content_type_cache.save_s3(DOCUMENT_BUCKET, cache_key)
 
-            # Insert records into postgres
-            insert_to_postgres(bot_id, contents, sources, embeddings)
+        logger.info(
+            f"Sources changed: {len(plan.changed)}, unchanged: {len(plan.unchanged)}, removed: {len(plan.removed)}"
+        )
+        if not plan.has_changes:
+            status_reason = "No changes in knowledge."
+        else:
+            logger.info(f"Number of chunks: {count}")
+            conn = connect_to_postgres()
+            try:
+                ensure_bot_index(conn, bot_id)
+            finally:
+                conn.close()
             status_reason = "Successfully inserted to vector store."
     except Exception as e:
         logger.error("[ERROR] Failed to embed.")
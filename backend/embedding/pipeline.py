@@ -0,0 +1,117 @@
+"""Staged pipeline with bounded queues.
+
+Each stage runs in its own thread and passes its outputs to the next stage through a
+bounded queue, so that slow stages apply back-pressure to the earlier ones and the
+number of items in flight (and the memory they use) stays constant.
+"""
+
+import logging
+import queue
+import threading
+from collections import deque
+from multiprocessing.pool import AsyncResult, Pool
+from typing import Any, Callable, Iterable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait on a queue before checking whether the pipeline was aborted.
+_POLL_INTERVAL_SEC = 0.1
+_DONE = object()
+
+
+class _Aborted(Exception):
+    pass
+
+
+class Pipeline:
+    """Run `source` items through `stages` in order.
+    Stage functions are called with one item and return the item for the next stage.
+    The first exception raised by any stage is re-raised by `run`.
+    """
+
+    def __init__(self, stages: list[Callable[[Any], Any]], queue_size: int = 4):
+        self.stages = stages
+        self.queues: list[queue.Queue] = [
+            queue.Queue(maxsize=queue_size) for _ in stages
+        ]
+        self._error: BaseException | None = None
+        self._aborted = threading.Event()
+
+    def _put(self, q: queue.Queue, item: Any):
+        while True:
+            if self._aborted.is_set():
+                raise _Aborted()
+            try:
+                q.put(item, timeout=_POLL_INTERVAL_SEC)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue) -> Any:
+        while True:
+            if self._aborted.is_set():
+                raise _Aborted()
+            try:
+                return q.get(timeout=_POLL_INTERVAL_SEC)
+            except queue.Empty:
+                continue
+
+    def _abort(self, e: BaseException):
+        if self._error is None:
+            self._error = e
+        self._aborted.set()
+
+    def _run_stage(self, index: int):
+        stage = self.stages[index]
+        in_queue = self.queues[index]
+        out_queue = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        try:
+            while True:
+                item = self._get(in_queue)
+                if item is _DONE:
+                    break
+                result = stage(item)
+                if out_queue is not None:
+                    self._put(out_queue, result)
+            if out_queue is not None:
+                self._put(out_queue, _DONE)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            logger.error(f"Pipeline stage {stage.__name__} failed: {e}")
+            self._abort(e)
+
+    def run(self, source: Iterable[Any]):
+        threads = [
+            threading.Thread(target=self._run_stage, args=(i,), daemon=True)
+            for i in range(len(self.stages))
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for item in source:
+                self._put(self.queues[0], item)
+            self._put(self.queues[0], _DONE)
+        except _Aborted:
+            pass
+        except BaseException as e:
+            self._abort(e)
+        for thread in threads:
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def bounded_imap(
+    pool: Pool, func: Callable, args_list: Iterable[tuple], max_pending: int
+) -> Iterator[Any]:
+    """Like `Pool.imap`, but submit at most `max_pending` tasks ahead of the consumer,
+    so that results do not pile up in memory when the consumer is slower.
+    """
+    pending: deque[AsyncResult] = deque()
+    for args in args_list:
+        pending.append(pool.apply_async(func, args=args))
+        if len(pending) >= max_pending:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
@@ -0,0 +1,85 @@
+"""Decide which knowledge sources of a bot need to be embedded again.
+
+A fingerprint is stored per source (see `embedding.vector_store`). It covers the
+embedding parameters and the content of the source, so that a source is loaded,
+split and embedded again only when one of them has changed.
+"""
+
+import hashlib
+import json
+from dataclasses import dataclass, field
+
+import boto3
+from embedding.loaders.base import Document
+
+
+def compose_params_digest(
+    model_id: str, chunk_size: int, chunk_overlap: int, enable_partition_pdf: bool
+) -> str:
+    """Digest of the parameters which affect the chunks and their embeddings."""
+    params = json.dumps(
+        [model_id, chunk_size, chunk_overlap, enable_partition_pdf], sort_keys=True
+    )
+    return hashlib.sha256(params.encode("utf-8")).hexdigest()
+
+
+def compose_fingerprint(params_digest: str, *parts: str) -> str:
+    hasher = hashlib.sha256(params_digest.encode("utf-8"))
+    for part in parts:
+        hasher.update(b"\0")
+        hasher.update(part.encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def get_s3_object_fingerprint(bucket: str, key: str, params_digest: str) -> str:
+    """Fingerprint of an S3 object from its ETag, without downloading it."""
+    response = boto3.client("s3").head_object(Bucket=bucket, Key=key)
+    return compose_fingerprint(params_digest, response["ETag"])
+
+
+def get_documents_fingerprints(
+    documents: list[Document], params_digest: str
+) -> dict[str, str]:
+    """Fingerprint of each source from the contents of its documents."""
+    contents: dict[str, list[str]] = {}
+    for document in documents:
+        contents.setdefault(document.metadata["source"], []).append(
+            document.page_content
+        )
+    return {
+        source: compose_fingerprint(params_digest, *texts)
+        for source, texts in contents.items()
+    }
+
+
+@dataclass
+class SyncPlan:
+    """Sources to embed again and sources to delete from the vector store."""
+
+    # Fingerprints of the sources which are new or have changed.
+    changed: dict[str, str] = field(default_factory=dict)
+    unchanged: set[str] = field(default_factory=set)
+    removed: set[str] = field(default_factory=set)
+    # True if the stored rows have no fingerprints (e.g. synced by an older version),
+    # in which case all rows of the bot are replaced.
+    full_rebuild: bool = False
+
+    def add(self, source: str, fingerprint: str, previous: dict[str, str]):
+        if not self.full_rebuild and previous.get(source) == fingerprint:
+            self.unchanged.add(source)
+        else:
+            self.changed[source] = fingerprint
+
+    def finalize(self, previous: dict[str, str]):
+        if not self.full_rebuild:
+            self.removed = set(previous) - set(self.changed) - self.unchanged
+
+    @property
+    def sources_to_replace(self) -> list[str] | None:
+        if self.full_rebuild:
+            return None
+        return sorted(set(self.changed) | self.removed)
+
+    @property
+    def has_changes(self) -> bool:
+        return self.full_rebuild or len(self.changed) + len(self.removed) > 0
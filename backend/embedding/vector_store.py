@@ -0,0 +1,304 @@
+"""Write chunks and their embeddings to the pgvector `items` table.
+
+Each row stores a hash of its content (`content_hash`), and `item_sources` stores a
+fingerprint per source, so that unchanged sources and chunks are not embedded again.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import struct
+from typing import IO, Iterable, Iterator, Literal, Sequence
+
+import numpy as np
+from app.vector_index import ensure_table_index
+from ulid import ULID
+
+logger = logging.getLogger(__name__)
+
+# `copy` streams rows with `COPY ... FROM STDIN (FORMAT BINARY)`.
+# `insert` uses `executemany` with text vectors (previous behavior).
+type_insert_mode = Literal["copy", "insert"]
+INSERT_MODE: type_insert_mode = os.environ.get("PGVECTOR_INSERT_MODE", "copy")  # type: ignore
+# COPY into a temporary staging table first, so that rows of the bot are
+# replaced by a single short `DELETE` + `INSERT ... SELECT` at the end.
+USE_STAGING_TABLE = os.environ.get("PGVECTOR_USE_STAGING_TABLE", "true") == "true"
+# Size of each COPY data message sent to the server.
+COPY_CHUNK_BYTES = 1024 * 1024
+
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_PGCOPY_TRAILER = struct.pack("!h", -1)
+_ITEMS_COLUMNS = "(id, botid, content, source, embedding, content_hash)"
+
+
+def compose_content_hash(model_id: str, content: str) -> str:
+    """Hash of a chunk. Chunks with the same hash share the same embedding."""
+    return hashlib.sha256(f"{model_id}\0{content}".encode("utf-8")).hexdigest()
+
+
+def ensure_schema(conn):
+    """Add the columns and tables used for incremental sync if they do not exist,
+    and the vector indexes of `app.vector_index`.
+    Tables created by older versions of `setup-pgvector` are migrated in place.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "ALTER TABLE items ADD COLUMN IF NOT EXISTS content_hash CHAR(64)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_items_botid_content_hash ON items (botid, content_hash)"
+        )
+        cursor.execute(
+            """CREATE TABLE IF NOT EXISTS item_sources(
+                botid CHAR(26),
+                source text,
+                fingerprint CHAR(64),
+                PRIMARY KEY (botid, source))"""
+        )
+    conn.commit()
+    ensure_table_index(conn)
+
+
+def get_source_fingerprints(conn, bot_id: str) -> dict[str, str]:
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT source, fingerprint FROM item_sources WHERE botid = %s", (bot_id,)
+        )
+        return {source: fingerprint for source, fingerprint in cursor.fetchall()}
+
+
+def get_embeddings_by_content_hash(
+    conn, bot_id: str, content_hashes: Sequence[str]
+) -> dict[str, np.ndarray]:
+    """Get stored embeddings of the bot which have one of the hashes."""
+    if len(content_hashes) == 0:
+        return {}
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT DISTINCT ON (content_hash) content_hash, embedding::text FROM items WHERE botid = %s AND content_hash = ANY(%s)",
+            (bot_id, list(content_hashes)),
+        )
+        return {
+            content_hash: np.asarray(json.loads(embedding), dtype=np.float32)
+            for content_hash, embedding in cursor.fetchall()
+        }
+
+
+def encode_vector(embedding: Sequence[float] | np.ndarray) -> bytes:
+    """Encode embedding in the binary format of pgvector `vector` (`vector_send`)."""
+    values = np.asarray(embedding, dtype=">f4")
+    return struct.pack("!HH", len(values), 0) + values.tobytes()
+
+
+def _encode_text(value: str) -> bytes:
+    data = value.encode("utf-8")
+    return struct.pack("!i", len(data)) + data
+
+
+def encode_binary_copy_rows(
+    bot_id: str,
+    contents: Iterable[str],
+    sources: Iterable[str],
+    embeddings: Iterable[Sequence[float] | np.ndarray],
+    content_hashes: Iterable[str],
+    chunk_bytes: int = COPY_CHUNK_BYTES,
+) -> Iterator[bytes]:
+    """Encode rows of `items` in the PostgreSQL binary COPY format.
+    Yields chunks of about `chunk_bytes` so that memory stays bounded.
+    Ref: https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+    """
+    encoded_bot_id = _encode_text(bot_id)
+    buffer = bytearray(_PGCOPY_HEADER)
+    for content, source, embedding, content_hash in zip(
+        contents, sources, embeddings, content_hashes
+    ):
+        vector = encode_vector(embedding)
+        buffer += struct.pack("!h", 6)
+        buffer += _encode_text(str(ULID()))
+        buffer += encoded_bot_id
+        buffer += _encode_text(content)
+        buffer += _encode_text(source)
+        buffer += struct.pack("!i", len(vector)) + vector
+        buffer += _encode_text(content_hash)
+        if len(buffer) >= chunk_bytes:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += _PGCOPY_TRAILER
+    yield bytes(buffer)
+
+
+def _insert_rows(cursor, bot_id, contents, sources, embeddings, content_hashes) -> int:
+    values_to_insert = [
+        (
+            str(ULID()),
+            bot_id,
+            content,
+            source,
+            json.dumps(np.asarray(embedding).tolist()),
+            content_hash,
+        )
+        for source, content, embedding, content_hash in zip(
+            sources, contents, embeddings, content_hashes
+        )
+    ]
+    cursor.executemany(
+        f"INSERT INTO items {_ITEMS_COLUMNS} VALUES (%s, %s, %s, %s, %s, %s)",
+        values_to_insert,
+    )
+    return len(values_to_insert)
+
+
+def _delete_rows(cursor, bot_id: str, sources_to_replace: Sequence[str] | None):
+    if sources_to_replace is None:
+        cursor.execute("DELETE FROM items WHERE botid = %s", (bot_id,))
+        cursor.execute("DELETE FROM item_sources WHERE botid = %s", (bot_id,))
+    elif len(sources_to_replace) > 0:
+        params = (bot_id, list(sources_to_replace))
+        cursor.execute(
+            "DELETE FROM items WHERE botid = %s AND source = ANY(%s)", params
+        )
+        cursor.execute(
+            "DELETE FROM item_sources WHERE botid = %s AND source = ANY(%s)", params
+        )
+
+
+class BotEmbeddingWriter:
+    """Write rows of a bot in batches within a single transaction.
+    Rows of `sources_to_replace` are deleted, or all rows of the bot if it is None.
+    The list may be updated until `commit`, e.g. while sources are still being loaded.
+    Readers keep seeing the previous rows until `commit`.
+    """
+
+    def __init__(
+        self,
+        conn,
+        bot_id: str,
+        sources_to_replace: Sequence[str] | None = None,
+        mode: type_insert_mode = INSERT_MODE,
+        use_staging: bool = USE_STAGING_TABLE,
+    ):
+        self.conn = conn
+        self.bot_id = bot_id
+        self.sources_to_replace = sources_to_replace
+        self.mode = mode
+        self.use_staging = use_staging and mode == "copy"
+        self.count = 0
+        self._table = "items_staging" if self.use_staging else "items"
+        # Sources whose previous rows are deleted, when written directly to `items`
+        self._deleted: set[str] = set()
+        self._cursor = conn.cursor()
+        if self.use_staging:
+            self._cursor.execute(
+                "CREATE TEMP TABLE items_staging (LIKE items) ON COMMIT DROP"
+            )
+        elif sources_to_replace is None:
+            _delete_rows(self._cursor, bot_id, None)
+
+    def _delete_previous_rows(self, sources: Iterable[str]):
+        """Delete the previous rows of the sources, before writing their new rows
+        directly to `items`.
+        """
+        if self.sources_to_replace is None:
+            return
+        sources_to_delete = sorted(set(sources) - self._deleted)
+        _delete_rows(self._cursor, self.bot_id, sources_to_delete)
+        self._deleted.update(sources_to_delete)
+
+    def write(
+        self,
+        contents: Sequence[str],
+        sources: Sequence[str],
+        embeddings: Sequence[Sequence[float]] | np.ndarray,
+        content_hashes: Sequence[str],
+    ) -> int:
+        rows = (self.bot_id, contents, sources, embeddings, content_hashes)
+        if not self.use_staging:
+            self._delete_previous_rows(sources)
+        if self.mode == "insert":
+            count = _insert_rows(self._cursor, *rows)
+        else:
+            self._cursor.execute(
+                f"COPY {self._table} {_ITEMS_COLUMNS} FROM STDIN WITH (FORMAT BINARY)",
+                stream=encode_binary_copy_rows(*rows),
+            )
+            count = self._cursor.rowcount
+        self.count += count
+        return count
+
+    def commit(self, source_fingerprints: dict[str, str] | None = None) -> int:
+        """Make the written rows visible. Returns the total number of written rows."""
+        if self.use_staging:
+            _delete_rows(self._cursor, self.bot_id, self.sources_to_replace)
+            self._cursor.execute(
+                f"INSERT INTO items {_ITEMS_COLUMNS} SELECT {_ITEMS_COLUMNS[1:-1]} FROM items_staging"
+            )
+        else:
+            # e.g. removed sources, which have no new rows
+            self._delete_previous_rows(self.sources_to_replace or [])
+        if source_fingerprints:
+            self._cursor.executemany(
+                "INSERT INTO item_sources (botid, source, fingerprint) VALUES (%s, %s, %s)",
+                [
+                    (self.bot_id, source, fingerprint)
+                    for source, fingerprint in source_fingerprints.items()
+                ],
+            )
+        self._cursor.close()
+        self.conn.commit()
+        logger.info(f"Successfully inserted {self.count} records.")
+        return self.count
+
+    def rollback(self):
+        self._cursor.close()
+        self.conn.rollback()
+
+
+def spool_rows(
+    spool: IO[bytes],
+    contents: Sequence[str],
+    sources: Sequence[str],
+    embeddings: Sequence[Sequence[float]] | np.ndarray,
+    content_hashes: Sequence[str],
+):
+    """Append a batch of rows to the file, so that they can be written again by
+    `BotEmbeddingWriter` without loading and embedding them again.
+    """
+    pickle.dump((contents, sources, embeddings, content_hashes), spool)
+
+
+def iter_spooled_rows(spool: IO[bytes]) -> Iterator[tuple]:
+    """Yield the batches appended by `spool_rows`, from the beginning."""
+    spool.seek(0)
+    while True:
+        try:
+            yield pickle.load(spool)
+        except EOFError:
+            return
+
+
+def replace_bot_embeddings(
+    conn,
+    bot_id: str,
+    contents: Sequence[str],
+    sources: Sequence[str],
+    embeddings: Sequence[Sequence[float]] | np.ndarray,
+    content_hashes: Sequence[str],
+    source_fingerprints: dict[str, str] | None = None,
+    sources_to_replace: Sequence[str] | None = None,
+    mode: type_insert_mode = INSERT_MODE,
+    use_staging: bool = USE_STAGING_TABLE,
+) -> int:
+    """Replace rows of the bot with the given rows in a single transaction.
+    See `BotEmbeddingWriter`. Returns the number of inserted rows.
+    """
+    try:
+        writer = BotEmbeddingWriter(
+            conn, bot_id, sources_to_replace, mode=mode, use_staging=use_staging
+        )
+        writer.write(contents, sources, embeddings, content_hashes)
+        return writer.commit(source_fingerprints)
+    except Exception as e:
+        conn.rollback()
+        raise e
@@ -1,6 +1,9 @@
 import logging
+from typing import Iterable, Iterator
 
+import numpy as np
 from app.bedrock import calculate_document_embeddings
+from embedding.chunking import TextChunker
 from embedding.loaders.base import BaseLoader, Document
 from llama_index.core.node_parser import TextSplitter
 
@@ -8,18 +11,20 @@ logger = logging.getLogger(__name__)
 
 
 class DocumentSplitter:
-    """Thin wrapper for `llama_index.TextSplitter` to split documents."""
+    """Thin wrapper for `TextChunker` or `llama_index.TextSplitter` to split documents."""
 
-    def __init__(self, splitter: TextSplitter):
+    def __init__(self, splitter: TextChunker | TextSplitter):
         self.splitter = splitter
 
-    def split_documents(self, documents: list[Document]) -> list[Document]:
-        res = []
+    def iter_split_documents(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Split documents lazily, e.g. as they are streamed by `BaseLoader.lazy_load`."""
         for document in documents:
             splitted_content = self.splitter.split_text(document.page_content)
             for content in splitted_content:
-                res.append(Document(page_content=content, metadata=document.metadata))
-        return res
+                yield Document(page_content=content, metadata=document.metadata)
+
+    def split_documents(self, documents: Iterable[Document]) -> list[Document]:
+        return list(self.iter_split_documents(documents))
 
 
 class Embedder:
@@ -34,11 +39,12 @@ class Embedder:
             logger.info(f"{i}th document content length: {len(d.page_content)}")
             logger.info(f"{i}th document head of content: {d.page_content[:30]}")
 
-    def embed_documents(self, documents: list[Document]) -> list[list[float]]:
+    def embed_documents(self, documents: list[Document]) -> np.ndarray:
+        """Returns a contiguous float32 matrix of shape (len(documents), dimension)."""
         if self.verbose:
             logger.info(f"Embedding {len(documents)} documents.")
             self.print_documents_summary(documents)
         embeddings = calculate_document_embeddings([d.page_content for d in documents])
         if self.verbose:
             logger.info("Done embedding.")
-        return embeddings
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
@@ -2,14 +2,22 @@ import sys
 
 sys.path.append(".")
 
+import io
+import json
 import unittest
 from pprint import pprint
+from unittest.mock import patch
 
 from app.bedrock import (
+    EMBEDDING_MAX_TEXTS_PER_REQUEST,
+    calculate_document_embeddings,
+    calculate_embedding_price,
+    calculate_price,
     calculate_query_embedding,
     call_converse_api,
     compose_args_for_converse_api,
 )
+from botocore.exceptions import ClientError
 from app.repositories.models.conversation import ContentModel, MessageModel
 from app.routes.schemas.conversation import type_model_name
 
@@ -26,6 +34,39 @@ class TestBedrockEmbedding(unittest.TestCase):
         self.assertEqual(type(embeddings[0]), float)
 
 
+class FakeEmbeddingClient:
+    """Returns `[len(text)]` as embedding and throttles the first request."""
+
+    def __init__(self):
+        self.batch_sizes: list[int] = []
+        self.throttled = False
+
+    def invoke_model(self, body, **kwargs):
+        if not self.throttled:
+            self.throttled = True
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": ""}}, "InvokeModel"
+            )
+        texts = json.loads(body)["texts"]
+        self.batch_sizes.append(len(texts))
+        embeddings = [[float(len(t))] for t in texts]
+        return {"body": io.BytesIO(json.dumps({"embeddings": embeddings}).encode())}
+
+
+class TestCalculateDocumentEmbeddings(unittest.TestCase):
+    def test_batches_keep_order(self):
+        documents = ["x" * (i % 50 + 1) for i in range(250)]
+        fake_client = FakeEmbeddingClient()
+        with patch("app.bedrock.client", fake_client), patch(
+            "app.bedrock.EMBEDDING_RETRY_BASE_DELAY_SEC", 0
+        ):
+            embeddings = calculate_document_embeddings(documents, max_concurrency=4)
+
+        self.assertEqual(embeddings, [[float(len(d))] for d in documents])
+        self.assertEqual(sum(fake_client.batch_sizes), len(documents))
+        self.assertEqual(max(fake_client.batch_sizes), EMBEDDING_MAX_TEXTS_PER_REQUEST)
+
+
 class TestCallConverseApi(unittest.TestCase):
     def test_call_converse_api(self):
         message = MessageModel(
@@ -58,5 +99,21 @@ class TestCallConverseApi(unittest.TestCase):
         pprint(response)
 
 
+class TestCalculatePrice(unittest.TestCase):
+    def test_price_by_serving_region(self):
+        self.assertAlmostEqual(
+            calculate_price("claude-v3-opus", 1000, 1000, region="us-west-2"), 0.09
+        )
+        self.assertAlmostEqual(
+            calculate_price("claude-v2", 1000, 1000, region="ap-northeast-1"),
+            0.0032,
+        )
+
+    def test_embedding_price(self):
+        # 4,000 characters are estimated as 1,000 tokens
+        self.assertAlmostEqual(calculate_embedding_price("a" * 4000), 0.0001)
+        self.assertGreater(calculate_embedding_price("a"), 0.0)
+
+
 if __name__ == "__main__":
     unittest.main()
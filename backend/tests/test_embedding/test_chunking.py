@@ -0,0 +1,76 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from embedding.chunking import ChunkSizeHistogram, TextChunker
+
+
+class TestTextChunker(unittest.TestCase):
+    def test_short_text(self):
+        chunker = TextChunker(chunk_size=100, chunk_overlap=20)
+        self.assertEqual(chunker.split_text("  Hello, world.  "), ["Hello, world."])
+        self.assertEqual(chunker.split_text("   "), [])
+
+    def test_chunks_fit_chunk_size(self):
+        chunker = TextChunker(chunk_size=200, chunk_overlap=50)
+        text = "\n\n".join(
+            " ".join(f"Sentence {i} of paragraph {p}." for i in range(20))
+            for p in range(10)
+        )
+        chunks = chunker.split_text(text)
+        self.assertGreater(len(chunks), 1)
+        self.assertTrue(all(len(c) <= 200 for c in chunks))
+        # Every sentence is kept
+        for p in range(10):
+            for i in range(20):
+                sentence = f"Sentence {i} of paragraph {p}."
+                self.assertTrue(any(sentence in c for c in chunks), sentence)
+
+    def test_overlap(self):
+        chunker = TextChunker(chunk_size=100, chunk_overlap=30)
+        text = " ".join(f"w{i:03d}" for i in range(200))
+        chunks = chunker.split_text(text)
+        for previous, current in zip(chunks, chunks[1:]):
+            head = current.split(" ")[0]
+            self.assertIn(head, previous)
+            # Each chunk adds new text
+            self.assertNotEqual(current.split(" ")[-1], previous.split(" ")[-1])
+
+    def test_text_without_separators(self):
+        chunker = TextChunker(chunk_size=100, chunk_overlap=20)
+        chunks = chunker.split_text("x" * 250)
+        self.assertEqual([len(c) for c in chunks], [100, 100, 50])
+
+    def test_chunk_size_is_capped_by_model_limit(self):
+        chunker = TextChunker(chunk_size=5000, chunk_overlap=200, max_length=2048)
+        self.assertEqual(chunker.chunk_size, 2048)
+        chunks = chunker.split_text("word " * 3000)
+        self.assertTrue(all(len(c) <= 2048 for c in chunks))
+
+    def test_length_function(self):
+        # Count words as tokens
+        chunker = TextChunker(
+            chunk_size=10, chunk_overlap=0, length_function=lambda t: len(t.split())
+        )
+        chunks = chunker.split_text(" ".join(str(i) for i in range(35)))
+        self.assertEqual([len(c.split()) for c in chunks], [10, 10, 10, 5])
+
+    def test_invalid_overlap(self):
+        with self.assertRaises(ValueError):
+            TextChunker(chunk_size=100, chunk_overlap=100)
+
+
+class TestChunkSizeHistogram(unittest.TestCase):
+    def test_add(self):
+        histogram = ChunkSizeHistogram(max_length=1024, bin_width=256)
+        histogram.add([0, 255, 256, 1024])
+        histogram.add([2000])
+        self.assertEqual(histogram.counts.tolist(), [2, 1, 0, 2])
+        self.assertEqual(histogram.total, 5)
+        self.assertEqual(histogram.num_over_limit, 1)
+        self.assertIn("5 chunks", histogram.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
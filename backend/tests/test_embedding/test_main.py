@@ -0,0 +1,61 @@
+import sys
+import unittest
+from unittest.mock import MagicMock, patch
+
+sys.path.append(".")
+
+from botocore.exceptions import ClientError
+from embedding import main
+from embedding.loaders import url as url_loader
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "S3")
+
+
+class TestMain(unittest.TestCase):
+    def setUp(self):
+        self.s3 = MagicMock()
+        self.s3.get_object.side_effect = _client_error("NoSuchKey")
+        self.update_sync_status = MagicMock()
+        self.ensure_bot_index = MagicMock()
+        self.patches = [
+            patch.object(url_loader.boto3, "client", return_value=self.s3),
+            patch.object(main, "get_exec_id", return_value="exec"),
+            patch.object(main, "update_sync_status", self.update_sync_status),
+            patch.object(main, "connect_to_postgres"),
+            patch.object(main, "ensure_schema"),
+            patch.object(main, "get_source_fingerprints", return_value={}),
+            patch.object(main, "iter_url_chunks", return_value=[]),
+            patch.object(main.multiprocessing, "Pool"),
+            patch.object(main, "embed_and_write", return_value=1),
+            patch.object(main, "ensure_bot_index", self.ensure_bot_index),
+        ]
+        for p in self.patches:
+            p.start()
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+
+    def test_cache_not_saved(self):
+        self.s3.put_object.side_effect = _client_error("AccessDenied")
+        main.main(
+            "user",
+            "bot",
+            sitemap_urls=[],
+            source_urls=["https://example.com/"],
+            filenames=[],
+            chunk_size=1000,
+            chunk_overlap=200,
+            enable_partition_pdf=False,
+        )
+
+        self.s3.put_object.assert_called_once()
+        # Synced even though the cache is not saved
+        self.ensure_bot_index.assert_called_once()
+        self.assertEqual(self.update_sync_status.call_args.args[2], "SUCCEEDED")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import io
+import os
+import sys
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+sys.path.append(".")
+
+import boto3
+from embedding.loaders import pdf
+from embedding.loaders.pdf import (
+    PdfPartitionCache,
+    _compose_ranges,
+    iter_partition_pdf_parallel,
+    partition_pdf_parallel,
+)
+from moto import mock_aws
+from pypdf import PdfWriter
+
+BUCKET = "test-bucket"
+PREFIX = "user/bot/_cache/pdf_partition"
+
+
+def _make_pdf(num_pages: int) -> io.BytesIO:
+    writer = PdfWriter()
+    for _ in range(num_pages):
+        writer.add_blank_page(width=72, height=72)
+    file = io.BytesIO()
+    writer.write(file)
+    file.seek(0)
+    return file
+
+
+def _fake_partition_shard(shard: bytes, starting_page_number: int) -> list[dict]:
+    from pypdf import PdfReader
+
+    num_pages = len(PdfReader(io.BytesIO(shard)).pages)
+    return [
+        {
+            "type": "NarrativeText",
+            "element_id": f"{page_number}-{i}",
+            "text": f"page {page_number} element {i}",
+            "metadata": {"page_number": page_number},
+        }
+        for page_number in range(starting_page_number, starting_page_number + num_pages)
+        for i in range(2)
+    ]
+
+
+class TestComposeRanges(unittest.TestCase):
+    def test_consecutive_pages(self):
+        self.assertEqual(
+            _compose_ranges([1, 2, 3, 4, 5, 6, 7], 3), [[1, 2, 3], [4, 5, 6], [7]]
+        )
+
+    def test_gaps(self):
+        self.assertEqual(_compose_ranges([1, 2, 5, 6, 9], 4), [[1, 2], [5, 6], [9]])
+
+    def test_empty(self):
+        self.assertEqual(_compose_ranges([], 4), [])
+
+
+@mock_aws
+class TestPartitionPdfParallel(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        boto3.client("s3").create_bucket(Bucket=BUCKET)
+        self.executor = ThreadPoolExecutor(max_workers=4)
+
+    def tearDown(self):
+        self.executor.shutdown()
+
+    def _partition(self, file, cache=None) -> list:
+        with mock.patch.object(
+            pdf, "_partition_shard", side_effect=_fake_partition_shard
+        ) as partition_shard:
+            elements = partition_pdf_parallel(
+                file, "hash", cache, pages_per_shard=3, executor=self.executor
+            )
+        return elements, partition_shard
+
+    def test_merges_pages_in_order(self):
+        elements, partition_shard = self._partition(_make_pdf(7))
+        self.assertEqual(partition_shard.call_count, 3)
+        self.assertEqual(
+            [str(e) for e in elements],
+            [f"page {p} element {i}" for p in range(1, 8) for i in range(2)],
+        )
+
+    def test_cached_pages_are_not_partitioned(self):
+        cache = PdfPartitionCache(BUCKET, PREFIX)
+        self._partition(_make_pdf(5), cache)
+
+        elements, partition_shard = self._partition(_make_pdf(5), cache)
+        partition_shard.assert_not_called()
+        self.assertEqual(len(elements), 10)
+
+    def test_partitions_only_missing_pages(self):
+        cache = PdfPartitionCache(BUCKET, PREFIX)
+        cache.put("hash", 1, [])
+        cache.put("hash", 2, [])
+
+        elements, partition_shard = self._partition(_make_pdf(4), cache)
+        partition_shard.assert_called_once()
+        self.assertEqual(partition_shard.call_args.args[1], 3)
+        self.assertEqual(
+            [str(e) for e in elements],
+            [f"page {p} element {i}" for p in (3, 4) for i in range(2)],
+        )
+        self.assertEqual(cache.get("hash", 4)[0]["text"], "page 4 element 0")
+
+    def test_yields_pages_as_shards_complete(self):
+        later_shards = threading.Event()
+
+        def partition_shard(shard: bytes, starting_page_number: int) -> list[dict]:
+            if starting_page_number > 1:
+                later_shards.wait(timeout=5)
+            return _fake_partition_shard(shard, starting_page_number)
+
+        with mock.patch.object(pdf, "_partition_shard", side_effect=partition_shard):
+            elements = iter_partition_pdf_parallel(
+                _make_pdf(6), "hash", pages_per_shard=3, executor=self.executor
+            )
+            # The first shard is yielded while the others are still partitioned
+            first = [str(next(elements)) for _ in range(6)]
+            self.assertFalse(later_shards.is_set())
+            later_shards.set()
+            rest = [str(e) for e in elements]
+
+        self.assertEqual(
+            first + rest,
+            [f"page {p} element {i}" for p in range(1, 7) for i in range(2)],
+        )
+
+    def test_get_many(self):
+        cache = PdfPartitionCache(BUCKET, PREFIX, max_concurrency=4)
+        for page_number in (1, 3, 4):
+            cache.put("hash", page_number, [{"text": str(page_number)}])
+
+        cached = cache.get_many("hash", [1, 2, 3, 4, 5])
+        self.assertEqual(sorted(cached), [1, 3, 4])
+        self.assertEqual(cached[3], [{"text": "3"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import sys
+import threading
+import time
+import unittest
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(".")
+
+from embedding.pipeline import Pipeline, bounded_imap
+
+
+class TestPipeline(unittest.TestCase):
+    def test_run_stages_in_order(self):
+        results = []
+        Pipeline([lambda x: x * 2, results.append]).run(range(10))
+        self.assertEqual(results, [x * 2 for x in range(10)])
+
+    def test_back_pressure(self):
+        produced = 0
+        release = threading.Event()
+
+        def source():
+            nonlocal produced
+            for i in range(100):
+                produced += 1
+                yield i
+
+        def slow_sink(x):
+            release.wait()
+
+        thread = threading.Thread(
+            target=Pipeline([lambda x: x, slow_sink], queue_size=2).run,
+            args=(source(),),
+        )
+        thread.start()
+        time.sleep(0.5)
+        # 2 queues of size 2, plus one item held by each stage and the source
+        self.assertLessEqual(produced, 8)
+        release.set()
+        thread.join()
+        self.assertEqual(produced, 100)
+
+    def test_error_is_propagated(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError("failed")
+            return x
+
+        written = []
+        with self.assertRaises(ValueError):
+            Pipeline([fail, written.append], queue_size=1).run(range(1000))
+        self.assertLess(len(written), 1000)
+
+    def test_source_error_is_propagated(self):
+        def source():
+            yield 1
+            raise RuntimeError("source failed")
+
+        with self.assertRaises(RuntimeError):
+            Pipeline([lambda x: x]).run(source())
+
+
+class TestBoundedImap(unittest.TestCase):
+    def test_order_and_pending(self):
+        submitted = 0
+
+        def args_list():
+            nonlocal submitted
+            for i in range(20):
+                submitted += 1
+                yield (i,)
+
+        with ThreadPool(4) as pool:
+            results = bounded_imap(pool, lambda x: x * x, args_list(), max_pending=3)
+            self.assertEqual(next(results), 0)
+            self.assertLessEqual(submitted, 3)
+            self.assertEqual(list(results), [x * x for x in range(1, 20)])
+
+
+if __name__ == "__main__":
+    unittest.main()
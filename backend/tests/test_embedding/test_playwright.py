@@ -0,0 +1,117 @@
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(".")
+
+from embedding.loaders.playwright import (
+    DelayUnstructuredHtmlEvaluator,
+    PlaywrightURLLoader,
+)
+
+PAGE = """<html><body>
+<img src="/image.png">
+<p>Content of {path}</p>
+</body></html>"""
+
+RENDERED_BY_JS = """<html><body>
+<div id="root"></div>
+<script>
+setTimeout(() => {
+  document.getElementById("root").innerHTML = '<p id="ready">Rendered by JavaScript</p>';
+}, 300);
+</script>
+</body></html>"""
+
+
+class _Handler(BaseHTTPRequestHandler):
+    requested_paths: list[str] = []
+
+    def do_GET(self):
+        _Handler.requested_paths.append(self.path)
+        if self.path == "/image.png":
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.end_headers()
+            return
+        body = (
+            RENDERED_BY_JS if self.path == "/js" else PAGE.format(path=self.path)
+        ).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestPlaywrightURLLoader(unittest.TestCase):
+    """Requires Playwright and Chromium. Run inside the embedding container:
+
+    ```
+    cd backend
+    docker build -f embedding/Dockerfile -t embedding .
+    docker run -it -v $(pwd)/tests:/src/tests embedding /src/tests/test_embedding/test_playwright.py
+    ```
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        _Handler.requested_paths.clear()
+
+    def test_load_concurrently(self):
+        urls = [f"{self.base_url}/page{i}" for i in range(12)]
+        loader = PlaywrightURLLoader(
+            urls, max_concurrency=4, max_concurrency_per_host=3, pages_per_context=2
+        )
+        documents = loader.load()
+
+        self.assertEqual([d.metadata["source"] for d in documents], urls)
+        for i, document in enumerate(documents):
+            self.assertIn(f"Content of /page{i}", document.page_content)
+        # Images are blocked
+        self.assertNotIn("/image.png", _Handler.requested_paths)
+
+    def test_load_lazy_urls(self):
+        urls = [f"{self.base_url}/lazy{i}" for i in range(6)]
+
+        def iter_urls():
+            for url in urls:
+                # e.g. fed by another thread while classifying
+                time.sleep(0.05)
+                yield url
+
+        documents = PlaywrightURLLoader(iter_urls(), max_concurrency=2).load()
+        self.assertEqual([d.metadata["source"] for d in documents], urls)
+
+    def test_wait_for_selector(self):
+        loader = PlaywrightURLLoader(
+            [f"{self.base_url}/js"],
+            evaluator=DelayUnstructuredHtmlEvaluator(
+                delay_sec=5, ready_selector="#ready"
+            ),
+        )
+        documents = loader.load()
+        self.assertIn("Rendered by JavaScript", documents[0].page_content)
+
+    def test_continue_on_failure(self):
+        urls = ["http://127.0.0.1:1/unreachable", f"{self.base_url}/page"]
+        documents = PlaywrightURLLoader(urls).load()
+        self.assertEqual([d.metadata["source"] for d in documents], urls[1:])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.append(".")
+
+import boto3
+from embedding.loaders import s3 as s3_loader
+from embedding.loaders.s3 import S3FileLoader, open_s3_object
+from moto import mock_aws
+
+BUCKET = "test-bucket"
+KEY = "user/bot/documents/data.bin"
+
+
+class _Metadata:
+    def __init__(self, page_number: int):
+        self.page_number = page_number
+
+    def to_dict(self) -> dict:
+        return {"page_number": self.page_number}
+
+
+class _Element:
+    def __init__(self, text: str, page_number: int | None = None):
+        self.text = text
+        if page_number is not None:
+            self.metadata = _Metadata(page_number)
+
+    def __str__(self):
+        return self.text
+
+
+@mock_aws
+class TestS3FileLoader(unittest.TestCase):
+    def setUp(self):
+        os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+        self.client = boto3.client("s3")
+        self.client.create_bucket(Bucket=BUCKET)
+        self.data = bytes(range(256)) * 1000
+        self.client.put_object(Bucket=BUCKET, Key=KEY, Body=self.data)
+
+    def test_open_s3_object(self):
+        requests = []
+        self.client.meta.events.register(
+            "before-call.s3.GetObject", lambda **kwargs: requests.append(kwargs)
+        )
+        with open_s3_object(BUCKET, KEY, self.client) as file:
+            self.assertEqual(file.read(10), self.data[:10])
+            file.seek(-5, io.SEEK_END)
+            self.assertEqual(file.read(), self.data[-5:])
+            file.seek(1000)
+            self.assertEqual(file.read(3), self.data[1000:1003])
+        # Fetched once, however it is read
+        self.assertEqual(len(requests), 1)
+
+    def test_lazy_load_paged(self):
+        loader = S3FileLoader(BUCKET, KEY, mode="paged")
+        elements = [_Element("a", 1), _Element("b", 2), _Element("c", 1)]
+        loader._get_elements = lambda: elements  # type: ignore
+        documents = list(loader.lazy_load())
+        # Elements of the same page are grouped, even if not consecutive
+        self.assertEqual([d.page_content for d in documents], ["a\n\nc\n\n", "b\n\n"])
+        self.assertEqual([d.metadata["page_number"] for d in documents], [1, 2])
+
+    def test_lazy_load_single(self):
+        loader = S3FileLoader(BUCKET, KEY)
+        elements = [_Element("a" * 60), _Element("b" * 60), _Element("c" * 10)]
+        original = s3_loader.STREAM_DOCUMENT_MAX_CHARS
+        s3_loader.STREAM_DOCUMENT_MAX_CHARS = 100
+        loader._get_elements = lambda: elements  # type: ignore
+        try:
+            documents = list(loader.lazy_load())
+        finally:
+            s3_loader.STREAM_DOCUMENT_MAX_CHARS = original
+        self.assertEqual(
+            [d.page_content for d in documents],
+            ["a" * 60, "b" * 60 + "\n\n" + "c" * 10],
+        )
+        self.assertEqual(documents[0].metadata["source"], f"s3://{BUCKET}/{KEY}")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import gzip
+import io
+import sys
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(".")
+
+from embedding.loaders.sitemap import SitemapEntry, SitemapLoader, parse_sitemap
+
+NAMESPACE = 'xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"'
+
+
+def _urlset(entries: list[tuple[str, str | None]]) -> bytes:
+    urls = "".join(
+        f"<url><loc>{loc}</loc>"
+        + (f"<lastmod>{lastmod}</lastmod>" if lastmod else "")
+        + "</url>"
+        for loc, lastmod in entries
+    )
+    return f'<?xml version="1.0"?><urlset {NAMESPACE}>{urls}</urlset>'.encode()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    documents: dict[str, bytes] = {}
+
+    def do_GET(self):
+        body = _Handler.documents.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestParseSitemap(unittest.TestCase):
+    def test_parse(self):
+        stream = io.BytesIO(
+            _urlset([("https://a/1", "2024-01-01"), ("https://a/2", None)])
+        )
+        self.assertEqual(
+            list(parse_sitemap(stream)),
+            [
+                ("url", SitemapEntry("https://a/1", "2024-01-01")),
+                ("url", SitemapEntry("https://a/2", None)),
+            ],
+        )
+
+
+class TestSitemapLoader(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        cls.base_url = base_url
+        _Handler.documents = {
+            "/sitemap_index.xml": (
+                f'<?xml version="1.0"?><sitemapindex {NAMESPACE}>'
+                f"<sitemap><loc>{base_url}/sitemap1.xml</loc></sitemap>"
+                f"<sitemap><loc>{base_url}/sitemap2.xml.gz</loc></sitemap>"
+                f"<sitemap><loc>{base_url}/missing.xml</loc></sitemap>"
+                f"<sitemap><loc>{base_url}/sitemap_index.xml</loc></sitemap>"
+                "</sitemapindex>"
+            ).encode(),
+            "/sitemap1.xml": _urlset(
+                [("https://a/1", "2024-01-01"), ("https://a/2", None)]
+            ),
+            "/sitemap2.xml.gz": gzip.compress(
+                _urlset([("https://a/2", None), ("https://a/3", "2024-02-01")])
+            ),
+        }
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def test_follow_index_and_deduplicate(self):
+        loader = SitemapLoader(
+            [f"{self.base_url}/sitemap_index.xml"], exclude=["https://a/1"]
+        )
+        self.assertEqual(
+            list(loader.iter_entries()),
+            [SitemapEntry("https://a/2"), SitemapEntry("https://a/3", "2024-02-01")],
+        )
+
+    def test_max_pages(self):
+        loader = SitemapLoader([f"{self.base_url}/sitemap_index.xml"], max_pages=2)
+        self.assertEqual(len(list(loader.iter_entries())), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from embedding.loaders.base import Document
+from embedding.sync import SyncPlan, compose_params_digest, get_documents_fingerprints
+
+
+class TestSyncPlan(unittest.TestCase):
+    def setUp(self):
+        self.digest = compose_params_digest("model", 1000, 200, False)
+        self.previous = get_documents_fingerprints(
+            [
+                Document(page_content="a", metadata={"source": "s1"}),
+                Document(page_content="b", metadata={"source": "s2"}),
+                Document(page_content="c", metadata={"source": "s3"}),
+            ],
+            self.digest,
+        )
+
+    def test_incremental(self):
+        current = get_documents_fingerprints(
+            [
+                Document(page_content="a", metadata={"source": "s1"}),
+                Document(page_content="b2", metadata={"source": "s2"}),
+                Document(page_content="d", metadata={"source": "s4"}),
+            ],
+            self.digest,
+        )
+        plan = SyncPlan()
+        for source, fingerprint in current.items():
+            plan.add(source, fingerprint, self.previous)
+        plan.finalize(self.previous)
+
+        self.assertEqual(plan.unchanged, {"s1"})
+        self.assertEqual(set(plan.changed), {"s2", "s4"})
+        self.assertEqual(plan.removed, {"s3"})
+        self.assertEqual(plan.sources_to_replace, ["s2", "s3", "s4"])
+        self.assertTrue(plan.has_changes)
+
+    def test_no_changes(self):
+        plan = SyncPlan()
+        for source, fingerprint in self.previous.items():
+            plan.add(source, fingerprint, self.previous)
+        plan.finalize(self.previous)
+        self.assertFalse(plan.has_changes)
+
+    def test_params_changed(self):
+        digest = compose_params_digest("model", 500, 200, False)
+        current = get_documents_fingerprints(
+            [Document(page_content="a", metadata={"source": "s1"})], digest
+        )
+        self.assertNotEqual(current["s1"], self.previous["s1"])
+
+    def test_full_rebuild(self):
+        plan = SyncPlan(full_rebuild=True)
+        plan.add("s1", self.previous["s1"], self.previous)
+        plan.finalize(self.previous)
+        self.assertEqual(set(plan.changed), {"s1"})
+        self.assertIsNone(plan.sources_to_replace)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,167 @@
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from embedding.loaders.base import BaseLoader, Document
+from embedding.loaders.url import (
+    AdaptiveTimeout,
+    ContentTypeCache,
+    ContentTypeProber,
+    UrlLoader,
+    group_urls_by_content_type,
+)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests: list[tuple[str, str | None]] = []
+    connections: set[int] = set()
+
+    def do_HEAD(self):
+        _Handler.requests.append((self.path, self.headers.get("If-None-Match")))
+        _Handler.connections.add(id(self.connection))
+        if self.path.startswith("/redirect"):
+            self.send_response(302)
+            self.send_header("Location", "/page.pdf")
+        elif self.path.startswith("/missing"):
+            self.send_response(404)
+        elif self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+        elif self.path.endswith(".pdf"):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/pdf")
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestContentTypeProber(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+
+    def setUp(self):
+        _Handler.requests.clear()
+        _Handler.connections.clear()
+
+    def test_group_urls(self):
+        urls = [
+            f"{self.base_url}/index.html",
+            f"{self.base_url}/page.pdf",
+            f"{self.base_url}/redirect",
+            f"{self.base_url}/missing",
+            "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        ]
+        grouped = group_urls_by_content_type(urls)
+        self.assertEqual(grouped["web"], [urls[0]])
+        self.assertCountEqual(grouped["unstructured"], urls[1:4])
+        self.assertEqual(grouped["youtube"], [urls[4]])
+
+    def test_reuse_connection(self):
+        prober = ContentTypeProber(max_concurrency=1)
+        urls = [f"{self.base_url}/page{i}.html" for i in range(10)]
+        results = dict(prober.iter_content_types(urls))
+        self.assertEqual(set(results.values()), {"web"})
+        self.assertEqual(len(_Handler.connections), 1)
+
+    def test_cache(self):
+        url = f"{self.base_url}/index.html"
+        cache = ContentTypeCache()
+        self.assertEqual(
+            dict(ContentTypeProber(cache).iter_content_types([url]))[url], "web"
+        )
+        self.assertEqual(cache.get(url)["etag"], '"v1"')
+
+        # Fresh entries are used without requests
+        self.assertEqual(
+            dict(ContentTypeProber(cache).iter_content_types([url]))[url], "web"
+        )
+        self.assertEqual(len(_Handler.requests), 1)
+
+        # Stale entries are revalidated with the ETag
+        cache.entries[url]["checked_at"] = time.time() - cache.ttl_sec - 1
+        self.assertEqual(
+            dict(ContentTypeProber(cache).iter_content_types([url]))[url], "web"
+        )
+        self.assertEqual(_Handler.requests[-1], ("/index.html", '"v1"'))
+        self.assertTrue(cache.is_fresh(cache.get(url)))
+
+
+class FakeLoader(BaseLoader):
+    instances: list["FakeLoader"] = []
+
+    def __init__(self, loader_type: str, urls):
+        self.loader_type = loader_type
+        self.urls = urls
+        FakeLoader.instances.append(self)
+
+    def load(self) -> list[Document]:
+        return list(self.lazy_load())
+
+    def lazy_load(self):
+        for url in self.urls:
+            yield Document(page_content=url, metadata={"source": url})
+
+
+class TestUrlLoader(unittest.TestCase):
+    def setUp(self):
+        FakeLoader.instances.clear()
+
+    def _content_types(self, urls):
+        for url in urls:
+            yield url, "web" if url.endswith(".html") else "unstructured"
+
+    def test_lazy_load(self):
+        urls = [f"https://example.com/{i}.html" for i in range(40)] + [
+            f"https://example.com/{i}.pdf" for i in range(40)
+        ]
+        with patch(
+            "embedding.loaders.url.get_loader",
+            side_effect=lambda t, urls, cache=None: FakeLoader(t, urls),
+        ), patch.object(
+            ContentTypeProber, "iter_content_types", side_effect=self._content_types
+        ):
+            documents = UrlLoader(iter(urls)).lazy_load()
+            first = next(documents)
+            self.assertIn(first.metadata["source"], urls)
+            sources = [first.metadata["source"]] + [
+                d.metadata["source"] for d in documents
+            ]
+
+        self.assertCountEqual(sources, urls)
+        # A single loader for all web pages, and batches for the others
+        loader_types = [loader.loader_type for loader in FakeLoader.instances]
+        self.assertEqual(loader_types.count("web"), 1)
+        self.assertEqual(loader_types.count("unstructured"), 3)
+
+
+class TestAdaptiveTimeout(unittest.TestCase):
+    def test_follow_latency(self):
+        timeout = AdaptiveTimeout(initial_sec=10, min_sec=2, max_sec=30, factor=4)
+        self.assertEqual(timeout.get(), 10)
+        timeout.observe(0.01)
+        self.assertEqual(timeout.get(), 2)
+        for _ in range(50):
+            timeout.observe(20)
+        self.assertEqual(timeout.get(), 30)
+
+
+if __name__ == "__main__":
+    unittest.main()
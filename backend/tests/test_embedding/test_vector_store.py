@@ -0,0 +1,66 @@
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.append(".")
+
+import numpy as np
+from embedding.vector_store import (
+    encode_binary_copy_rows,
+    encode_vector,
+    iter_spooled_rows,
+    spool_rows,
+)
+
+
+class TestEncodeBinaryCopyRows(unittest.TestCase):
+    def test_encode_vector(self):
+        data = encode_vector([1.0, -0.5])
+        self.assertEqual(data, struct.pack("!HHff", 2, 0, 1.0, -0.5))
+
+    def test_rows(self):
+        embeddings = np.array([[0.1, 0.2], [0.3, 0.4]], dtype=np.float32)
+        chunks = list(
+            encode_binary_copy_rows(
+                "bot",
+                ["a", "b"],
+                ["s1", "s2"],
+                embeddings,
+                ["h1", "h2"],
+                chunk_bytes=1,
+            )
+        )
+        # One chunk per row and the trailer
+        self.assertEqual(len(chunks), 3)
+        data = b"".join(chunks)
+        self.assertTrue(data.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(data.endswith(struct.pack("!h", -1)))
+        self.assertIn(encode_vector(embeddings[1]), data)
+        self.assertEqual(data.count(struct.pack("!i", 3) + b"bot"), 2)
+
+
+class TestSpoolRows(unittest.TestCase):
+    def test_replay(self):
+        batches = [
+            (["a"], ["s1"], np.array([[0.1, 0.2]], dtype=np.float32), ["h1"]),
+            (["b", "c"], ["s2", "s2"], np.ones((2, 2), dtype=np.float32), ["h2", "h3"]),
+        ]
+        with tempfile.TemporaryFile() as spool:
+            for batch in batches:
+                spool_rows(spool, *batch)
+            # Replayable more than once
+            for _ in range(2):
+                replayed = list(iter_spooled_rows(spool))
+                self.assertEqual(len(replayed), 2)
+                for (contents, sources, embeddings, hashes), batch in zip(
+                    replayed, batches
+                ):
+                    self.assertEqual(contents, batch[0])
+                    self.assertEqual(sources, batch[1])
+                    np.testing.assert_array_equal(embeddings, batch[2])
+                    self.assertEqual(hashes, batch[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,150 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.append(".")
+
+from embedding.loaders.youtube import (
+    RateLimiter,
+    TranscriptCache,
+    YoutubeLoader,
+    YoutubeLoaderWithLangDetection,
+)
+from youtube_transcript_api import NoTranscriptFound, TranscriptsDisabled
+
+
+class _Transcript:
+    def __init__(self, video_id: str, language_code: str, api: "_StubTranscriptApi"):
+        self.video_id = video_id
+        self.language_code = language_code
+        self.api = api
+
+    def fetch(self) -> list[dict]:
+        self.api.count("fetch")
+        return [
+            {"text": f" {self.video_id} "},
+            {"text": f"in {self.language_code}"},
+        ]
+
+
+class _TranscriptList:
+    def __init__(self, transcripts: list[_Transcript]):
+        self.transcripts = transcripts
+
+    def __iter__(self):
+        return iter(self.transcripts)
+
+    def find_transcript(self, language_codes):
+        for code in language_codes:
+            for transcript in self.transcripts:
+                if transcript.language_code == code:
+                    return transcript
+        raise NoTranscriptFound(self.transcripts[0].video_id, language_codes, None)
+
+
+class _StubTranscriptApi:
+    def __init__(self, languages: dict[str, list[str]]):
+        self.languages = languages
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def count(self, name: str):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+
+    def list_transcripts(self, video_id: str) -> _TranscriptList:
+        self.count("list_transcripts")
+        if video_id not in self.languages:
+            raise TranscriptsDisabled(video_id)
+        return _TranscriptList(
+            [_Transcript(video_id, code, self) for code in self.languages[video_id]]
+        )
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_spacing(self):
+        limiter = RateLimiter(rate_per_sec=100)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+
+
+class TestYoutubeLoader(unittest.TestCase):
+    def test_load_with_language(self):
+        api = _StubTranscriptApi({"aaaaaaaaaaa": ["ja", "en"]})
+        documents = YoutubeLoader(
+            "aaaaaaaaaaa", language="en", transcript_api=api
+        ).load()
+        self.assertEqual(documents[0].page_content, "aaaaaaaaaaa in en")
+        self.assertEqual(documents[0].metadata, {"source": "aaaaaaaaaaa"})
+
+    def test_transcripts_disabled(self):
+        api = _StubTranscriptApi({})
+        self.assertEqual(YoutubeLoader("aaaaaaaaaaa", transcript_api=api).load(), [])
+
+
+class TestYoutubeLoaderWithLangDetection(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.api = _StubTranscriptApi(
+            {f"video{i:06d}": ["fr", "en"] if i % 2 else ["ja"] for i in range(10)}
+        )
+        self.urls = [f"https://www.youtube.com/watch?v=video{i:06d}" for i in range(10)]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _load(self) -> list:
+        return YoutubeLoaderWithLangDetection(
+            self.urls,
+            cache=TranscriptCache(self.temp_dir.name),
+            max_concurrency=4,
+            requests_per_sec=0,
+            transcript_api=self.api,
+        ).load()
+
+    def test_one_listing_per_video(self):
+        documents = self._load()
+        self.assertEqual(self.api.calls["list_transcripts"], 10)
+        self.assertEqual(self.api.calls["fetch"], 10)
+        # Order of the URLs is kept and the first listed language is used
+        self.assertEqual(
+            [d.page_content for d in documents],
+            [f"video{i:06d} in {'fr' if i % 2 else 'ja'}" for i in range(10)],
+        )
+
+    def test_cache(self):
+        first = self._load()
+        second = self._load()
+        self.assertEqual(self.api.calls["list_transcripts"], 10)
+        self.assertEqual(
+            [d.page_content for d in first], [d.page_content for d in second]
+        )
+
+    def test_cache_ttl(self):
+        self._load()
+        # Entries older than the TTL are fetched again
+        for root, _, files in os.walk(self.temp_dir.name):
+            for file in files:
+                path = os.path.join(root, file)
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                entry["fetched_at"] -= 8 * 24 * 60 * 60
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(entry, f)
+        self._load()
+        self.assertEqual(self.api.calls["list_transcripts"], 20)
+
+    def test_detection_failure(self):
+        self.urls.append("https://www.youtube.com/watch?v=nosubtitles")
+        with self.assertRaises(Exception):
+            self._load()
+
+
+if __name__ == "__main__":
+    unittest.main()
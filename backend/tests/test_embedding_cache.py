@@ -0,0 +1,64 @@
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+import boto3
+from app.embedding_cache import EmbeddingCache, S3EmbeddingStore, compose_cache_key
+from moto import mock_aws
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        cache = EmbeddingCache(max_entries=10, ttl_sec=60)
+        key = compose_cache_key("cohere.embed-multilingual-v3", "hello")
+
+        self.assertIsNone(cache.get(key))
+        cache.put(key, [0.5, -0.25, 1.0])
+        self.assertEqual(cache.get(key), [0.5, -0.25, 1.0])
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_rate"], 0.5)
+
+    def test_key_depends_on_model(self):
+        self.assertNotEqual(
+            compose_cache_key("model-a", "hello"), compose_cache_key("model-b", "hello")
+        )
+
+    def test_lru_eviction(self):
+        cache = EmbeddingCache(max_entries=2, ttl_sec=60)
+        cache.put("a", [1.0])
+        cache.put("b", [2.0])
+        cache.get("a")
+        cache.put("c", [3.0])
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), [1.0])
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl(self):
+        cache = EmbeddingCache(max_entries=10, ttl_sec=60)
+        with patch("app.embedding_cache.time.monotonic", return_value=0):
+            cache.put("a", [1.0])
+        with patch("app.embedding_cache.time.monotonic", return_value=61):
+            self.assertIsNone(cache.get("a"))
+
+    @mock_aws
+    def test_shared_store(self):
+        boto3.client("s3", region_name="us-east-1").create_bucket(Bucket="cache")
+        store = S3EmbeddingStore("cache")
+        EmbeddingCache(shared_store=store).put("a", [0.5, 0.25])
+
+        # Another instance finds the entry in the shared store
+        cache = EmbeddingCache(shared_store=store)
+        self.assertEqual(cache.get("a"), [0.5, 0.25])
+        self.assertEqual(cache.stats()["shared_hits"], 1)
+        self.assertEqual(cache.get("a"), [0.5, 0.25])
+        self.assertEqual(cache.stats()["hits"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app.postgres import ConnectionPool
+
+
+class FakePreparedStatement:
+    def __init__(self, conn, statement):
+        self.conn = conn
+        self.statement = statement
+
+    def run(self, **params):
+        return ((self.statement, params),)
+
+
+class FakeConnection:
+    def __init__(self):
+        self.autocommit = False
+        self.closed = False
+        self.broken = False
+        self.prepared = 0
+        self.runs: list[tuple[str, dict]] = []
+
+    def run(self, sql, **params):
+        if self.broken:
+            raise ConnectionResetError("connection reset")
+        self.runs.append((sql, params))
+        return [[1]]
+
+    def prepare(self, statement):
+        self.prepared += 1
+        return FakePreparedStatement(self, statement)
+
+    def close(self):
+        self.closed = True
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connections: list[FakeConnection] = []
+
+        def connect():
+            conn = FakeConnection()
+            self.connections.append(conn)
+            return conn
+
+        self.pool = ConnectionPool(connect=connect, max_idle=1)
+
+    def test_reuse_connection_and_prepared_statement(self):
+        for _ in range(3):
+            with self.pool.connection() as pooled:
+                rows = pooled.run_prepared("SELECT :x", x=1)
+                self.assertEqual(rows[0][1], {"x": 1})
+
+        self.assertEqual(len(self.connections), 1)
+        self.assertTrue(self.connections[0].autocommit)
+        self.assertEqual(self.connections[0].prepared, 1)
+        stats = self.pool.stats()
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 2)
+        self.assertEqual(stats["prepare_hits"], 2)
+        self.assertEqual(stats["in_use"], 0)
+        self.assertEqual(stats["idle"], 1)
+
+    def test_discard_connection_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.pool.connection():
+                raise ValueError()
+
+        self.assertTrue(self.connections[0].closed)
+        self.assertEqual(self.pool.stats()["idle"], 0)
+
+    def test_validate_idle_connection(self):
+        self.pool.validate_after_idle_sec = 0
+        with self.pool.connection():
+            pass
+        self.connections[0].broken = True
+
+        with self.pool.connection() as pooled:
+            self.assertIs(pooled.conn, self.connections[1])
+
+        stats = self.pool.stats()
+        self.assertEqual(stats["validation_failures"], 1)
+        self.assertTrue(self.connections[0].closed)
+
+    def test_close_connections_over_max_idle(self):
+        with self.pool.connection():
+            with self.pool.connection():
+                pass
+
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(self.pool.stats()["idle"], 1)
+        self.assertTrue(self.connections[0].closed)
+
+    def test_apply_only_changed_settings(self):
+        with self.pool.connection() as pooled:
+            pooled.apply_settings({"hnsw.ef_search": "40", "ivfflat.probes": "10"})
+            pooled.apply_settings({"hnsw.ef_search": "40", "ivfflat.probes": "10"})
+            pooled.apply_settings({"hnsw.ef_search": "100", "ivfflat.probes": "10"})
+
+        runs = self.connections[0].runs
+        self.assertEqual(len(runs), 2)
+        self.assertEqual(
+            runs[0][1],
+            {
+                "name0": "hnsw.ef_search",
+                "value0": "40",
+                "name1": "ivfflat.probes",
+                "value1": "10",
+            },
+        )
+        self.assertEqual(runs[1][1], {"name0": "hnsw.ef_search", "value0": "100"})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+from app.region_router import NoRegionAvailableError, RegionRouter
+from botocore.exceptions import ClientError
+
+
+def _client_error(code: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}}, "Converse")
+
+
+class FakeEventStream:
+    def __init__(self, events: list[dict]):
+        self.events = events
+        self.closed = False
+
+    def __iter__(self):
+        for event in self.events:
+            if self.closed:
+                return
+            yield event
+
+    def close(self):
+        self.closed = True
+
+
+class FakeBedrockClient:
+    """Fake Bedrock runtime client which injects latency and errors."""
+
+    def __init__(self, region: str, latency: float = 0.0, error: str | None = None):
+        self.region = region
+        self.latency = latency
+        self.error = error
+        self.calls = 0
+
+    def converse(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.error:
+            raise _client_error(self.error)
+        return {"output": {"message": {"content": [{"text": self.region}]}}}
+
+    def converse_stream(self, **kwargs):
+        self.calls += 1
+        time.sleep(self.latency)
+        if self.error:
+            raise _client_error(self.error)
+        self.event_stream = FakeEventStream(
+            [
+                {"contentBlockDelta": {"delta": {"text": self.region}}},
+                {"messageStop": {"stopReason": "end_turn"}},
+            ]
+        )
+        return {"stream": self.event_stream}
+
+
+def _text(result: tuple[dict, str]) -> str:
+    response, _ = result
+    return response["output"]["message"]["content"][0]["text"]
+
+
+class TestRegionRouter(unittest.TestCase):
+    def setUp(self) -> None:
+        self.clients = {
+            "us-east-1": FakeBedrockClient("us-east-1"),
+            "us-west-2": FakeBedrockClient("us-west-2"),
+        }
+
+    def _router(
+        self, hedge_after_sec: float = 0, regions: list[str] | None = None
+    ) -> RegionRouter:
+        return RegionRouter(
+            client_factory=lambda region: self.clients[region],
+            regions_resolver=lambda model_name: regions or ["us-east-1", "us-west-2"],
+            hedge_after_sec=hedge_after_sec,
+            max_attempts=3,
+            retry_backoff_sec=0.01,
+        )
+
+    def test_failover_on_throttling(self):
+        self.clients["us-east-1"].error = "ThrottlingException"
+        router = self._router()
+
+        self.assertEqual(_text(router.converse("claude-v3-sonnet")), "us-west-2")
+        self.assertEqual(router.stats()["us-east-1"]["throttle_rate"], 1.0)
+        # Throttled region is deprioritized afterwards
+        self.assertEqual(
+            router.candidates("claude-v3-sonnet"), ["us-west-2", "us-east-1"]
+        )
+
+    def test_non_retryable_error_is_raised(self):
+        self.clients["us-east-1"].error = "ValidationException"
+        router = self._router()
+
+        with self.assertRaises(ClientError):
+            router.converse("claude-v3-sonnet")
+        self.assertEqual(self.clients["us-west-2"].calls, 0)
+
+    def test_all_regions_failed(self):
+        for client in self.clients.values():
+            client.error = "ThrottlingException"
+        router = self._router()
+
+        with self.assertRaises(NoRegionAvailableError):
+            router.converse("claude-v3-sonnet")
+        # Retried by the router, up to the max attempts in total
+        self.assertEqual(sum(c.calls for c in self.clients.values()), 3)
+
+    def test_retry_in_single_region(self):
+        client = self.clients["us-east-1"]
+        client.error = "ThrottlingException"
+        original = client.converse
+
+        def converse(**kwargs):
+            if client.calls == 2:
+                client.error = None
+            return original(**kwargs)
+
+        client.converse = converse
+        router = self._router(regions=["us-east-1"])
+
+        self.assertEqual(_text(router.converse("claude-v3-sonnet")), "us-east-1")
+        self.assertEqual(client.calls, 3)
+
+    def test_serving_region(self):
+        self.clients["us-east-1"].error = "ThrottlingException"
+        router = self._router()
+
+        _, region = router.converse("claude-v3-sonnet")
+        self.assertEqual(region, "us-west-2")
+        _, region = router.converse_stream("claude-v3-sonnet")
+        self.assertEqual(region, "us-west-2")
+
+    def test_prefer_faster_region(self):
+        self.clients["us-east-1"].latency = 0.05
+        router = self._router()
+        router._record_success("us-east-1", 0.05)
+        router._record_success("us-west-2", 0.01)
+
+        self.assertEqual(
+            router.candidates("claude-v3-sonnet"), ["us-west-2", "us-east-1"]
+        )
+
+    def test_circuit_breaker(self):
+        self.clients["us-east-1"].error = "ServiceUnavailableException"
+        router = self._router()
+        for _ in range(5):
+            router.converse("claude-v3-sonnet")
+
+        self.assertTrue(router.stats()["us-east-1"]["circuit_open"])
+        calls = self.clients["us-east-1"].calls
+        router.converse("claude-v3-sonnet")
+        # Open circuit is skipped while another region is healthy
+        self.assertEqual(self.clients["us-east-1"].calls, calls)
+
+    def test_hedged_request(self):
+        self.clients["us-east-1"].latency = 0.5
+        router = self._router(hedge_after_sec=0.05)
+
+        start = time.monotonic()
+        response, region = router.converse("claude-v3-sonnet")
+        self.assertEqual(_text((response, region)), "us-west-2")
+        self.assertEqual(region, "us-west-2")
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_stream_failover_before_first_event(self):
+        self.clients["us-east-1"].error = "ThrottlingException"
+        router = self._router()
+
+        stream, _ = router.converse_stream("claude-v3-sonnet")
+        events = list(stream)
+        self.assertEqual(events[0]["contentBlockDelta"]["delta"]["text"], "us-west-2")
+        self.assertEqual(len(events), 2)
+        self.assertTrue(self.clients["us-west-2"].event_stream.closed)
+
+    def test_stream_closed_when_stopped(self):
+        router = self._router()
+
+        stream, region = router.converse_stream("claude-v3-sonnet")
+        next(stream)
+        event_stream = self.clients[region].event_stream
+        self.assertFalse(event_stream.closed)
+        # e.g. the client has disconnected
+        stream.close()
+        self.assertTrue(event_stream.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
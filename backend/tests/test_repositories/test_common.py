@@ -0,0 +1,109 @@
+import sys
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+sys.path.append(".")
+
+import boto3
+from app.repositories import common
+from app.repositories.common import (
+    _get_table_client,
+    clear_credential_cache,
+    get_credential_cache_stats,
+)
+from moto import mock_aws
+
+TABLE_NAME = "test-table"
+
+
+@mock_aws
+class TestCredentialCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.env = patch.dict(
+            "os.environ",
+            {
+                "AWS_EXECUTION_ENV": "AWS_Lambda_python3.11",
+                "AWS_ACCESS_KEY_ID": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+                "AWS_DEFAULT_REGION": "us-east-1",
+            },
+        )
+        self.env.start()
+        self.patches = [
+            patch.object(common, "TABLE_NAME", TABLE_NAME),
+            patch.object(common, "REGION", "us-east-1"),
+            patch.object(
+                common,
+                "TABLE_ACCESS_ROLE_ARN",
+                "arn:aws:iam::123456789012:role/TableAccessRole",
+            ),
+            patch.object(common, "_sts_client", None),
+        ]
+        for p in self.patches:
+            p.start()
+        clear_credential_cache()
+
+        boto3.client("dynamodb", region_name="us-east-1").create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+
+    def tearDown(self) -> None:
+        clear_credential_cache()
+        for p in self.patches:
+            p.stop()
+        self.env.stop()
+
+    def test_reuse_credentials_per_user(self):
+        with patch.object(
+            common, "_assume_role_resource", wraps=common._assume_role_resource
+        ) as assume:
+            for _ in range(4):
+                table = _get_table_client("user1")
+                table.put_item(Item={"PK": "user1", "SK": "user1#CONV#1"})
+            _get_table_client("user2")
+
+        self.assertEqual(assume.call_count, 2)
+        stats = get_credential_cache_stats()
+        self.assertEqual(stats["misses"], 2)
+        self.assertEqual(stats["hits"], 3)
+        self.assertEqual(stats["size"], 2)
+
+    def test_refresh_before_expiration(self):
+        _get_table_client("user1")
+        # Pretend the credentials are about to expire
+        cached = common._credential_cache._items[("dynamodb", "user1")]
+        cached.expiration = datetime.now(timezone.utc) + timedelta(seconds=10)
+
+        _get_table_client("user1")
+        stats = get_credential_cache_stats()
+        self.assertEqual(stats["refreshes"], 1)
+        self.assertGreater(
+            common._credential_cache._items[("dynamodb", "user1")].expiration,
+            datetime.now(timezone.utc) + timedelta(minutes=10),
+        )
+
+    def test_evict_least_recently_used(self):
+        with patch.object(common._credential_cache, "max_size", 2):
+            _get_table_client("user1")
+            _get_table_client("user2")
+            _get_table_client("user1")
+            _get_table_client("user3")
+
+        stats = get_credential_cache_stats()
+        self.assertEqual(stats["evictions"], 1)
+        self.assertIn(("dynamodb", "user1"), common._credential_cache._items)
+        self.assertNotIn(("dynamodb", "user2"), common._credential_cache._items)
+
+
+if __name__ == "__main__":
+    unittest.main()
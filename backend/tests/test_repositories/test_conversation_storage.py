@@ -0,0 +1,375 @@
+import base64
+import json
+import random
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+import boto3
+from app.repositories import common, content_blob, conversation
+from app.repositories.common import compose_content_blob_ref_id
+from app.repositories.content_blob import (
+    clear_content_blob_cache,
+    compose_content_blob_key,
+    load_content_body,
+    load_content_bytes,
+)
+from app.repositories.conversation import (
+    LazyMessageMap,
+    RecordNotFoundError,
+    delete_conversation_by_id,
+    delete_conversation_by_user_id,
+    find_conversation_by_id,
+    find_conversation_by_user_id,
+    store_conversation,
+    update_feedback,
+)
+from app.repositories.models.conversation import (
+    ContentModel,
+    ConversationModel,
+    FeedbackModel,
+    MessageModel,
+)
+from app.usecases.chat import trace_to_root
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import Binary
+from moto import mock_aws
+
+TABLE_NAME = "test-table"
+BUCKET_NAME = "test-large-message-bucket"
+# Not compressible, so that it exceeds the threshold also when compressed
+LARGE_BODY = "".join(random.Random(0).choices("abcdefghijklmnopqrstuvwxyz", k=2000))
+
+
+def _message(parent: str | None, body: str, children: list[str]) -> MessageModel:
+    return MessageModel(
+        role="user",
+        content=[
+            ContentModel(
+                content_type="text", body=body, media_type=None, file_name=None
+            )
+        ],
+        model="claude-v3-haiku",
+        children=children,
+        parent=parent,
+        create_time=1627984879.9,
+        feedback=None,
+        used_chunks=None,
+        thinking_log=None,
+    )
+
+
+def _conversation() -> ConversationModel:
+    return ConversationModel(
+        id="1",
+        create_time=1627984879.9,
+        title="Test Conversation",
+        total_price=0.5,
+        message_map={
+            "system": _message(None, "", ["a"]),
+            "a": _message("system", "Hello", ["b"]),
+            "b": _message("a", "Hi", []),
+        },
+        last_message_id="b",
+        bot_id=None,
+        should_continue=False,
+    )
+
+
+@mock_aws
+class TestPerMessageStorage(unittest.TestCase):
+    def setUp(self) -> None:
+        self.env = patch.dict(
+            "os.environ",
+            {
+                "AWS_ACCESS_KEY_ID": "testing",
+                "AWS_SECRET_ACCESS_KEY": "testing",
+                "AWS_DEFAULT_REGION": "us-east-1",
+            },
+        )
+        self.env.start()
+        self.s3 = boto3.client("s3", region_name="us-east-1")
+        self.s3.create_bucket(Bucket=BUCKET_NAME)
+        self.patches = [
+            patch.object(common, "TABLE_NAME", TABLE_NAME),
+            patch.object(common, "REGION", "us-east-1"),
+            patch.object(conversation, "LARGE_MESSAGE_BUCKET", BUCKET_NAME),
+            patch.object(conversation, "s3_client", self.s3),
+            patch.object(content_blob, "CONTENT_BLOB_BUCKET", BUCKET_NAME),
+            patch.object(content_blob, "s3_client", self.s3),
+        ]
+        for p in self.patches:
+            p.start()
+
+        boto3.client("dynamodb", region_name="us-east-1").create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[
+                {"AttributeName": "PK", "KeyType": "HASH"},
+                {"AttributeName": "SK", "KeyType": "RANGE"},
+            ],
+            AttributeDefinitions=[
+                {"AttributeName": "PK", "AttributeType": "S"},
+                {"AttributeName": "SK", "AttributeType": "S"},
+            ],
+            GlobalSecondaryIndexes=[
+                {
+                    "IndexName": "SKIndex",
+                    "KeySchema": [{"AttributeName": "SK", "KeyType": "HASH"}],
+                    "Projection": {"ProjectionType": "ALL"},
+                }
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        self.table = boto3.resource("dynamodb", region_name="us-east-1").Table(
+            TABLE_NAME
+        )
+
+    def tearDown(self) -> None:
+        for p in self.patches:
+            p.stop()
+        self.env.stop()
+
+    def _message_items(self) -> list[dict]:
+        return self.table.query(
+            KeyConditionExpression=Key("PK").eq("user")
+            & Key("SK").begins_with("user#CONV_MSG#1#")
+        )["Items"]
+
+    def test_store_only_changed_messages(self):
+        store_conversation("user", _conversation())
+        self.assertEqual(len(self._message_items()), 3)
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["a"].content[0].body, "Hello")
+        self.assertEqual(found.message_map["b"].parent, "a")
+        self.assertEqual(found.total_price, 0.5)
+        # Only conversations are listed
+        self.assertEqual(len(find_conversation_by_user_id("user")), 1)
+
+        # Add a turn
+        found.message_map["b"].children.append("c")
+        found.message_map["c"] = _message("b", "More", [])
+        found.last_message_id = "c"
+        with self.assertLogs("app.repositories.conversation", "INFO") as logs:
+            store_conversation("user", found)
+        # `b` (new child) and `c`
+        self.assertIn("Stored 2 of 4 messages as items", "\n".join(logs.output))
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.last_message_id, "c")
+        self.assertEqual(found.message_map["b"].children, ["c"])
+        self.assertEqual(found.message_map["c"].content[0].body, "More")
+
+    def test_large_message_and_delete(self):
+        conv = _conversation()
+        conv.message_map["b"].content[0].body = LARGE_BODY
+        store_conversation("user", conv, threshold=1000)
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["b"].content[0].body, LARGE_BODY)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 1)
+
+        delete_conversation_by_id("user", "1")
+        with self.assertRaises(RecordNotFoundError):
+            find_conversation_by_id("user", "1")
+        self.assertEqual(len(self._message_items()), 0)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+
+        # Storing the same instance again stores all messages
+        store_conversation("user", conv, threshold=1000)
+        self.assertEqual(len(find_conversation_by_id("user", "1").message_map), 3)
+        delete_conversation_by_user_id("user")
+        self.assertEqual(len(self.table.scan()["Items"]), 0)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+
+    def test_update_feedback(self):
+        store_conversation("user", _conversation())
+
+        response = update_feedback(
+            "user",
+            "1",
+            "b",
+            FeedbackModel(thumbs_up=True, category="Good", comment=""),
+        )
+        # Same as updating the message map
+        self.assertIn("Message", response["Attributes"])
+        found = find_conversation_by_id("user", "1")
+        self.assertTrue(found.message_map["b"].feedback.thumbs_up)  # type: ignore
+        self.assertIsNone(found.message_map["a"].feedback)
+
+    def test_migrate_message_map(self):
+        # Stored in the former format, with the message map in S3
+        store_conversation(
+            "user", _conversation(), threshold=1, storage_mode="message_map"
+        )
+        self.assertEqual(len(self._message_items()), 0)
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["a"].content[0].body, "Hello")
+
+        update_feedback(
+            "user",
+            "1",
+            "b",
+            FeedbackModel(thumbs_up=True, category="Good", comment=""),
+        )
+        self.assertEqual(len(self._message_items()), 3)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+        found = find_conversation_by_id("user", "1")
+        self.assertTrue(found.message_map["b"].feedback.thumbs_up)  # type: ignore
+        # The model of `system` is still listed
+        item = self.table.get_item(Key={"PK": "user", "SK": "user#CONV#1"})["Item"]
+        self.assertIn("system", json.loads(item["MessageMap"]))
+
+    def test_lazy_loading(self):
+        conv = _conversation()
+        # Another branch, stored in S3
+        conv.message_map["a"].children.append("x")
+        conv.message_map["x"] = _message("a", LARGE_BODY, [])
+        store_conversation("user", conv, threshold=1000)
+
+        found = find_conversation_by_id("user", "1")
+        message_map = found.message_map
+        assert isinstance(message_map, LazyMessageMap)
+        self.assertEqual(len(message_map), 4)
+        self.assertIn("x", message_map)
+        self.assertEqual(message_map.parsed_items(), [])
+
+        # Only the messages on the path are parsed, and the part is not fetched
+        with patch.object(self.s3, "get_object", wraps=self.s3.get_object) as get:
+            messages = trace_to_root("b", message_map)
+            self.assertEqual([m.content[0].body for m in messages], ["", "Hello", "Hi"])
+            self.assertEqual(
+                {k for k, _ in message_map.parsed_items()}, {"system", "a", "b"}
+            )
+            get.assert_not_called()
+
+            # Only the changed message is stored
+            message_map["b"].content[0].body = "Hi!"
+            with self.assertLogs("app.repositories.conversation", "INFO") as logs:
+                store_conversation("user", found, threshold=1000)
+            self.assertIn("Stored 1 of 4 messages as items", "\n".join(logs.output))
+
+            self.assertEqual(message_map["x"].content[0].body, LARGE_BODY)
+            get.assert_called_once()
+        with self.assertLogs("app.repositories.conversation", "INFO") as logs:
+            store_conversation("user", found, threshold=1000)
+        self.assertIn("Stored 0 of 4 messages as items", "\n".join(logs.output))
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["b"].content[0].body, "Hi!")
+        self.assertEqual(found.message_map["x"].content[0].body, LARGE_BODY)
+
+    def test_dump_found_conversation(self):
+        conv = _conversation()
+        store_conversation("user", conv)
+
+        found = find_conversation_by_id("user", "1")
+        assert isinstance(found.message_map, LazyMessageMap)
+        self.assertEqual(found.model_dump(), conv.model_dump())
+        self.assertEqual(
+            json.loads(found.model_dump_json()), json.loads(conv.model_dump_json())
+        )
+
+    def test_content_blobs(self):
+        data = bytes(range(256)) * 40
+        body = base64.b64encode(data).decode("utf-8")
+        for conversation_id in ("1", "2"):
+            conv = _conversation()
+            conv.id = conversation_id
+            conv.message_map["b"].content.append(
+                ContentModel(
+                    content_type="image",
+                    body=body,
+                    media_type="image/png",
+                    file_name=None,
+                )
+            )
+            store_conversation("user", conv)
+            # Offloaded also in the instance
+            self.assertEqual(conv.message_map["b"].content[1].body, "")
+
+        # Stored once for both conversations
+        objects = self.s3.list_objects_v2(Bucket=BUCKET_NAME)["Contents"]
+        self.assertEqual(len(objects), 1)
+        self.assertTrue(objects[0]["Key"].startswith("user/blobs/"))
+
+        clear_content_blob_cache()
+        found = find_conversation_by_id("user", "2")
+        content = found.message_map["b"].content[1]
+        self.assertEqual(content.body, "")
+        key = objects[0]["Key"]
+        self.assertEqual(content.blob_key, key)
+        self.assertEqual(load_content_bytes(content), data)
+        self.assertEqual(load_content_body(content), body)
+
+        # Not deleted with a conversation, since shared
+        delete_conversation_by_id("user", "1")
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 1)
+        # Deleted with the last conversation referring to it
+        delete_conversation_by_id("user", "2")
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+        self.assertNotIn(
+            "Item",
+            self.table.get_item(
+                Key={"PK": "user", "SK": compose_content_blob_ref_id("user", key)}
+            ),
+        )
+
+    def test_untracked_content_blobs(self):
+        data = bytes(range(256)) * 40
+        # Stored before references were tracked, possibly referred to by others
+        key = compose_content_blob_key("user", data)
+        self.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=data)
+
+        conv = _conversation()
+        conv.message_map["b"].content.append(
+            ContentModel(
+                content_type="image",
+                body=base64.b64encode(data).decode("utf-8"),
+                media_type="image/png",
+                file_name=None,
+            )
+        )
+        store_conversation("user", conv)
+        self.assertEqual(conv.message_map["b"].content[1].blob_key, key)
+
+        delete_conversation_by_id("user", "1")
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 1)
+        delete_conversation_by_user_id("user")
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+        self.assertEqual(
+            self.table.query(KeyConditionExpression=Key("PK").eq("user"))["Count"], 0
+        )
+
+    def test_compressed_messages(self):
+        conv = _conversation()
+        conv.message_map["b"].content[0].body = "Hi " * 1000
+        store_conversation("user", conv, threshold=1000)
+        item = self.table.get_item(Key={"PK": "user", "SK": "user#CONV_MSG#1#b"})
+        # Stored inline as it fits the threshold once compressed
+        message = item["Item"]["Message"]
+        self.assertIsInstance(message, Binary)
+        self.assertLess(len(message.value), 1000)
+        self.assertEqual(self.s3.list_objects_v2(Bucket=BUCKET_NAME)["KeyCount"], 0)
+
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["b"].content[0].body, "Hi " * 1000)
+        # Unchanged once decompressed
+        with self.assertLogs("app.repositories.conversation", "INFO") as logs:
+            store_conversation("user", found, threshold=1000)
+        self.assertIn("Stored 0 of 3 messages as items", "\n".join(logs.output))
+
+        # In the former format, the whole message map is compressed
+        store_conversation("user", conv, storage_mode="message_map")
+        item = self.table.get_item(Key={"PK": "user", "SK": "user#CONV#1"})["Item"]
+        self.assertIsInstance(item["MessageMap"], Binary)
+        self.assertEqual(
+            find_conversation_by_user_id("user")[0].model, "claude-v3-haiku"
+        )
+        found = find_conversation_by_id("user", "1")
+        self.assertEqual(found.message_map["b"].content[0].body, "Hi " * 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,44 @@
+import sys
+import unittest
+import zlib
+
+sys.path.append(".")
+
+from app.repositories.message_codec import (
+    MESSAGE_CODEC_MAGIC,
+    decode_message_json,
+    encode_message_json,
+    get_encoded_size,
+)
+from boto3.dynamodb.types import Binary
+
+
+class TestMessageCodec(unittest.TestCase):
+    def test_small_json_is_kept_as_text(self):
+        text = '{"role": "user"}'
+        self.assertEqual(encode_message_json(text), text)
+        self.assertEqual(decode_message_json(text), text)
+
+    def test_round_trip(self):
+        text = '{"body": "' + "こんにちは" * 500 + '"}'
+        encoded = encode_message_json(text)
+        assert isinstance(encoded, bytes)
+        self.assertTrue(encoded.startswith(MESSAGE_CODEC_MAGIC))
+        self.assertLess(get_encoded_size(encoded), get_encoded_size(text))
+        self.assertEqual(decode_message_json(encoded), text)
+        # As found in DynamoDB
+        self.assertEqual(decode_message_json(Binary(encoded)), text)
+
+    def test_plain_json(self):
+        text = '{"body": "' + "a" * 2000 + '"}'
+        self.assertEqual(encode_message_json(text, compression="none"), text)
+        # e.g. S3 objects stored before
+        self.assertEqual(decode_message_json(text.encode("utf-8")), text)
+
+    def test_unsupported_version(self):
+        with self.assertRaises(ValueError):
+            decode_message_json(MESSAGE_CODEC_MAGIC + b"\x09" + zlib.compress(b"{}"))
+
+
+if __name__ == "__main__":
+    unittest.main()
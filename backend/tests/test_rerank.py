@@ -0,0 +1,86 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+import numpy as np
+from app.rerank import (
+    estimate_tokens,
+    lexical_scores,
+    mmr_order,
+    rerank_search_results,
+)
+from app.vector_search import SearchResult, decode_vector
+
+
+def _result(rank: int, content: str, embedding=None) -> SearchResult:
+    return SearchResult(
+        bot_id="bot", content=content, source=f"s{rank}", rank=rank, embedding=embedding
+    )
+
+
+class TestRerank(unittest.TestCase):
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        self.assertEqual(estimate_tokens("abcd" * 10), 10)
+        # Non-ASCII characters count one token each
+        self.assertEqual(estimate_tokens("日本語"), 3)
+
+    def test_lexical_scores(self):
+        scores = lexical_scores(
+            "Pricing of Bedrock", ["bedrock pricing", "bedrock", "other"]
+        )
+        np.testing.assert_allclose(scores, [2 / 3, 1 / 3, 0])
+        np.testing.assert_allclose(lexical_scores("?", ["a"]), [0])
+
+    def test_mmr_order_drops_duplicates(self):
+        relevance = np.array([1.0, 0.9, 0.8])
+        similarity = np.array(
+            [
+                [1.0, 0.99, 0.1],
+                [0.99, 1.0, 0.1],
+                [0.1, 0.1, 1.0],
+            ]
+        )
+        self.assertEqual(mmr_order(relevance, similarity), [0, 2])
+
+    def test_rerank_keeps_ranks_and_removes_duplicates(self):
+        results = [
+            _result(0, "alpha beta", [1.0, 0.0]),
+            _result(1, "alpha beta copy", [1.0, 0.001]),
+            _result(2, "gamma", [0.0, 1.0]),
+        ]
+        reranked = rerank_search_results("alpha", results)
+        self.assertEqual([r.rank for r in reranked], [0, 2])
+
+    def test_rerank_without_embeddings(self):
+        # e.g. results of Bedrock Knowledge Base
+        content = "The quick brown fox jumps over the lazy dog. " * 5
+        results = [
+            _result(0, content),
+            _result(1, content + "!"),
+            _result(2, "Completely different text about databases."),
+        ]
+        reranked = rerank_search_results("fox", results)
+        self.assertEqual([r.rank for r in reranked], [0, 2])
+
+    def test_rerank_token_budget(self):
+        results = [_result(i, "word " * 40, list(np.eye(3)[i])) for i in range(3)]
+        # 50 tokens each
+        reranked = rerank_search_results("word", results, max_context_tokens=120)
+        self.assertEqual([r.rank for r in reranked], [0, 1])
+        # The top result is always kept
+        reranked = rerank_search_results("word", results, max_context_tokens=10)
+        self.assertEqual([r.rank for r in reranked], [0])
+
+    def test_embedding_not_serialized(self):
+        result = _result(0, "content", [0.5, 0.25])
+        self.assertNotIn("embedding", result.model_dump())
+        self.assertNotIn("0.25", repr(result))
+
+    def test_decode_vector(self):
+        self.assertEqual(decode_vector("[0.5,-1,2.25]"), [0.5, -1.0, 2.25])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import sys
+import unittest
+from unittest.mock import patch
+
+sys.path.append(".")
+
+from app.response_cache import CachedResponse, ResponseCache, compose_bot_version
+from app.vector_search import SearchResult
+from tests.test_repositories.utils.bot_factory import create_test_private_bot
+
+
+def _response(answer: str) -> CachedResponse:
+    return CachedResponse(
+        answer=answer,
+        used_results=[
+            SearchResult(bot_id="bot", content="content", source="s3://b/k", rank=0)
+        ],
+        price=0.01,
+    )
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_similar_query_hits(self):
+        cache = ResponseCache(max_entries=10, ttl_sec=60, similarity_threshold=0.95)
+        self.assertIsNone(cache.get("v1", [1.0, 0.0]))
+        cache.put("v1", [1.0, 0.0], _response("answer"))
+
+        cached = cache.get("v1", [0.99, 0.05])
+        assert cached is not None
+        self.assertEqual(cached.answer, "answer")
+        self.assertEqual(cached.used_results[0].source, "s3://b/k")
+        # Not similar enough
+        self.assertIsNone(cache.get("v1", [0.5, 0.5]))
+
+        stats = cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 2)
+
+    def test_most_similar_entry(self):
+        cache = ResponseCache(max_entries=10, ttl_sec=60, similarity_threshold=0.9)
+        cache.put("v1", [1.0, 0.0], _response("a"))
+        cache.put("v1", [0.0, 1.0], _response("b"))
+        cached = cache.get("v1", [0.1, 1.0])
+        assert cached is not None
+        self.assertEqual(cached.answer, "b")
+
+    def test_version_isolation(self):
+        cache = ResponseCache(max_entries=10, ttl_sec=60)
+        cache.put("v1", [1.0, 0.0], _response("answer"))
+        self.assertIsNone(cache.get("v2", [1.0, 0.0]))
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, ttl_sec=60)
+        cache.put("v1", [1.0, 0.0, 0.0], _response("a"))
+        cache.put("v1", [0.0, 1.0, 0.0], _response("b"))
+        cache.get("v1", [1.0, 0.0, 0.0])
+        cache.put("v2", [0.0, 0.0, 1.0], _response("c"))
+
+        self.assertIsNone(cache.get("v1", [0.0, 1.0, 0.0]))
+        self.assertIsNotNone(cache.get("v1", [1.0, 0.0, 0.0]))
+        self.assertIsNotNone(cache.get("v2", [0.0, 0.0, 1.0]))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_ttl(self):
+        cache = ResponseCache(max_entries=10, ttl_sec=60)
+        with patch("app.response_cache.time.monotonic", return_value=0):
+            cache.put("v1", [1.0, 0.0], _response("answer"))
+        with patch("app.response_cache.time.monotonic", return_value=61):
+            self.assertIsNone(cache.get("v1", [1.0, 0.0]))
+        self.assertEqual(cache.stats()["size"], 0)
+
+    def test_bot_version(self):
+        bot = create_test_private_bot("bot1", False, "user1")
+        version = compose_bot_version(bot, "claude-v3-haiku")
+        self.assertEqual(version, compose_bot_version(bot, "claude-v3-haiku"))
+        self.assertNotEqual(version, compose_bot_version(bot, "claude-v3-sonnet"))
+
+        # Usage does not change the version
+        bot.last_used_time += 100
+        self.assertEqual(version, compose_bot_version(bot, "claude-v3-haiku"))
+
+        bot.instruction = "Another instruction"
+        self.assertNotEqual(version, compose_bot_version(bot, "claude-v3-haiku"))
+        bot = create_test_private_bot("bot1", False, "user1")
+        bot.sync_last_exec_id = "another-sync"
+        self.assertNotEqual(version, compose_bot_version(bot, "claude-v3-haiku"))
+        bot = create_test_private_bot("bot1", False, "user1")
+        bot.generation_params.temperature = 0.9
+        self.assertNotEqual(version, compose_bot_version(bot, "claude-v3-haiku"))
+
+
+if __name__ == "__main__":
+    unittest.main()
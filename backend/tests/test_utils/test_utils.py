@@ -39,6 +39,24 @@ class TestUtils(unittest.TestCase):
 
         assert reg == "us-west-2"
 
+    def test_get_bedrock_client_reused_per_region(self):
+        from app.utils import get_bedrock_client
+
+        client = get_bedrock_client("us-east-2")
+        assert get_bedrock_client("us-east-2") is client
+        assert get_bedrock_client("us-west-2") is not client
+
+        config = client.meta.config
+        assert config.tcp_keepalive is True
+        assert config.max_pool_connections >= 10
+
+    def test_get_bedrock_region(self):
+        from app.utils import BEDROCK_REGION_JSON, get_bedrock_region
+
+        for model_name, region in BEDROCK_REGION_JSON.items():
+            assert get_bedrock_region(model_name) == region
+        assert get_bedrock_region("unknown") == BEDROCK_REGION_JSON["default"]
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,48 @@
+import sys
+import unittest
+
+sys.path.append(".")
+
+from app.vector_index import (
+    MAX_EF_SEARCH,
+    _quote_bot_id,
+    compose_bot_index_name,
+    compose_search_settings,
+)
+
+
+class TestVectorIndex(unittest.TestCase):
+    def test_compose_bot_index_name(self):
+        self.assertEqual(
+            compose_bot_index_name("01HXYZABCDEFGHJKMNPQRSTVWX"),
+            "idx_items_embedding_01hxyzabcdefghjkmnpqrstvwx",
+        )
+
+    def test_quote_bot_id(self):
+        self.assertEqual(_quote_bot_id("01HXYZ "), "'01HXYZ'")
+        with self.assertRaises(ValueError):
+            _quote_bot_id("x'; DROP TABLE items; --")
+
+    def test_search_settings_per_bot(self):
+        settings = compose_search_settings(20, strategy="per_bot")
+        self.assertEqual(settings["hnsw.ef_search"], "100")
+        self.assertEqual(settings["plan_cache_mode"], "force_custom_plan")
+        self.assertNotIn("hnsw.iterative_scan", settings)
+
+    def test_search_settings_iterative(self):
+        settings = compose_search_settings(
+            20, ef_search=100, probes=5, strategy="iterative"
+        )
+        self.assertEqual(settings["hnsw.ef_search"], "100")
+        self.assertEqual(settings["ivfflat.probes"], "5")
+        self.assertEqual(settings["hnsw.iterative_scan"], "strict_order")
+
+    def test_ef_search_covers_limit(self):
+        self.assertEqual(compose_search_settings(150)["hnsw.ef_search"], "150")
+        self.assertEqual(
+            compose_search_settings(5000)["hnsw.ef_search"], str(MAX_EF_SEARCH)
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,20 @@
 import sys
+import threading
+import time
 import unittest
+from unittest.mock import patch
 
 sys.path.append(".")
 
-from app.vector_search import SearchResult, filter_used_results
+import numpy as np
+from app import vector_search
+from app.vector_search import (
+    SearchResult,
+    compose_text_query,
+    encode_query_vector,
+    filter_used_results,
+    reciprocal_rank_fusion,
+)
 
 
 class TestVectorSearch(unittest.TestCase):
@@ -47,6 +58,52 @@ class TestVectorSearch(unittest.TestCase):
         used_results = filter_used_results(generated_text, search_results)
         self.assertEqual(len(used_results), 0)
 
+    def test_encode_query_vector(self):
+        embedding = [0.1, -0.0123456789012345, 1.0]
+        encoded = encode_query_vector(embedding)
+        self.assertEqual(encoded, "[0.100000001,-0.0123456791,1]")
+        values = np.array(encoded.strip("[]").split(","), dtype=np.float32)
+        np.testing.assert_array_equal(values, np.float32(embedding))
+
+    def test_compose_text_query(self):
+        self.assertEqual(
+            compose_text_query("What's the price of Model-X?"),
+            "'what' | 's' | 'the' | 'price' | 'of' | 'model' | 'x'",
+        )
+        self.assertEqual(compose_text_query("a A a"), "'a'")
+        self.assertIsNone(compose_text_query("?!"))
+
+    def test_reciprocal_rank_fusion(self):
+        vector = [("a",), ("b",), ("c",)]
+        text = [("c",), ("d",), ("a",)]
+        fused = reciprocal_rank_fusion([vector, text], key=lambda r: r[0], k=60)
+        # `a` and `c` are found by both, `a` ranks higher on average
+        self.assertEqual([r[0] for r in fused], ["a", "c", "b", "d"])
+
+    def test_reciprocal_rank_fusion_single_ranking(self):
+        ranking = [("a",), ("b",)]
+        self.assertEqual(
+            reciprocal_rank_fusion([ranking, []], key=lambda r: r[0]), ranking
+        )
+
+    def test_hybrid_search_waits_text_search_on_error(self):
+        text_search_done = threading.Event()
+
+        def text_search(*args):
+            time.sleep(0.1)
+            text_search_done.set()
+            return []
+
+        with patch.object(vector_search, "_text_search", text_search), patch.object(
+            vector_search, "_vector_search", side_effect=RuntimeError("failed")
+        ):
+            with self.assertRaises(RuntimeError):
+                vector_search._pgvector_search(
+                    "bot", 3, "price of model x", search_type="hybrid"
+                )
+            # Not left running after the search has failed
+            self.assertTrue(text_search_done.is_set())
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,80 @@
+import json
+import sys
+import time
+import unittest
+
+sys.path.append(".")
+
+from app.websocket_sender import WebsocketSender
+
+
+class FakeGatewayApi:
+    def __init__(self, latency_sec: float = 0.0, fail_after: int | None = None):
+        self.latency_sec = latency_sec
+        self.fail_after = fail_after
+        self.posted: list[dict] = []
+
+    def post_to_connection(self, ConnectionId: str, Data: bytes):
+        if self.fail_after is not None and len(self.posted) >= self.fail_after:
+            raise Exception("GoneException")
+        time.sleep(self.latency_sec)
+        self.posted.append(json.loads(Data))
+
+
+class TestWebsocketSender(unittest.TestCase):
+    def test_coalesce_and_order(self):
+        gatewayapi = FakeGatewayApi(latency_sec=0.01)
+        tokens = [f"token{i} " for i in range(200)]
+        with WebsocketSender(gatewayapi, "conn", flush_interval_sec=0.05) as sender:
+            for token in tokens:
+                sender.send_token(token)
+                time.sleep(0.0005)
+            sender.send(dict(status="STREAMING_END", completion="", stop_reason="end"))
+
+        posted = gatewayapi.posted
+        self.assertEqual(posted[-1]["status"], "STREAMING_END")
+        streaming = posted[:-1]
+        self.assertTrue(all(p["status"] == "STREAMING" for p in streaming))
+        self.assertEqual("".join(p["completion"] for p in streaming), "".join(tokens))
+        # The first token is posted alone
+        self.assertEqual(streaming[0]["completion"], tokens[0])
+        self.assertLess(len(streaming), len(tokens) / 5)
+        self.assertEqual(sender.post_count, len(posted))
+
+    def test_flush_by_size(self):
+        gatewayapi = FakeGatewayApi()
+        with WebsocketSender(
+            gatewayapi, "conn", flush_interval_sec=60, flush_bytes=10
+        ) as sender:
+            for _ in range(10):
+                sender.send_token("abcde")
+        completions = [p["completion"] for p in gatewayapi.posted]
+        self.assertEqual("".join(completions), "abcde" * 10)
+        self.assertTrue(all(len(c) <= 10 for c in completions))
+
+    def test_flush_by_time(self):
+        gatewayapi = FakeGatewayApi()
+        sender = WebsocketSender(gatewayapi, "conn", flush_interval_sec=0.01)
+        sender.send_token("first")
+        sender.send_token("second")
+        # Posted without waiting for more tokens nor closing
+        time.sleep(0.2)
+        self.assertEqual(
+            [p["completion"] for p in gatewayapi.posted], ["first", "second"]
+        )
+        sender.close()
+
+    def test_failed_post(self):
+        gatewayapi = FakeGatewayApi(fail_after=1)
+        with WebsocketSender(gatewayapi, "conn", flush_interval_sec=0.01) as sender:
+            sender.send_token("first")
+            time.sleep(0.05)
+            sender.send_token("second")
+            sender.send(dict(status="STREAMING_END", completion="", stop_reason="end"))
+        # The rest is dropped, and closing does not raise
+        self.assertEqual(len(gatewayapi.posted), 1)
+        self.assertIsNotNone(sender.error)
+
+
+if __name__ == "__main__":
+    unittest.main()
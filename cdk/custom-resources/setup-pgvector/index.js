@@ -12,6 +12,7 @@ const setUp = async (dbConfig) => {
     await client.query("CREATE EXTENSION IF NOT EXISTS pgcrypto;");
     await client.query("CREATE EXTENSION IF NOT EXISTS vector;");
     await client.query("DROP TABLE IF EXISTS items;");
+    await client.query("DROP TABLE IF EXISTS item_sources;");
     // NOTE: Cohere multi lingual embedding dimension is 1024
     // Ref: https://txt.cohere.com/introducing-embed-v3/
     await client.query(`CREATE TABLE IF NOT EXISTS items(
@@ -19,14 +20,21 @@ const setUp = async (dbConfig) => {
                          botid CHAR(26),
                          content text,
                          source text,
-                         embedding vector(1024));`);
-    // `lists` parameter controls the nubmer of clusters created during index building.
-    // Also it's important to choose the same index method as the one used in the query.
-    // Here we use L2 distance for the index method.
-    // See: https://txt.cohere.com/introducing-embed-v3/
-    await client.query(`CREATE INDEX idx_items_embedding ON items 
-                         USING ivfflat (embedding vector_l2_ops) WITH (lists = 100);`);
+                         embedding vector(1024),
+                         content_hash CHAR(64));`);
+    // ANN (HNSW) indexes are created by the embedding job once a bot has enough rows.
+    // See `backend/app/vector_index.py`.
     await client.query(`CREATE INDEX idx_items_botid ON items (botid);`);
+    // Full-text index used by hybrid search. See `backend/app/vector_search.py`.
+    await client.query(`CREATE INDEX idx_items_content_tsv ON items
+                         USING gin (to_tsvector('simple', content));`);
+    // Used by the embedding job to skip sources and chunks which have not changed.
+    await client.query(`CREATE INDEX idx_items_botid_content_hash ON items (botid, content_hash);`);
+    await client.query(`CREATE TABLE IF NOT EXISTS item_sources(
+                         botid CHAR(26),
+                         source text,
+                         fingerprint CHAR(64),
+                         PRIMARY KEY (botid, source));`);
 
     console.log("SQL execution successful.");
   } catch (err) {
@@ -232,6 +232,19 @@ export class BedrockChatStack extends cdk.Stack {
       bedrockKnowledgeBaseProject: bedrockKnowledgeBaseCodebuild.project,
     });
     documentBucket.grantRead(embedding.container.taskDefinition.taskRole);
+    // Caches of the sync, stored under `{user_id}/{bot_id}/_cache/`
+    documentBucket.grantPut(
+      embedding.container.taskDefinition.taskRole,
+      "*/_cache/url_content_types.json"
+    );
+    documentBucket.grantPut(
+      embedding.container.taskDefinition.taskRole,
+      "*/_cache/pdf_partition/*"
+    );
+    documentBucket.grantPut(
+      embedding.container.taskDefinition.taskRole,
+      "*/_cache/youtube_transcripts/*"
+    );
 
     vectorStore.allowFrom(embedding.taskSecurityGroup);
     vectorStore.allowFrom(embedding.removalHandler);
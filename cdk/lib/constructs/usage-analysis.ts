@@ -82,8 +82,20 @@ export class UsageAnalysis extends Construct {
         type: glue.Schema.struct([{ name: "S", type: glue.Schema.STRING }]),
       },
       {
+        // Stored as text, or as binary (base64 in exports) once compressed
         name: "MessageMap",
-        type: glue.Schema.struct([{ name: "S", type: glue.Schema.STRING }]),
+        type: glue.Schema.struct([
+          { name: "S", type: glue.Schema.STRING },
+          { name: "B", type: glue.Schema.STRING },
+        ]),
+      },
+      {
+        // Messages stored as individual items, encoded as `MessageMap`
+        name: "Message",
+        type: glue.Schema.struct([
+          { name: "S", type: glue.Schema.STRING },
+          { name: "B", type: glue.Schema.STRING },
+        ]),
       },
       {
         name: "IsLargeMessage",